@@ -1,39 +1,270 @@
 # app.py — Flask mini sosyal ağ (Py3.9 uyumlu)
-import os, uuid
+import os, re, io, sys, json, stat, time, queue, struct, bisect, socket, uuid, gzip, zlib, sqlite3, hashlib, functools, mimetypes, threading, contextlib, traceback
+from collections import Counter, OrderedDict, deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from typing import Optional
 from flask import (
     Flask, request, jsonify, render_template_string,
-    send_from_directory, session, redirect, url_for, Response, abort
+    send_from_directory, session, redirect, url_for, Response, abort, g
 )
 from werkzeug.utils import secure_filename
-from werkzeug.security import generate_password_hash, check_password_hash
+from werkzeug.security import generate_password_hash, check_password_hash, safe_join
 from flask_socketio import SocketIO, emit, join_room, leave_room, send
+from socketio import PubSubManager
 
 # YENİ EKLENTİLER: Veritabanı için
 from flask_sqlalchemy import SQLAlchemy
-from sqlalchemy import or_
+from sqlalchemy import or_, case, event
+from sqlalchemy.exc import IntegrityError
+
+# Opsiyonel: zstd yalnızca Python 3.14+ standart kütüphanesinde var
+try:
+    from compression import zstd
+except ImportError:
+    zstd = None
+
+# Opsiyonel: görsel türevleri (thumbnail) için Pillow. Yoksa orijinaller sunulur.
+try:
+    from PIL import Image, ImageOps
+except ImportError:
+    Image = ImageOps = None
+
+# Opsiyonel: arkadaş önerilerini seyrek matris çarpımıyla hesaplamak için.
+# Yoksa aynı sonuç saf Python ile hesaplanır.
+try:
+    import numpy as np
+    from scipy import sparse
+except ImportError:
+    np = sparse = None
 
 # -------------------- FLASK APP (route'lardan ÖNCE!) --------------------
 app = Flask(__name__)
 app.secret_key = os.environ.get("APP_SECRET", "DEGISTIR_ILK_CALISTIRMADA")
 
-# YENİ: SQLite veritabanı yapılandırması
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///site.db'
+# YENİ: SQLite veritabanı yapılandırması (DATABASE_URL ile başka dosya/sunucu; ör. bench/)
+app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get("DATABASE_URL", "sqlite:///site.db")
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+# Bağlantı havuzu: eşzamanlı isteklerin tümü bağlantı tutabilmeli (bkz. EŞZAMANLILIK MODU)
+DB_POOL_SIZE = int(os.environ.get("DB_POOL_SIZE", 5))
+DB_POOL_OVERFLOW = int(os.environ.get("DB_POOL_OVERFLOW", 10))
+app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {"pool_size": DB_POOL_SIZE, "max_overflow": DB_POOL_OVERFLOW}
 db = SQLAlchemy(app)  # SQLAlchemy nesnesi oluştur
 
+
+# -------------------- ÇOKLU WORKER (Socket.IO mesaj kuyruğu) --------------------
+# Birden fazla süreç/host çalıştırıldığında emit(..., room=sid) başka süreçteki
+# bağlantıya ancak ortak bir mesaj kuyruğu üzerinden ulaşır. SOCKETIO_MESSAGE_QUEUE:
+#   boş              -> tek süreç (varsayılan)
+#   sqlite[:///yol]  -> aynı makinedeki süreçler için SQLite tablosu üzerinden yayın
+#   redis://, amqp://, kafka://, zmq+tcp:// -> Flask-SocketIO'nun kendi yöneticileri
+# Canlı yayın kaydı için ayrıca LIVE_STATE_BACKEND=sqlite ayarlanmalıdır. Örnek:
+#   LIVE_STATE_BACKEND=sqlite SOCKETIO_MESSAGE_QUEUE=sqlite PORT=8081 python appcloud.py
+#   LIVE_STATE_BACKEND=sqlite SOCKETIO_MESSAGE_QUEUE=sqlite PORT=8082 python appcloud.py
+# ve önlerinde yapışkan oturumlu (ör. nginx ip_hash) bir yük dengeleyici.
+SOCKETIO_MESSAGE_QUEUE = os.environ.get("SOCKETIO_MESSAGE_QUEUE", "")
+LIVE_STATE_PATH = os.environ.get("LIVE_STATE_PATH", os.path.join(app.instance_path, "live_state.db"))
+
+
+def open_local_sqlite(path):
+    """Süreçler arası paylaşılan küçük SQLite dosyası (WAL, otomatik commit)."""
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    conn = sqlite3.connect(path, timeout=5, isolation_level=None, check_same_thread=False)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    return conn
+
+
+class SqliteQueueManager(PubSubManager):
+    """Socket.IO mesajlarını aynı makinedeki süreçlere bir SQLite tablosu üzerinden dağıtır."""
+    name = 'sqlite'
+
+    def __init__(self, path, channel='flask-socketio', write_only=False, logger=None,
+                 poll_interval=0.01, retention=30):
+        super().__init__(channel=channel, write_only=write_only, logger=logger)
+        self.path = path
+        self.poll_interval = poll_interval
+        self.retention = retention  # sn; okunmuş sayılan mesajların saklanma süresi
+        self._conn = None
+        self._pid = None
+
+    def _db(self):
+        if self._pid != os.getpid():  # fork sonrası bağlantı paylaşılmaz
+            self._conn = open_local_sqlite(self.path)
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS socketio_bus (id INTEGER PRIMARY KEY AUTOINCREMENT, "
+                "channel TEXT NOT NULL, created REAL NOT NULL, payload TEXT NOT NULL)")
+            self._pid = os.getpid()
+        return self._conn
+
+    def _publish(self, data):
+        self._db().execute("INSERT INTO socketio_bus (channel, created, payload) VALUES (?, ?, ?)",
+                           (self.channel, time.time(), json.dumps(data)))
+
+    def _listen(self):
+        conn = self._db()
+        last = conn.execute("SELECT COALESCE(MAX(id), 0) FROM socketio_bus").fetchone()[0]
+        last_purge = time.time()
+        while True:
+            rows = conn.execute("SELECT id, payload FROM socketio_bus WHERE id > ? AND channel = ? ORDER BY id",
+                                (last, self.channel)).fetchall()
+            for row_id, payload in rows:
+                last = row_id
+                yield payload
+            if time.time() - last_purge > self.retention:
+                last_purge = time.time()
+                conn.execute("DELETE FROM socketio_bus WHERE created < ?", (last_purge - self.retention,))
+            self.server.sleep(self.poll_interval)
+
+
+def socketio_queue_options():
+    if not SOCKETIO_MESSAGE_QUEUE:
+        return {}
+    if SOCKETIO_MESSAGE_QUEUE == "sqlite" or SOCKETIO_MESSAGE_QUEUE.startswith("sqlite:"):
+        path = SOCKETIO_MESSAGE_QUEUE.partition(":///")[2] or LIVE_STATE_PATH
+        return {"client_manager": SqliteQueueManager(path)}
+    return {"message_queue": SOCKETIO_MESSAGE_QUEUE}
+
+
 # SocketIO'yu başlat
-socketio = SocketIO(app, cors_allowed_origins="*")
+socketio = SocketIO(app, cors_allowed_origins="*", **socketio_queue_options())
+
+
+# -------------------- EŞZAMANLILIK MODU (eventlet tpool) --------------------
+# socketio.run eventlet ile tek OS iş parçacığında çalışır (monkey_patch yok). SQLite
+# çağrıları ve yükleme yazımları C seviyesinde bloklar; o sırada tüm yeşil iş
+# parçacıkları (sinyalleşme, medya akışı) durur. IO_MODE:
+#   inline -> her şey döngüde (varsayılan, eski davranış)
+#   tpool  -> SQLAlchemy'nin sqlite bağlantıları (her DBAPI çağrısı) ve yükleme yazımları
+#             eventlet.tpool iş parçacıklarında çalışır; döngü bu sırada başka işlere döner.
+# Boyutlandırma: IO_THREADS tpool iş parçacığı sayısıdır. DB_POOL_SIZE + DB_POOL_OVERFLOW
+# eşzamanlı istek sayısını karşılamalı; tpool modunda bağlantı tutan istek beklerken
+# döngü başkasına geçer ve dolu havuzdaki checkout tüm döngüyü bekletir.
+# LOOP_WATCHDOG_MS: döngü bu süreden uzun bloklanırsa bloklayan yığın kaydedilir ve basılır
+# (/api/io). Doğrudan sqlite3 kullanan canlı durum/mesaj kuyruğu arka uçları kapsam dışıdır.
+IO_MODE = os.environ.get("IO_MODE", "inline")
+IO_THREADS = int(os.environ.get("IO_THREADS", 8))
+LOOP_WATCHDOG_MS = float(os.environ.get("LOOP_WATCHDOG_MS", 500))  # 0 = kapalı
+WATCHDOG_STACK_DEPTH = 12  # raporlanan en üst çerçeve sayısı
+
+LOOP_THREAD = threading.main_thread().ident  # socketio.run döngüsü ana iş parçacığında
+
+if IO_MODE == "tpool" and socketio.async_mode == "eventlet":
+    from eventlet import tpool
+
+    tpool.set_num_threads(IO_THREADS)
+else:
+    if IO_MODE != "inline":
+        print(f"IO_MODE={IO_MODE} bu kurulumda desteklenmiyor (async_mode={socketio.async_mode}); inline kullanılıyor.")
+    IO_MODE = "inline"
+    tpool = None
+
+
+def run_blocking(fn, *args, **kwargs):
+    """Bloklayan çağrıyı tpool modunda iş parçacığında çalıştırır; döngü beklerken serbesttir.
+
+    Döngü dışındaki gerçek iş parçacıkları (ör. DM yazıcısı) zaten döngüyü bloklamaz,
+    onlarda doğrudan çağrılır (tpool olayları yalnızca döngü iş parçacığında beklenebilir).
+    """
+    if tpool is None or threading.get_ident() != LOOP_THREAD:
+        return fn(*args, **kwargs)
+    return tpool.execute(fn, *args, **kwargs)
+
+
+class _BlockingProxy:
+    """sqlite3 bağlantısı/imleci sarmalayıcısı: her metot çağrısı run_blocking üzerinden."""
+    __slots__ = ("_obj",)
+
+    def __init__(self, obj):
+        object.__setattr__(self, "_obj", obj)
+
+    def __getattr__(self, name):
+        attr = getattr(self._obj, name)
+        if not callable(attr):
+            return attr
+
+        def call(*args, **kwargs):
+            result = run_blocking(attr, *args, **kwargs)
+            return _BlockingProxy(result) if isinstance(result, sqlite3.Cursor) else result
+        return call
+
+    def __setattr__(self, name, value):
+        setattr(self._obj, name, value)
+
+
+if tpool is not None:
+    with app.app_context():
+        if db.engine.dialect.name == "sqlite":
+            @event.listens_for(db.engine, "do_connect")
+            def _tpool_connect(dialect, conn_rec, cargs, cparams):
+                return _BlockingProxy(run_blocking(sqlite3.connect, *cargs, **cparams))
+
+            # SQLAlchemy ilk bağlantı olaylarını bir OS kilidi altında çalıştırır; run_blocking
+            # orada döngüye dönerse eşzamanlı ilk bağlantılar aynı iş parçacığında kilitlenir.
+            # İlk bağlantıyı şimdi, tek başına aç.
+            with db.engine.connect():
+                pass
+
+
+class LoopWatchdog:
+    """Döngüde nabız görevi, ayrı OS iş parçacığında bekçi: uzun blokları yığınıyla kaydeder."""
+
+    def __init__(self, threshold_ms, keep=20):
+        self.threshold = threshold_ms / 1000
+        self.beat = None
+        self.loop_ident = None
+        self.reports = deque(maxlen=keep)
+        self.counters = Counter()
+        self.longest_ms = 0.0
+
+    def _pulse(self):
+        self.loop_ident = threading.get_ident()
+        while True:
+            self.beat = before = time.monotonic()
+            socketio.sleep(self.threshold / 4)
+            gap = time.monotonic() - before - self.threshold / 4
+            if gap >= self.threshold:
+                self.counters["stalls"] += 1
+                self.longest_ms = max(self.longest_ms, gap * 1000)
+                if self.reports and self.reports[-1]["beat"] == before:
+                    self.reports[-1]["blocked_ms"] = round(gap * 1000, 1)  # kesin süre
+
+    def _watch(self):
+        reported = None
+        while True:
+            time.sleep(self.threshold / 4)
+            beat = self.beat
+            if beat is None or beat == reported or time.monotonic() - beat < self.threshold * 1.25:
+                continue
+            reported = beat  # aynı duraklama bir kez raporlanır
+            frame = sys._current_frames().get(self.loop_ident)
+            stack = traceback.format_stack(frame)[-WATCHDOG_STACK_DEPTH:] if frame else []
+            blocked_ms = round((time.monotonic() - beat) * 1000, 1)
+            self.reports.append({"beat": beat, "at": time.time(), "blocked_ms": blocked_ms, "stack": stack})
+            print(f"Olay döngüsü en az {blocked_ms} ms bloklandı:\n" + "".join(stack))
+
+    def start(self):
+        socketio.start_background_task(self._pulse)
+        threading.Thread(target=self._watch, name="loop-watchdog", daemon=True).start()
+
+    def stats(self):
+        return {"threshold_ms": self.threshold * 1000, "counters": dict(self.counters),
+                "longest_ms": round(self.longest_ms, 1),
+                "reports": [{k: v for k, v in r.items() if k != "beat"} for r in list(self.reports)]}
+
+
+WATCHDOG = LoopWatchdog(LOOP_WATCHDOG_MS) if LOOP_WATCHDOG_MS > 0 else None
 
 # -------------------- YÜKLEME KLASÖRLERİ & LİMİTLER --------------------
 BASE_DIR = os.path.abspath(os.getcwd())
 UPLOAD_DIR = os.path.join(BASE_DIR, "uploads")
 AVATAR_DIR = os.path.join(UPLOAD_DIR, "avatars")
 MEDIA_DIR = os.path.join(UPLOAD_DIR, "media")  # video & ses
+DERIVED_DIR = os.path.join(UPLOAD_DIR, "derived")  # küçültülmüş görsel türevleri
 
 os.makedirs(UPLOAD_DIR, exist_ok=True)
 os.makedirs(AVATAR_DIR, exist_ok=True)
 os.makedirs(MEDIA_DIR, exist_ok=True)
+os.makedirs(DERIVED_DIR, exist_ok=True)
 
 # Maksimum yükleme boyutu (örn. 200 MB)
 app.config['MAX_CONTENT_LENGTH'] = 200 * 1024 * 1024
@@ -42,6 +273,13 @@ IMAGE_EXT = {".jpg", ".jpeg", ".png", ".gif", ".webp"}
 VIDEO_EXT = {".mp4", ".webm", ".ogg", ".m4v", ".mov"}  # MP4 dahil
 AUDIO_EXT = {".mp3", ".wav", ".m4a", ".ogg"}
 
+# /media için uzantı -> mimetype (ogg video olarak sunulur)
+MEDIA_MIMETYPES = {
+    ".mp4": "video/mp4", ".m4v": "video/mp4", ".webm": "video/webm", ".ogg": "video/ogg",
+    ".mov": "video/quicktime",
+    ".mp3": "audio/mpeg", ".wav": "audio/wav", ".m4a": "audio/mp4",
+}
+
 
 def is_image(path): return os.path.splitext(path)[1].lower() in IMAGE_EXT
 
@@ -57,7 +295,7 @@ def is_audio(path): return os.path.splitext(path)[1].lower() in AUDIO_EXT
 class User(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     username = db.Column(db.String(80), unique=True, nullable=False, index=True)
-    password_hash = db.Column(db.String(128), nullable=False)
+    password_hash = db.Column(db.String(256), nullable=False)  # scrypt özetleri ~162 karakter
     bio = db.Column(db.String(500))
     avatar = db.Column(db.String(100))
     privacy = db.Column(db.String(10), default='friends')  # 'friends' veya 'public'
@@ -113,6 +351,23 @@ class Friendship(db.Model):
     __table_args__ = (db.UniqueConstraint('user_id', 'friend_id', name='_user_friend_uc'),)
 
 
+class FriendSuggestion(db.Model):
+    __tablename__ = 'friend_suggestion'
+    # Önceden hesaplanmış "tanıyor olabileceğin kişiler" (kullanıcı başına ilk SUGGEST_TOP_K)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True)
+    candidate_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True)
+    mutual = db.Column(db.Integer, nullable=False)  # ortak arkadaş sayısı
+    rank = db.Column(db.Integer, nullable=False)
+
+    __table_args__ = (db.Index('ix_friend_suggestion_rank', 'user_id', 'rank'),)
+
+
+class SuggestionDirty(db.Model):
+    __tablename__ = 'suggestion_dirty'
+    # Kabul edilmiş arkadaşlıkları değişen kullanıcılar; bir sonraki tazelemede yeniden hesaplanır
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True)
+
+
 class DirectMessage(db.Model):
     __tablename__ = 'direct_message'
     id = db.Column(db.Integer, primary_key=True)
@@ -123,13 +378,89 @@ class DirectMessage(db.Model):
     sender = db.relationship('User', foreign_keys=[from_user_id], backref='sent_dms')
     recipient = db.relationship('User', foreign_keys=[to_user_id], backref='received_dms')
 
+    # Keyset sayfalama: (gönderen, alıcı, id) aralık taraması (bkz. dm_page)
+    __table_args__ = (db.Index('ix_direct_message_pair_id', 'from_user_id', 'to_user_id', 'id'),)
+
+
+class DirectMessageRead(db.Model):
+    __tablename__ = 'direct_message_read'
+    # Okundu bilgisi: user_id, peer_id'den gelen mesajları last_read_id'ye kadar okudu
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    peer_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    last_read_id = db.Column(db.Integer, nullable=False, default=0)
+
+    __table_args__ = (db.UniqueConstraint('user_id', 'peer_id', name='_dm_read_uc'),)
+
+
+class Conversation(db.Model):
+    __tablename__ = 'conversation'
+    # DM konuşma özeti: kullanıcı çifti başına tek satır (user_low < user_high)
+    id = db.Column(db.Integer, primary_key=True)
+    user_low = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    user_high = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    last_message_id = db.Column(db.Integer, nullable=False)
+    last_at = db.Column(db.Float, nullable=False)
+    preview = db.Column(db.String(200), nullable=False, default="")
+    unread_low = db.Column(db.Integer, nullable=False, default=0)  # user_low'un okumadığı mesajlar
+    unread_high = db.Column(db.Integer, nullable=False, default=0)
+
+    __table_args__ = (db.UniqueConstraint('user_low', 'user_high', name='_conversation_pair_uc'),
+                      db.Index('ix_conversation_low_recent', 'user_low', 'last_message_id'),
+                      db.Index('ix_conversation_high_recent', 'user_high', 'last_message_id'))
+
+
+class Notification(db.Model):
+    __tablename__ = 'notification'
+    # Aynı (kullanıcı, tür, hedef) için okunmamış bildirim tektir; yeni olaylar count'u artırır
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)  # bildirimi alan
+    kind = db.Column(db.String(20), nullable=False)  # friend_request, friend_accept, comment, like, dm
+    actor_id = db.Column(db.Integer, db.ForeignKey('user.id'))  # son olayı yapan (anonim beğenide boş)
+    target_id = db.Column(db.Integer)  # gönderi id'si (comment/like) ya da kullanıcı id'si
+    count = db.Column(db.Integer, nullable=False, default=1)
+    read = db.Column(db.Boolean, nullable=False, default=False)
+    updated_at = db.Column(db.Float, nullable=False)
+
+    actor = db.relationship('User', foreign_keys=[actor_id])
+
+    __table_args__ = (db.Index('ix_notification_user_unread', 'user_id', 'read', 'kind', 'target_id'),
+                      db.Index('ix_notification_user_id', 'user_id', 'id'))
 
-# YENİ EKLENTİ: Aktif canlı yayınları takip etmek için (in-memory kalır)
-LIVE_STREAMS = {}  # {"username": "socketio_room_id"}
+
+class NotificationCounter(db.Model):
+    __tablename__ = 'notification_counter'
+    # Okunmamış bildirim sayısı; tablo taramadan okunur
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True)
+    unread = db.Column(db.Integer, nullable=False, default=0)
+
+
+class ChangeLog(db.Model):
+    __tablename__ = 'change_log'
+    # Senkronizasyon akışı: id monoton imleçtir (AUTOINCREMENT, silinen id tekrar verilmez).
+    # Her satır varlığın o anki tam görüntüsü (upsert) ya da silme kaydıdır (delete).
+    id = db.Column(db.Integer, primary_key=True)
+    entity = db.Column(db.String(12), nullable=False)  # user, post, comment, friendship, resync
+    entity_id = db.Column(db.Integer, nullable=False)
+    op = db.Column(db.String(8), nullable=False)  # upsert, delete, resync
+    owner_id = db.Column(db.Integer, nullable=False)  # gizlilik: gönderi sahibi; arkadaşlıkta isteği gönderen; kullanıcının kendisi
+    peer_id = db.Column(db.Integer)  # arkadaşlıkta isteği alan
+    data = db.Column(db.Text)  # JSON
+    created_at = db.Column(db.Float, nullable=False)
+
+    __table_args__ = (db.Index('ix_change_log_entity', 'entity', 'entity_id', 'id'),
+                      {'sqlite_autoincrement': True})
 
 
 # -------------------- YARDIMCI VERİTABANI FONKSİYONLARI --------------------
 
+def ensure_indexes():
+    """create_all() var olan tablolara indeks eklemez; sonradan tanımlananları burada kur."""
+    for model in (DirectMessage,):
+        for index in model.__table__.indexes:
+            index.create(bind=db.engine, checkfirst=True)
+
+
 def get_user_by_username(username: Optional[str]) -> Optional[User]:
     if not username: return None
     return User.query.filter_by(username=username).first()
@@ -194,6 +525,269 @@ def can_view_posts(owner_id: int, viewer_id: Optional[int]) -> bool:
     return get_friendship_status(viewer_id, owner_id) == 'friend'
 
 
+def visible_owner_ids(viewer_id: Optional[int], owner_ids) -> set:
+    """can_view_posts'un toplu hâli: sabit sayıda sorguyla görülebilen sahiplerin id'leri."""
+    owner_ids = set(owner_ids)
+    if not owner_ids: return set()
+    privacy = dict(db.session.query(User.id, User.privacy).filter(User.id.in_(owner_ids)))
+    visible = {uid for uid, p in privacy.items() if p == "public" or uid == viewer_id}
+    restricted = set(privacy) - visible
+    if viewer_id is not None and restricted:
+        for uid, friend_id in db.session.query(Friendship.user_id, Friendship.friend_id).filter(
+                Friendship.status == 'accepted',
+                or_((Friendship.user_id == viewer_id) & Friendship.friend_id.in_(restricted),
+                    (Friendship.friend_id == viewer_id) & Friendship.user_id.in_(restricted))):
+            visible.add(friend_id if uid == viewer_id else uid)
+    return visible
+
+
+def visible_posts_clause(viewer_id: Optional[int]):
+    """can_view_posts'un SQL hâli: Post sorgusuna filtre olarak eklenir (sayfalamada satır kaybı olmaz)."""
+    clause = Post.user_id.in_(db.select(User.id).where(User.privacy == "public"))
+    if viewer_id is None:
+        return clause
+    accepted = Friendship.status == 'accepted'
+    return or_(clause, Post.user_id == viewer_id,
+               Post.user_id.in_(db.select(Friendship.friend_id).where(Friendship.user_id == viewer_id, accepted)),
+               Post.user_id.in_(db.select(Friendship.user_id).where(Friendship.friend_id == viewer_id, accepted)))
+
+
+# -------------------- DEĞİŞİKLİK AKIŞI (senkronizasyon imleci) --------------------
+# Kullanıcı (profil alanları), gönderi (beğeni sayısı dahil), yorum ve arkadaşlık yazımları aynı işlem içinde
+# change_log'a eklenir; istemci /api/changes?since=<imleç> ile yalnızca o imleçten
+# sonrasını çeker. Her satır varlığın tam görüntüsü olduğundan aynı varlığın eski
+# satırları gereksizdir ve periyodik olarak silinir (yeni satırın id'si daha büyük
+# olduğundan hiçbir imleç değişikliği kaçırmaz). Görülemeyen satırlar atlandığından
+# görünürlük değişince (arkadaşlık kabulü/bitişi, gizlilik ayarı) sahip başına bir
+# "resync" kaydı yazılır: istemci o kullanıcının gönderilerini /api/posts?user= ile
+# yeniden çeker. Akıştan önce var olan satırlar açılışta backfill_changes() ile eklenir.
+CHANGES_PAGE = 200
+CHANGES_PAGE_MAX = 1000
+CHANGES_COMPACT_INTERVAL = float(os.environ.get("CHANGES_COMPACT_INTERVAL", 600))  # sn; 0 = kapalı
+
+
+def change_row(entity, entity_id, op, owner_id, peer_id=None, data=None):
+    return {"entity": entity, "entity_id": entity_id, "op": op, "owner_id": owner_id, "peer_id": peer_id,
+            "data": json.dumps(data) if data is not None else None, "created_at": time.time()}
+
+
+def friendship_change(row_id, user_id, friend_id, status=None):
+    """Arkadaşlık satırının görüntüsü; status None ise silme kaydı."""
+    if status is None:
+        return change_row("friendship", row_id, "delete", user_id, friend_id)
+    return change_row("friendship", row_id, "upsert", user_id, friend_id,
+                      {"user_id": user_id, "friend_id": friend_id, "status": status})
+
+
+def resync_change(owner_id, peer_id=None):
+    """Sahibin gönderilerinin görünürlüğü değişti; peer_id verilirse yalnızca ona, yoksa herkese."""
+    return change_row("resync", owner_id, "resync", owner_id, peer_id, {"user_id": owner_id})
+
+
+def friendship_resync(user_id, friend_id):
+    """Arkadaşlık kuruldu ya da bitti: iki taraf da karşısındakinin gönderilerini yeniden çeker."""
+    return [resync_change(user_id, friend_id), resync_change(friend_id, user_id)]
+
+
+def record_changes(rows):
+    """Eşleyici olaylarını atlayan toplu UPDATE/DELETE'ler için (commit çağırana kalır)."""
+    if rows:
+        db.session.execute(db.insert(ChangeLog), rows)
+
+
+def _log_change(connection, row):
+    connection.execute(ChangeLog.__table__.insert().values(**row))
+
+
+def _changed(target, *attrs):
+    state = db.inspect(target)
+    return any(state.attrs[attr].history.has_changes() for attr in attrs)
+
+
+def data_version():
+    """Ucuz sürüm damgası: izlenen herhangi bir yazımda artar (ETag'ler buna dayanır)."""
+    return db.session.query(db.func.max(ChangeLog.id)).scalar() or 0
+
+
+def _user_change(user):
+    return change_row("user", user.id, "upsert", user.id,
+                      data={"user_id": user.id, "privacy": user.privacy, "bio": user.bio,
+                            "avatar": user.get_avatar_path()})
+
+
+def _post_change(post):
+    return change_row("post", post.id, "upsert", post.user_id,
+                      data={"user_id": post.user_id, "html": post.html_content, "likes": post.likes or 0})
+
+
+def _comment_change(connection, comment):
+    owner_id = connection.execute(db.select(Post.user_id).where(Post.id == comment.post_id)).scalar()
+    return change_row("comment", comment.id, "upsert", owner_id,
+                      data={"post_id": comment.post_id, "user_id": comment.user_id, "html": comment.html_content})
+
+
+@event.listens_for(User, "after_insert")
+def _user_inserted(mapper, connection, target):
+    _log_change(connection, _user_change(target))
+
+
+@event.listens_for(User, "after_update")
+def _user_updated(mapper, connection, target):
+    if _changed(target, "privacy", "bio", "avatar"):
+        _log_change(connection, _user_change(target))
+    if _changed(target, "privacy"):
+        _log_change(connection, resync_change(target.id))
+
+
+@event.listens_for(Post, "after_insert")
+def _post_inserted(mapper, connection, target):
+    _log_change(connection, _post_change(target))
+
+
+@event.listens_for(Post, "after_update")
+def _post_updated(mapper, connection, target):
+    if _changed(target, "html_content", "likes"):
+        _log_change(connection, _post_change(target))
+
+
+@event.listens_for(Post, "after_delete")
+def _post_deleted(mapper, connection, target):
+    _log_change(connection, change_row("post", target.id, "delete", target.user_id))
+
+
+@event.listens_for(Comment, "after_insert")
+def _comment_inserted(mapper, connection, target):
+    _log_change(connection, _comment_change(connection, target))
+
+
+@event.listens_for(Comment, "after_update")
+def _comment_updated(mapper, connection, target):
+    if _changed(target, "html_content"):
+        _log_change(connection, _comment_change(connection, target))
+
+
+@event.listens_for(Comment, "after_delete")
+def _comment_deleted(mapper, connection, target):
+    change = _comment_change(connection, target)
+    _log_change(connection, change_row("comment", target.id, "delete", change["owner_id"]))
+
+
+@event.listens_for(Friendship, "after_insert")
+def _friendship_inserted(mapper, connection, target):
+    _log_change(connection, friendship_change(target.id, target.user_id, target.friend_id, target.status or "pending"))
+    if target.status == "accepted":
+        for row in friendship_resync(target.user_id, target.friend_id):
+            _log_change(connection, row)
+
+
+@event.listens_for(Friendship, "after_update")
+def _friendship_updated(mapper, connection, target):
+    if _changed(target, "status"):
+        _log_change(connection, friendship_change(target.id, target.user_id, target.friend_id, target.status))
+        if "accepted" in (target.status, *db.inspect(target).attrs.status.history.deleted):
+            for row in friendship_resync(target.user_id, target.friend_id):
+                _log_change(connection, row)
+
+
+@event.listens_for(Friendship, "after_delete")
+def _friendship_deleted(mapper, connection, target):
+    _log_change(connection, friendship_change(target.id, target.user_id, target.friend_id))
+    if target.status == "accepted":
+        for row in friendship_resync(target.user_id, target.friend_id):
+            _log_change(connection, row)
+
+
+def changes_since(viewer_id, since, limit):
+    """(görülebilen değişiklikler, yeni imleç, devamı var mı); sabit sayıda sorgu.
+
+    Görülemeyen satırlar atlanır ama imleç yine taranan son satıra ilerler; sonradan
+    görünür olan gönderiler için resync kayıtları gelir (peer_id yoksa herkese).
+    """
+    rows = ChangeLog.query.filter(ChangeLog.id > since).order_by(ChangeLog.id).limit(limit + 1).all()
+    more = len(rows) > limit
+    rows = rows[:limit]
+    cursor = rows[-1].id if rows else since
+    latest = {}
+    for row in rows:  # henüz sıkıştırılmamış eski görüntüler: sayfada yalnızca en yenisi
+        latest[(row.entity, row.entity_id, row.owner_id, row.peer_id)] = row
+    rows = sorted(latest.values(), key=lambda r: r.id)
+    visible = visible_owner_ids(viewer_id, {r.owner_id for r in rows if r.entity in ("post", "comment")})
+    rows = [r for r in rows if r.entity == "user"
+            or (viewer_id in (r.owner_id, r.peer_id) if r.entity == "friendship"
+                else r.peer_id in (None, viewer_id) if r.entity == "resync"
+                else r.owner_id in visible)]
+    data = {r.id: json.loads(r.data) if r.data else None for r in rows}
+    user_ids = {d[key] for d in data.values() if d for key in ("user_id", "friend_id") if key in d}
+    names = dict(db.session.query(User.id, User.username).filter(User.id.in_(user_ids))) if user_ids else {}
+    changes = []
+    for r in rows:
+        item = {"cursor": r.id, "entity": r.entity, "id": r.entity_id, "op": r.op}
+        d = data[r.id]
+        if d is not None:
+            if "user_id" in d: d["user"] = names.get(d.pop("user_id"))
+            if "friend_id" in d: d["friend"] = names.get(d.pop("friend_id"))
+            item["data"] = d
+        changes.append(item)
+    return changes, cursor, more
+
+
+def backfill_changes(chunk=1000):
+    """Akıştan önce var olan (hiç kaydı olmayan) satırların görüntülerini yazar; eklenen sayı.
+
+    since=0 ilk senkronu eksiksiz olsun diye açılışta çağrılır; eksik yoksa sorgular ucuzdur.
+    """
+    def missing(model, entity, *match):
+        return ~db.exists().where(ChangeLog.entity == entity, ChangeLog.entity_id == model.id, *match)
+
+    sources = (
+        (User.query.filter(missing(User, "user")), _user_change),
+        (Friendship.query.filter(missing(Friendship, "friendship", ChangeLog.owner_id == Friendship.user_id,
+                                         ChangeLog.peer_id == Friendship.friend_id)),
+         lambda f: friendship_change(f.id, f.user_id, f.friend_id, f.status or "pending")),
+        (Post.query.filter(missing(Post, "post")), _post_change),
+        (db.session.query(Comment, Post.user_id).join(Post, Post.id == Comment.post_id).filter(missing(Comment, "comment")),
+         lambda row: change_row("comment", row[0].id, "upsert", row[1],
+                                data={"post_id": row[0].post_id, "user_id": row[0].user_id, "html": row[0].html_content})),
+    )
+    added, rows = 0, []
+    for query, to_change in sources:
+        for item in query.yield_per(chunk):
+            rows.append(to_change(item))
+            if len(rows) >= chunk:
+                added += len(rows)
+                record_changes(rows)
+                rows = []
+    added += len(rows)
+    record_changes(rows)
+    db.session.commit()
+    if added:
+        print(f"Değişiklik akışı dolduruldu: {added} kayıt.")
+    return added
+
+
+def compact_changes():
+    """Her varlığın yalnızca en yeni satırını bırakır; silinen satır sayısını döndürür.
+
+    SQLite silinen arkadaşlık satırının id'sini yeniden verebilir; bu yüzden anahtar
+    (varlık, id, sahip, karşı taraf): başka çiftin satırı bir silme kaydını geçersiz kılmaz.
+    """
+    latest = db.session.query(db.func.max(ChangeLog.id)).group_by(
+        ChangeLog.entity, ChangeLog.entity_id, ChangeLog.owner_id, ChangeLog.peer_id)
+    removed = ChangeLog.query.filter(ChangeLog.id.not_in(latest)).delete(synchronize_session=False)
+    db.session.commit()
+    return removed
+
+
+def compact_changes_loop(interval):
+    while True:
+        socketio.sleep(interval)
+        try:
+            with app.app_context():
+                compact_changes()
+        except Exception as e:
+            print(f"Değişiklik akışı sıkıştırma hatası: {e!r}")
+
+
 # -------------------- HTML ŞABLON (Aynı kaldı) --------------------
 PAGE = """<!DOCTYPE html>
 <html lang="tr">
@@ -225,11 +819,13 @@ PAGE = """<!DOCTYPE html>
       {% if current_user %}
         {% set me = current_user.username %}
         {% if current_user.avatar %}
-          <img class="avatar" src="/avatar/{{current_user.avatar}}" alt="">
+          <img class="avatar" src="/avatar/{{current_user.avatar}}?w=28" alt="">
         {% endif %}
         Giriş: <a href="/user/{{me}}">@{{me}}</a> |
         <a href="/inbox">Mesajlar</a> |
         <a href="/requests">İstekler</a> |
+        <a href="/suggestions">Öneriler</a> |
+        <a href="/notifications">🔔 <span id="notif-count">{{ unread_notifications }}</span></a> |
         <a href="/go_live" style="color:red; font-weight:bold;">🔴 Canlı Yayın Aç</a> | 
         <a href="/logout">Çıkış</a>
       {% else %}
@@ -272,7 +868,7 @@ PAGE = """<!DOCTYPE html>
         <div class="card">
           {% set author_user = p.author %}
           {% if author_user.avatar %}
-            <img class="avatar" src="/avatar/{{author_user.avatar}}" alt="">
+            <img class="avatar" src="/avatar/{{author_user.avatar}}?w=28" alt="">
           {% endif %}
           <b><a href="/user/{{author_user.username}}">{{author_user.username}}</a></b>
           {% if author_user.username in LIVE_STREAMS %}
@@ -319,7 +915,7 @@ PAGE = """<!DOCTYPE html>
                 <div style="margin-bottom:6px;">
                   {% set commenter_user = c.commenter %}
                   {% if commenter_user.avatar %}
-                    <img class="avatar" src="/avatar/{{commenter_user.avatar}}" alt="">
+                    <img class="avatar" src="/avatar/{{commenter_user.avatar}}?w=28" alt="">
                   {% endif %}
                   <b><a href="/user/{{commenter_user.username}}">{{commenter_user.username}}</a>:</b>
                   <span>{{c.html_content|safe}}</span>
@@ -343,53 +939,795 @@ PAGE = """<!DOCTYPE html>
       {% endfor %}
     {% endif %}
   </div>
+{% if current_user %}
+<script src="https://cdnjs.cloudflare.com/ajax/libs/socket.io/4.0.1/socket.io.js"></script>
+<script>
+  // Bildirimler sunucuda birleştirilip toplu itilir; yalnızca sayaç güncellenir
+  io().on('notifications', (data) => {
+    document.getElementById('notif-count').textContent = data.unread;
+  });
+</script>
+{% endif %}
 </body>
 </html>
 """
 
 
-# -------------------- Range (Partial Content) Sunucu (Aynı kaldı) --------------------
+# -------------------- Range (Partial Content) Sunucu --------------------
+# Video oynatıcılar izleme başına onlarca Range isteği atar. Her istekte
+# exists/getsize/open yapmamak için stat sonucu ve açık dosya tanımlayıcısı
+# path bazında saklanır; okumalar os.pread ile ortak offset olmadan yapılır.
+FILE_CACHE_MAX = int(os.environ.get("FILE_CACHE_MAX", 256))  # aynı anda açık tutulan dosya sayısı
+FILE_CACHE_IDLE = float(os.environ.get("FILE_CACHE_IDLE", 30))  # sn; kullanılmayan fd kapatılır
+FILE_CACHE_REVALIDATE = 2.0  # sn; mtime/boyut en fazla bu sıklıkla yeniden kontrol edilir
+RANGE_CHUNK = 64 * 1024
+
+
+class _OpenFile:
+    __slots__ = ("path", "fd", "size", "mtime", "checked", "last_used", "refs", "stale")
+
+    def __init__(self, path, fd, st, now):
+        self.path, self.fd = path, fd
+        self.size, self.mtime = st.st_size, st.st_mtime_ns
+        self.checked = self.last_used = now
+        self.refs = 0
+        self.stale = False
+
+
+class FileHandleCache:
+    """Sınırlı LRU: path -> (fd, boyut, mtime). Kullanımdaki fd'ler erken kapatılmaz."""
+
+    def __init__(self, max_entries, idle_timeout, revalidate):
+        self.max_entries = max_entries
+        self.idle_timeout = idle_timeout
+        self.revalidate = revalidate
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.counters = Counter()
+
+    def acquire(self, path):
+        """Dosyanın kaydını (refs+1) döndürür; yoksa veya normal dosya değilse None."""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(path)
+            if entry is not None and now - entry.checked >= self.revalidate:
+                self.counters["stat"] += 1
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    st = None
+                if st is None or (st.st_mtime_ns, st.st_size) != (entry.mtime, entry.size):
+                    self._drop(path)
+                    entry = None
+                else:
+                    entry.checked = now
+            if entry is None:
+                entry = self._open(path, now)
+                if entry is None:
+                    return None
+            else:
+                self.counters["hit"] += 1
+                self._entries.move_to_end(path)
+            entry.refs += 1
+            entry.last_used = now
+            self._sweep(now)
+            return entry
+
+    def release(self, entry):
+        with self._lock:
+            entry.refs -= 1
+            entry.last_used = time.monotonic()
+            if entry.stale:
+                if entry.refs == 0:
+                    os.close(entry.fd)
+            elif entry.path in self._entries:
+                self._entries.move_to_end(entry.path)
+
+    def read(self, entry, offset, length):
+        """[offset, offset+length) aralığını RANGE_CHUNK parçalar halinde üretir."""
+        remaining = length
+        while remaining > 0:
+            data = os.pread(entry.fd, min(RANGE_CHUNK, remaining), offset)
+            if not data: break
+            offset += len(data)
+            remaining -= len(data)
+            self.counters["bytes"] += len(data)
+            yield data
+
+    def _open(self, path, now):
+        self.counters["open"] += 1
+        try:
+            fd = os.open(path, os.O_RDONLY)
+        except OSError:
+            return None
+        st = os.fstat(fd)
+        if not stat.S_ISREG(st.st_mode):
+            os.close(fd)
+            return None
+        entry = _OpenFile(path, fd, st, now)
+        self._entries[path] = entry
+        while len(self._entries) > self.max_entries:
+            self._drop(next(iter(self._entries)))
+        return entry
+
+    def _drop(self, path):
+        entry = self._entries.pop(path)
+        entry.stale = True
+        if entry.refs == 0:
+            os.close(entry.fd)
+
+    def _sweep(self, now):
+        # En eski kayıtlar baştadır; boşta kalanları kapat, ilk taze kayıtta dur
+        for _ in range(len(self._entries)):
+            path, entry = next(iter(self._entries.items()))
+            if now - entry.last_used < self.idle_timeout:
+                break
+            if entry.refs:
+                self._entries.move_to_end(path)  # hâlâ akıyor, kapatma
+                continue
+            self._drop(path)
+
+    def discard(self, path):
+        with self._lock:
+            if path in self._entries:
+                self._drop(path)
+
+    def stats(self):
+        with self._lock:
+            return {"open_files": len(self._entries), "max": self.max_entries, "counters": dict(self.counters)}
+
+
+FILE_HANDLES = FileHandleCache(FILE_CACHE_MAX, FILE_CACHE_IDLE, FILE_CACHE_REVALIDATE)
+
+
 def partial_response(path, mimetype):
-    if not os.path.exists(path): abort(404)
-    file_size = os.path.getsize(path)
+    entry = FILE_HANDLES.acquire(path)
+    if entry is None: abort(404)
+    file_size = entry.size
+    start, end, status = 0, file_size - 1, 200
     range_header = request.headers.get('Range', None)
-    if not range_header:
-        with open(path, 'rb') as f:
-            data = f.read()
-        return Response(data, 200, mimetype=mimetype, direct_passthrough=True)
-
-    try:
-        _, rng = range_header.split('=')
-        start_end = rng.split('-')
-        start = int(start_end[0]) if start_end[0] else 0
-        end = int(start_end[1]) if len(start_end) > 1 and start_end[1] else file_size - 1
-        start = max(0, start);
-        end = min(end, file_size - 1)
-        if start > end or start >= file_size:
+    if range_header:
+        try:
+            _, rng = range_header.split('=')
+            start_end = rng.split('-')
+            start = int(start_end[0]) if start_end[0] else 0
+            end = int(start_end[1]) if len(start_end) > 1 and start_end[1] else file_size - 1
+            start = max(0, start);
+            end = min(end, file_size - 1)
+            status = 206
+        except Exception:
+            start, end = 0, file_size - 1  # bozuk başlık: tüm dosya
+        if status == 206 and (start > end or start >= file_size):
+            FILE_HANDLES.release(entry)
             return Response(status=416, headers={"Content-Range": f"bytes */{file_size}"})
-    except Exception:
-        with open(path, 'rb') as f:
-            return Response(f.read(), 200, mimetype=mimetype, direct_passthrough=True)
 
     length = end - start + 1
+    headers = {"Accept-Ranges": "bytes", "Content-Length": str(length)}
+    if status == 206:
+        headers["Content-Range"] = f"bytes {start}-{end}/{file_size}"
+    resp = Response(FILE_HANDLES.read(entry, start, length), status, mimetype=mimetype, headers=headers,
+                    direct_passthrough=True)
+    resp.call_on_close(lambda: FILE_HANDLES.release(entry))
+    return resp
+
+
+# -------------------- GÖRSEL TÜREVLERİ (Thumbnail İş Kuyruğu) --------------------
+# Avatar ve gönderi fotoğrafları yüklendikten sonra arka planda küçültülür.
+# Şablonlar "?w=<px>" ile ister; türev hazır değilse orijinal sunulur.
+DERIVATIVE_SIZES = {
+    "avatar": (28, 120),  # akıştaki .avatar ve profil fotoğrafı
+    "upload": (720,),  # akıştaki img.media
+}
+DERIVATIVE_FORMATS = {"webp": "WEBP", "jpg": "JPEG"}
+DERIVATIVE_WORKERS = int(os.environ.get("DERIVATIVE_WORKERS", max(1, (os.cpu_count() or 2) // 2)))
+
+
+def derivative_name(kind, filename, size, ext):
+    stem = os.path.splitext(filename)[0]
+    return f"{kind}_{stem}__{size}.{ext}"
+
+
+def _build_derivatives(src_path, out_dir, kind, filename, sizes):
+    """Alt süreçte çalışır: her boyut için WebP ve JPEG türevi yazar."""
+    with Image.open(src_path) as im:
+        im = ImageOps.exif_transpose(im)
+        im.load()
+    if im.mode not in ("RGB", "RGBA"):
+        im = im.convert("RGBA")
+    for size in sizes:
+        if kind == "avatar":
+            # Avatarlar daire içinde object-fit:cover ile gösterilir -> kare kırp
+            thumb = ImageOps.fit(im, (size, size), Image.LANCZOS)
+        else:
+            thumb = im.copy()
+            thumb.thumbnail((size, size), Image.LANCZOS)
+        for ext, fmt in DERIVATIVE_FORMATS.items():
+            out = thumb.convert("RGB") if fmt == "JPEG" and thumb.mode != "RGB" else thumb
+            path = os.path.join(out_dir, derivative_name(kind, filename, size, ext))
+            out.save(path + ".tmp", format=fmt, quality=82)
+            os.replace(path + ".tmp", path)
+    return len(sizes) * len(DERIVATIVE_FORMATS)
+
+
+class DerivativeQueue:
+    """ProcessPoolExecutor üzerinde çalışan türev iş kuyruğu ve durum tablosu."""
+
+    def __init__(self, max_workers):
+        self.max_workers = max_workers
+        self.enabled = Image is not None
+        self._executor = None
+        self._lock = threading.Lock()
+        self.jobs = {}  # {"avatar:foo.jpg": "pending" | "done" | "failed"}
+        self.pending = {}  # {"avatar:foo.jpg": Future}
+        self.counters = Counter()
+
+    def _pool(self):
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(max_workers=self.max_workers)
+        return self._executor
+
+    def submit(self, kind, filename):
+        """Yeni yüklenen görsel için türev üretimini kuyruğa ekler."""
+        key = f"{kind}:{filename}"
+        if not self.enabled or os.path.splitext(filename)[1].lower() == ".gif":
+            return  # GIF animasyonu bozulmasın diye orijinal kalır
+        source = safe_join(AVATAR_DIR if kind == "avatar" else UPLOAD_DIR, filename)
+        if source is None or not os.path.isfile(source):
+            return  # olmayan adlar için iş ve kayıt açılmaz (?w= ile rastgele adlar istenebilir)
+        with self._lock:
+            if self.jobs.get(key) in ("pending", "done"):
+                return
+            self.jobs[key] = "pending"
+            self.counters["submitted"] += 1
+        try:
+            future = self._pool().submit(_build_derivatives, source,
+                                         DERIVED_DIR, kind, filename, DERIVATIVE_SIZES[kind])
+        except Exception:
+            self._finish(key, "failed")
+            return
+        with self._lock:
+            self.pending[key] = future
+        future.add_done_callback(lambda f, key=key: self._finish(key, "failed" if f.exception() else "done"))
+
+    def _finish(self, key, status):
+        with self._lock:
+            self.pending.pop(key, None)
+            if key in self.jobs:
+                self.jobs[key] = status
+                self.counters[status] += 1
+
+    def pick(self, kind, filename, width, webp):
+        """İstenen genişliğe uygun türevin dosya adını, hazır değilse None döndürür."""
+        sizes = DERIVATIVE_SIZES.get(kind)
+        if not self.enabled or not sizes:
+            return None
+        key = f"{kind}:{filename}"
+        status = self.jobs.get(key)
+        if status is None:
+            # Yeniden başlatma sonrası: diskte var mı bir kez bak, yoksa üret
+            probe = os.path.join(DERIVED_DIR, derivative_name(kind, filename, sizes[-1], "jpg"))
+            if os.path.exists(probe):
+                with self._lock:
+                    self.jobs[key] = status = "done"
+            else:
+                self.submit(kind, filename)
+                return None
+        if status != "done":
+            return None
+        size = next((s for s in sizes if s >= width), sizes[-1])
+        return derivative_name(kind, filename, size, "webp" if webp else "jpg")
+
+    def discard(self, kind, filename):
+        """Kaynak silinirken türevlerini ve iş kaydını temizler; türev yollarını döndürür."""
+        with self._lock:
+            self.jobs.pop(f"{kind}:{filename}", None)
+        paths = [os.path.join(DERIVED_DIR, derivative_name(kind, filename, size, ext))
+                 for size in DERIVATIVE_SIZES.get(kind, ()) for ext in DERIVATIVE_FORMATS]
+        for path in paths:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+        return paths
+
+    def status(self):
+        with self._lock:
+            running = sum(1 for f in self.pending.values() if f.running())
+            return {
+                "enabled": self.enabled,
+                "workers": self.max_workers,
+                "queue_depth": len(self.pending) - running,
+                "running": running,
+                "counters": dict(self.counters),
+            }
 
-    def generate():
-        with open(path, 'rb') as f:
-            f.seek(start)
-            remaining = length
-            chunk = 64 * 1024
-            while remaining > 0:
-                data = f.read(min(chunk, remaining))
-                if not data: break
-                remaining -= len(data)
-                yield data
-
-    headers = {
-        "Content-Range": f"bytes {start}-{end}/{file_size}",
-        "Accept-Ranges": "bytes",
-        "Content-Length": str(length)
-    }
-    return Response(generate(), 206, mimetype=mimetype, headers=headers)
+
+DERIVATIVES = DerivativeQueue(DERIVATIVE_WORKERS)
+
+
+# -------------------- KÜÇÜK DOSYA ÖNBELLEĞİ (bellek içi LRU) --------------------
+# Avatarlar ve küçük görseller neredeyse her kartta istenir. Eşikten küçük
+# dosyalar ETag'leri hesaplanmış halde bellekte tutulur; dosya adları benzersiz
+# olduğundan yalnızca silme/değiştirme anında açıkça geçersiz kılınır.
+SMALL_ASSET_MAX_FILE = int(os.environ.get("SMALL_ASSET_MAX_FILE", 256 * 1024))
+SMALL_ASSET_BUDGET = int(os.environ.get("SMALL_ASSET_BUDGET", 32 * 1024 * 1024))
+OVERSIZE_PATHS_MAX = 4096  # önbelleği atlayan büyük dosya yolları (LRU)
+COMPRESSIBLE_MIMETYPES = {"image/svg+xml", "image/bmp", "image/x-icon", "text/plain"}
+
+
+class _Asset:
+    __slots__ = ("body", "gzip_body", "etag", "mimetype", "size")
+
+    def __init__(self, body, mimetype):
+        self.body = body
+        self.mimetype = mimetype
+        self.etag = hashlib.blake2b(body, digest_size=12).hexdigest()
+        self.gzip_body = None
+        if mimetype in COMPRESSIBLE_MIMETYPES:
+            packed = gzip.compress(body, 6)
+            if len(packed) < len(body) * 0.9:
+                self.gzip_body = packed
+        self.size = len(body) + len(self.gzip_body or b"")
+
+
+class SmallAssetCache:
+    """Toplam bayt bütçesi olan LRU: path -> gövde, ETag ve varsa gzip varyantı."""
+
+    def __init__(self, max_file, budget):
+        self.max_file = max_file
+        self.budget = budget
+        self.used = 0
+        self._entries = OrderedDict()
+        self._oversize = OrderedDict()  # eşiği aşan yollar: her istekte açılıp stat edilmesin
+        self._lock = threading.Lock()
+        self.counters = Counter()
+
+    def get(self, path):
+        """Önbellekteki kaydı döndürür; yoksa küçükse diskten yükler, büyükse None."""
+        with self._lock:
+            asset = self._entries.get(path)
+            if asset is not None:
+                self._entries.move_to_end(path)
+                self.counters["hit"] += 1
+                return asset
+            if path in self._oversize:
+                self._oversize.move_to_end(path)
+                self.counters["bypass"] += 1
+                return None
+        try:
+            if os.stat(path).st_size > self.max_file:
+                with self._lock:
+                    self._oversize[path] = True
+                    if len(self._oversize) > OVERSIZE_PATHS_MAX:
+                        self._oversize.popitem(last=False)
+                    self.counters["bypass"] += 1
+                return None
+            self.counters["miss"] += 1
+            with open(path, "rb") as f:
+                body = f.read()
+        except OSError:
+            return None
+        asset = _Asset(body, mimetypes.guess_type(path)[0] or "application/octet-stream")
+        with self._lock:
+            old = self._entries.pop(path, None)
+            if old is not None:
+                self.used -= old.size
+            self._entries[path] = asset
+            self.used += asset.size
+            while self.used > self.budget and self._entries:
+                _, evicted = self._entries.popitem(last=False)
+                self.used -= evicted.size
+                self.counters["evict"] += 1
+        return asset
+
+    def invalidate(self, *paths):
+        with self._lock:
+            for path in paths:
+                self._oversize.pop(path, None)
+                asset = self._entries.pop(path, None)
+                if asset is not None:
+                    self.used -= asset.size
+
+    def respond(self, asset):
+        if asset.etag in request.if_none_match:
+            resp = Response(status=304)
+        elif asset.gzip_body is not None and "gzip" in request.headers.get("Accept-Encoding", ""):
+            resp = Response(asset.gzip_body, mimetype=asset.mimetype, headers={"Content-Encoding": "gzip"})
+        else:
+            resp = Response(asset.body, mimetype=asset.mimetype)
+        resp.set_etag(asset.etag)
+        resp.headers["Cache-Control"] = "no-cache"
+        if asset.gzip_body is not None:
+            resp.vary.add("Accept-Encoding")
+        return resp
+
+    def stats(self):
+        with self._lock:
+            return {"entries": len(self._entries), "bytes": self.used, "budget": self.budget,
+                    "max_file": self.max_file, "oversize_paths": len(self._oversize),
+                    "counters": dict(self.counters)}
+
+
+SMALL_ASSETS = SmallAssetCache(SMALL_ASSET_MAX_FILE, SMALL_ASSET_BUDGET)
+
+
+def send_image(directory, filename, kind):
+    """?w= verilmişse uygun türevi (WebP/JPEG), hazır değilse orijinali gönderir."""
+    width = request.args.get("w", type=int)
+    derived = None
+    if width:
+        webp = "image/webp" in request.headers.get("Accept", "")
+        derived = DERIVATIVES.pick(kind, filename, width, webp)
+        if derived:
+            directory, filename = DERIVED_DIR, derived
+    path = safe_join(directory, filename)
+    asset = SMALL_ASSETS.get(path) if path else None
+    resp = SMALL_ASSETS.respond(asset) if asset else send_from_directory(directory, filename)
+    if derived:
+        resp.vary.add("Accept")
+    return resp
+
+
+# -------------------- YANIT SIKIŞTIRMA (gzip/deflate/zstd) --------------------
+# HTML/JS/JSON yanıtları Accept-Encoding'e göre sıkıştırılır. zstd yalnızca
+# standart kütüphanede varsa (Python 3.14+ compression.zstd) sunulur. Zaten
+# sıkıştırılmış medya (görsel/video/ses) ve dosya yanıtları atlanır.
+COMPRESSIBLE_RESPONSE_TYPES = {
+    "text/html", "text/plain", "text/css", "text/javascript", "application/javascript",
+    "application/json", "image/svg+xml",
+}
+COMPRESS_MIN_SIZE = 512  # bayt; daha küçüğü için başlık yükü kazancı yer
+COMPRESS_STREAM_FLUSH = 64 * 1024  # akışta bu kadar girdi birikince blok gönder
+SUPPORTED_ENCODINGS = (["zstd"] if zstd is not None else []) + ["gzip", "deflate"]
+PRECOMPRESSED_MAX = 64  # statik kabuk önbelleğindeki kayıt sayısı
+_precompressed = OrderedDict()  # {(digest, encoding): bytes}
+
+
+def _compressor(encoding, best=False):
+    if encoding == "zstd":
+        return zstd.ZstdCompressor(level=19 if best else 3)
+    return zlib.compressobj(9 if best else 6, zlib.DEFLATED, 31 if encoding == "gzip" else 15)
+
+
+def _flush_block(comp):
+    if zstd is not None and isinstance(comp, zstd.ZstdCompressor):
+        return comp.flush(zstd.ZstdCompressor.FLUSH_BLOCK)
+    return comp.flush(zlib.Z_SYNC_FLUSH)
+
+
+def compress_bytes(body, encoding, best=False):
+    comp = _compressor(encoding, best)
+    return comp.compress(body) + comp.flush()
+
+
+def _stream_compress(chunks, encoding):
+    """Akan yanıtı sınırlı tamponla sıkıştırır; her COMPRESS_STREAM_FLUSH baytta blok yollar."""
+    comp = _compressor(encoding)
+    pending = 0
+    try:
+        for chunk in chunks:
+            if isinstance(chunk, str):
+                chunk = chunk.encode()
+            out = comp.compress(chunk)
+            pending += len(chunk)
+            if pending >= COMPRESS_STREAM_FLUSH:
+                out += _flush_block(comp)
+                pending = 0
+            if out:
+                yield out
+        yield comp.flush()
+    finally:
+        if hasattr(chunks, "close"):
+            chunks.close()
+
+
+def precompressed(view):
+    """İçeriği nadiren değişen sayfalar: sıkıştırılmış çıktı gövde özetine göre önbelleğe alınır."""
+    view.precompressed = True
+    return view
+
+
+@app.after_request
+def compress_response(resp):
+    if (resp.status_code != 200 or resp.direct_passthrough or "Content-Encoding" in resp.headers
+            or resp.mimetype not in COMPRESSIBLE_RESPONSE_TYPES):
+        return resp
+    resp.vary.add("Accept-Encoding")
+    encoding = request.accept_encodings.best_match(SUPPORTED_ENCODINGS)
+    if encoding is None:
+        return resp
+
+    if resp.is_streamed:
+        resp.response = _stream_compress(resp.response, encoding)
+        resp.headers.pop("Content-Length", None)
+    else:
+        body = resp.get_data()
+        if len(body) < COMPRESS_MIN_SIZE:
+            return resp
+        view = app.view_functions.get(request.endpoint)
+        if getattr(view, "precompressed", False):
+            key = (hashlib.blake2b(body, digest_size=16).digest(), encoding)
+            packed = _precompressed.get(key)
+            if packed is None:
+                packed = _precompressed[key] = compress_bytes(body, encoding, best=True)
+                while len(_precompressed) > PRECOMPRESSED_MAX:
+                    _precompressed.popitem(last=False)
+            else:
+                _precompressed.move_to_end(key)
+        else:
+            packed = compress_bytes(body, encoding)
+        resp.set_data(packed)
+    etag, weak = resp.get_etag()
+    if etag:
+        resp.set_etag(f"{etag}-{encoding}", weak)
+    resp.headers["Content-Encoding"] = encoding
+    return resp
+
+
+# -------------------- İSTEK ÖLÇÜMLERİ (SQL sayısı, süre, Prometheus) --------------------
+# Motor olayları istek başına SQL sayısını ve süresini sayar; route şablonu başına
+# (ör. "/dm/<username>") gecikme ve sorgu histogramları /metrics'te Prometheus metin
+# biçiminde verilir. @query_budget(n) route'un sorgu bütçesini bildirir: aşım sayılır
+# ve basılır; QUERY_BUDGET_STRICT=1 (testler) iken istek QueryBudgetExceeded ile düşer.
+# METRICS_HEADERS=1 ise yanıtlara Server-Timing ve X-SQL-Queries eklenir (bench/).
+QUERY_BUDGET_STRICT = os.environ.get("QUERY_BUDGET_STRICT", "") == "1"
+METRICS_HEADERS = os.environ.get("METRICS_HEADERS", "") == "1"
+# Canlı yayın gecikmelerinden (LATENCY_BUCKETS_MS) daha geniş: büyük sayfalar saniyeler
+# ve binlerce sorgu sürebilir, hepsi +Inf'e düşmesin
+REQUEST_LATENCY_BUCKETS_MS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000)
+REQUEST_QUERY_BUCKETS = (1, 2, 3, 5, 10, 20, 50, 100, 250, 500, 1000, 2500, 5000)
+
+
+class QueryBudgetExceeded(RuntimeError):
+    pass
+
+
+def query_budget(limit):
+    """Route başına izin verilen en fazla SQL sayısı (route dekoratörünün altına)."""
+    def mark(view):
+        view.query_budget = limit
+        return view
+    return mark
+
+
+with app.app_context():
+    # Başlangıç zamanı yürütme bağlamında: hata veren sorgu after_cursor_execute'u
+    # tetiklemez, havuzdaki bağlantıda (conn.info) birikmesin
+    @event.listens_for(db.engine, "before_cursor_execute")
+    def _sql_started(conn, cursor, statement, parameters, context, executemany):
+        context._sql_started = time.perf_counter()
+
+    @event.listens_for(db.engine, "after_cursor_execute")
+    def _sql_finished(conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - context._sql_started
+        if "sql_queries" in g:  # yalnızca istek içindeki sorgular (arka plan görevleri hariç)
+            g.sql_queries += 1
+            g.sql_seconds += elapsed
+
+
+class RequestMetrics:
+    """Route başına istek sayacı ile gecikme ve SQL sayısı histogramları."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests = Counter()  # {(route, method, status): n}
+        self.latency = {}  # {(route, method): LatencyHistogram}, ms
+        self.queries = {}  # {(route, method): LatencyHistogram}, sorgu sayısı
+        self.sql_seconds = Counter()  # {(route, method): toplam sn}
+        self.over_budget = Counter()  # {(route, method): n}
+
+    def observe(self, route, method, status, ms, queries, sql_seconds, over_budget):
+        key = (route, method)
+        with self._lock:
+            self.requests[(route, method, status)] += 1
+            self.latency.setdefault(key, LatencyHistogram(REQUEST_LATENCY_BUCKETS_MS)).observe(ms)
+            self.queries.setdefault(key, LatencyHistogram(REQUEST_QUERY_BUCKETS)).observe(queries)
+            self.sql_seconds[key] += sql_seconds
+            if over_budget:
+                self.over_budget[key] += 1
+
+    @staticmethod
+    def _labels(**labels):
+        def esc(v):
+            return str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        return "{" + ",".join(f'{k}="{esc(v)}"' for k, v in labels.items()) + "}"
+
+    def _histogram(self, lines, name, help_text, hists, scale):
+        lines += [f"# HELP {name} {help_text}", f"# TYPE {name} histogram"]
+        for (route, method), h in sorted(hists.items()):
+            seen = 0
+            for bound, count in zip(h.buckets, h.counts):
+                seen += count
+                lines.append(f"{name}_bucket{self._labels(route=route, method=method, le=bound * scale)} {seen}")
+            lines.append(f"{name}_bucket{self._labels(route=route, method=method, le='+Inf')} {h.total}")
+            lines.append(f"{name}_sum{self._labels(route=route, method=method)} {h.sum * scale}")
+            lines.append(f"{name}_count{self._labels(route=route, method=method)} {h.total}")
+
+    def prometheus(self):
+        lines = ["# HELP matties_http_requests_total İşlenen HTTP istekleri.",
+                 "# TYPE matties_http_requests_total counter"]
+        with self._lock:
+            for (route, method, status), n in sorted(self.requests.items()):
+                lines.append(f"matties_http_requests_total{self._labels(route=route, method=method, status=status)} {n}")
+            self._histogram(lines, "matties_http_request_duration_seconds", "İstek süresi (yanıt nesnesi hazır olana dek).",
+                            self.latency, 0.001)
+            self._histogram(lines, "matties_http_request_sql_queries", "İstek başına SQL sorgu sayısı.", self.queries, 1)
+            lines += ["# HELP matties_http_request_sql_seconds_total İstek içindeki SQL süresi.",
+                      "# TYPE matties_http_request_sql_seconds_total counter"]
+            for (route, method), total in sorted(self.sql_seconds.items()):
+                lines.append(f"matties_http_request_sql_seconds_total{self._labels(route=route, method=method)} {total:.6f}")
+            lines += ["# HELP matties_query_budget_exceeded_total Sorgu bütçesini aşan istekler.",
+                      "# TYPE matties_query_budget_exceeded_total counter"]
+            for (route, method), n in sorted(self.over_budget.items()):
+                lines.append(f"matties_query_budget_exceeded_total{self._labels(route=route, method=method)} {n}")
+        return "\n".join(lines) + "\n"
+
+
+METRICS = RequestMetrics()
+
+
+@app.before_request
+def start_request_metrics():
+    g.request_started = time.perf_counter()
+    g.sql_queries = 0
+    g.sql_seconds = 0.0
+
+
+@app.after_request
+def record_request_metrics(resp):
+    started = g.pop("request_started", None)
+    if started is None:  # hata yanıtı için ikinci geçiş (ör. bütçe aşımı sonrası 500)
+        return resp
+    ms = (time.perf_counter() - started) * 1000
+    route = request.url_rule.rule if request.url_rule is not None else "<eşleşmedi>"
+    budget = getattr(app.view_functions.get(request.endpoint), "query_budget", None)
+    over = budget is not None and g.sql_queries > budget
+    strict = over and QUERY_BUDGET_STRICT  # aşağıda istisna atılır; istemci 500 alacak
+    METRICS.observe(route, request.method, 500 if strict else resp.status_code, ms,
+                    g.sql_queries, g.sql_seconds, over)
+    if METRICS_HEADERS:
+        resp.headers["X-SQL-Queries"] = str(g.sql_queries)
+        resp.headers["Server-Timing"] = f'db;dur={g.sql_seconds * 1000:.2f};desc="{g.sql_queries} sorgu", app;dur={ms:.2f}'
+    if over:
+        message = f"{request.method} {route}: {g.sql_queries} sorgu (bütçe {budget})"
+        if strict:
+            raise QueryBudgetExceeded(message)
+        print(f"Sorgu bütçesi aşıldı: {message}")
+    return resp
+
+
+@app.route("/metrics")
+def metrics():
+    """Prometheus metin biçiminde istek ölçümleri."""
+    return Response(METRICS.prometheus(), mimetype="text/plain; version=0.0.4")
+
+
+# -------------------- SOKET OLAY SINIRLARI (token bucket) --------------------
+# Her olay grubu için (saniyede jeton, kova boyu): bağlantı (sid) ve oda başına
+# ayrı kovalar, ayrıca JSON olarak ölçülen yük üst sınırı (bayt). Sınırı aşan
+# olaylar düşürülür ve sayılır (/api/rate_limits); notify olan gruplarda gönderene
+# 'rate_limited' (grup, retry_after, cid) gider: DM metni ve odaya katılma istemcide
+# yeniden denenir. ICE adayları ve alındı bildirimleri düşük öncelikli, sessizce düşer.
+SOCKET_LIMITS = {
+    "join": {"sid": (1, 5), "room": (20, 60), "max_bytes": 1024, "notify": True},
+    "signal": {"sid": (60, 300), "room": (600, 3000), "max_bytes": 64 * 1024, "notify": False},
+    "dm": {"sid": (5, 20), "room": (10, 40), "max_bytes": 8 * 1024, "notify": True},
+    "dm_ack": {"sid": (20, 60), "room": None, "max_bytes": 512, "notify": False},
+    "record": {"sid": (4, 12), "room": None, "max_bytes": 1024 * 1024, "notify": False},
+}
+ROOM_BUCKETS_MAX = 10000  # aşılınca dolmuş (boşta) oda kovaları atılır
+
+
+def payload_size(value):
+    """Yükün JSON boyutuna yakın bir tahmin; ikili veriyi kodlamadan sayar."""
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return len(value)
+    if isinstance(value, str):
+        return len(value) + 2
+    if isinstance(value, dict):
+        return 2 + sum(payload_size(k) + payload_size(v) + 2 for k, v in value.items())
+    if isinstance(value, (list, tuple)):
+        return 2 + sum(payload_size(v) + 1 for v in value)
+    return len(json.dumps(value, default=str))
+
+
+class TokenBucket:
+    __slots__ = ("rate", "burst", "tokens", "stamp")
+
+    def __init__(self, rate, burst, now):
+        self.rate, self.burst = rate, burst
+        self.tokens, self.stamp = float(burst), now
+
+    def refill(self, now):
+        self.tokens = min(self.burst, self.tokens + (now - self.stamp) * self.rate)
+        self.stamp = now
+
+    def take(self, now, cost=1):
+        self.refill(now)
+        if self.tokens < cost:
+            return False
+        self.tokens -= cost
+        return True
+
+    def wait(self, cost=1):
+        """Son refill'e göre jetonlar yetene dek saniye; kova boyunu aşan maliyette None."""
+        if cost > self.burst:
+            return None
+        return max(0.0, (cost - self.tokens) / self.rate)
+
+
+class SocketRateLimiter:
+    """Bağlantı ve oda başına token bucket; yük boyutu denetimi ve kısma sayaçları."""
+
+    def __init__(self, limits):
+        self.limits = limits
+        self.by_sid = {}  # {sid: {grup: TokenBucket}}
+        self.by_room = {}  # {(grup, oda): TokenBucket}
+        self.counters = {group: Counter() for group in limits}
+
+    def check(self, group, sid, room, data, cost=1):
+        """İzinliyse None; değilse (neden, retry_after). Tekrar denemenin anlamı yoksa retry_after None."""
+        limits, counters = self.limits[group], self.counters[group]
+        if not isinstance(data, dict):
+            counters["malformed"] += 1
+            return "malformed", None
+        if payload_size(data) > limits["max_bytes"]:
+            counters["too_large"] += 1
+            return "too_large", None
+        now = time.monotonic()
+        buckets = self.by_sid.setdefault(sid, {})
+        bucket = buckets.get(group) or buckets.setdefault(group, TokenBucket(*limits["sid"], now))
+        if not bucket.take(now, cost):
+            counters["throttled_sid"] += 1
+            return "throttled_sid", bucket.wait(cost)
+        if room is not None and limits["room"]:
+            key = (group, room)
+            bucket = self.by_room.get(key)
+            if bucket is None:
+                if len(self.by_room) >= ROOM_BUCKETS_MAX:
+                    self._prune(now)
+                bucket = self.by_room[key] = TokenBucket(*limits["room"], now)
+            if not bucket.take(now, cost):
+                counters["throttled_room"] += 1
+                return "throttled_room", bucket.wait(cost)
+        counters["allowed"] += 1
+        return None
+
+    def _prune(self, now):
+        for key, bucket in list(self.by_room.items()):
+            bucket.refill(now)
+            if bucket.tokens >= bucket.burst:
+                del self.by_room[key]
+
+    def forget(self, sid):
+        self.by_sid.pop(sid, None)
+
+    def stats(self):
+        return {"limits": self.limits, "connections": len(self.by_sid), "room_buckets": len(self.by_room),
+                "events": {group: dict(c) for group, c in self.counters.items()}}
+
+
+RATE_LIMITER = SocketRateLimiter(SOCKET_LIMITS)
+
+
+def rate_limited(group, room=None, cost=None):
+    """Socket.IO olay yöneticisi için sınır; room(data) ve cost(data) isteğe bağlıdır."""
+    def decorator(handler):
+        @functools.wraps(handler)
+        def wrapper(data=None, *args):
+            rejected = RATE_LIMITER.check(
+                group, request.sid, room(data) if room and isinstance(data, dict) else None, data,
+                cost(data) if cost and isinstance(data, dict) else 1)
+            if rejected is None:
+                return handler(data, *args)
+            if RATE_LIMITER.limits[group]["notify"]:
+                reason, retry_after = rejected
+                emit('rate_limited', {
+                    'group': group, 'reason': reason,
+                    'retry_after': round(retry_after, 3) if retry_after is not None else None,
+                    'cid': data.get('cid') if isinstance(data, dict) else None})
+        return wrapper
+    return decorator
 
 
 # -------------------- ANA SAYFA (gizlilik filtreli) (Aynı kaldı) --------------------
@@ -429,14 +1767,110 @@ def index():
     return render_template_string(
         PAGE,
         posts=visible_posts,
-        LIVE_STREAMS=LIVE_STREAMS,
+        LIVE_STREAMS=PRESENCE.live_users(),
         current_user=current_user,
+        unread_notifications=NOTIFIER.unread(me_id) if current_user else 0,
         friends_of_current=friends_of_current,
         req_sent_of_current=req_sent_of_current,
         req_recv_of_current=req_recv_of_current,
     )
 
 
+# -------------------- PAROLA ÖZETLERİ (iş parçacığı havuzu) --------------------
+# scrypt/PBKDF2 saf CPU işidir; satır içinde çalışırsa tek olay döngüsünü (sinyalleşme,
+# medya akışı) durdurur. hashlib bu sırada GIL'i bıraktığından ayrı iş parçacıkları
+# yeterli: istek sonucu beklerken döngüye söz verir. Kuyruk sınırı aşılırsa 503 döner.
+# Çağıran, beklemeden önce okuma işlemini bitirmeli; yoksa bekleyen istekler bağlantı
+# havuzunu tüketir ve sıradaki checkout tüm döngüyü kilitler.
+# Başarılı girişte PASSWORD_METHOD'dan farklı parametreli eski özetler yenilenir.
+PASSWORD_METHOD = os.environ.get("PASSWORD_METHOD", "scrypt:32768:8:1")
+PASSWORD_WORKERS = int(os.environ.get("PASSWORD_WORKERS", 2))  # 0 = satır içi (eski davranış)
+PASSWORD_QUEUE_MAX = int(os.environ.get("PASSWORD_QUEUE_MAX", 32))  # çalışan işlere ek bekleyen iş
+
+
+class PasswordHasher:
+    """Parola özetleme/doğrulamayı sınırlı havuzda çalıştırır; süreleri ölçer."""
+
+    def __init__(self, workers, queue_max, method):
+        self.workers = workers
+        self.queue_max = queue_max
+        self.method = method
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="password") if workers else None
+        self._lock = threading.Lock()
+        self._tag = None
+        self.inflight = 0
+        self.counters = Counter()
+        self.latency = {}  # {"hash"|"verify": LatencyHistogram} — kuyrukta bekleme dahil
+        self.blocked_ms = 0.0  # satır içi modda döngünün bloklandığı toplam süre
+
+    def _method_tag(self):
+        # "scrypt" gibi kısa yazımlar özete "scrypt:32768:8:1" olarak geçer; karşılaştırma bununla
+        if self._tag is None:
+            self._tag = generate_password_hash("", self.method).split("$", 1)[0]
+        return self._tag
+
+    def _hash(self, password):
+        return generate_password_hash(password, self.method)
+
+    def _verify(self, stored, password):
+        if not check_password_hash(stored, password):
+            return False, None
+        if stored.split("$", 1)[0] != self._method_tag():
+            return True, self._hash(password)
+        return True, None
+
+    def _run(self, op, fn, *args):
+        """fn'i havuzda çalıştırıp sonucunu döndürür; kuyruk doluysa None."""
+        started = time.perf_counter()
+        if self._executor is None:
+            result = fn(*args)
+            with self._lock:
+                self.blocked_ms += (time.perf_counter() - started) * 1000
+        else:
+            with self._lock:
+                if self.inflight >= self.workers + self.queue_max:
+                    self.counters["rejected"] += 1
+                    return None
+                self.inflight += 1
+            try:
+                future = self._executor.submit(fn, *args)
+                delay = 0.001
+                while not future.done():
+                    socketio.sleep(delay)
+                    delay = min(delay * 2, 0.01)
+                result = future.result()
+            finally:
+                with self._lock:
+                    self.inflight -= 1
+        with self._lock:
+            self.counters[op] += 1
+            self.latency.setdefault(op, LatencyHistogram()).observe((time.perf_counter() - started) * 1000)
+        return result
+
+    def hash(self, password):
+        """Yeni özet; havuz doluysa None."""
+        return self._run("hash", self._hash, password)
+
+    def verify(self, stored, password):
+        """(doğru mu, yenilenmiş özet ya da None); havuz doluysa None."""
+        result = self._run("verify", self._verify, stored, password)
+        if result is not None and result[1] is not None:
+            with self._lock:
+                self.counters["rehashed"] += 1
+        return result
+
+    def stats(self):
+        with self._lock:
+            return {"method": self.method, "workers": self.workers, "queue_max": self.queue_max,
+                    "inflight": self.inflight, "counters": dict(self.counters),
+                    "loop_blocked_ms": round(self.blocked_ms, 3),
+                    "latency": {op: h.to_dict() for op, h in self.latency.items()}}
+
+
+PASSWORDS = PasswordHasher(PASSWORD_WORKERS, PASSWORD_QUEUE_MAX, PASSWORD_METHOD)
+PASSWORD_BUSY = ("Sunucu meşgul, biraz sonra tekrar deneyin.", 503, {"Retry-After": "1"})
+
+
 # -------------------- KAYIT & GİRİŞ (Aynı kaldı) --------------------
 @app.route("/register", methods=["GET", "POST"])
 def register():
@@ -452,9 +1886,12 @@ def register():
         if User.query.filter_by(username=username).first():
             return "Bu kullanıcı adı alınmış. <a href='/register'>&larr; Geri</a>", 400
 
+        db.session.rollback()  # özet beklenirken bağlantı havuza dönsün
+        password_hash = PASSWORDS.hash(password)
+        if password_hash is None: return PASSWORD_BUSY
         new_user = User(
             username=username,
-            password_hash=generate_password_hash(password),
+            password_hash=password_hash,
             bio=bio,
             avatar=None,
             privacy=priv
@@ -488,8 +1925,18 @@ def login():
         username = (request.form.get("username") or "").strip()
         password = (request.form.get("password") or "").strip()
         u = User.query.filter_by(username=username).first()
-        if not u or not check_password_hash(u.password_hash, password):
+        if not u:
+            return "Geçersiz kimlik. <a href='/login'>&larr; Geri</a>", 401
+        stored = u.password_hash
+        db.session.rollback()  # doğrulama beklenirken bağlantı havuza dönsün
+        result = PASSWORDS.verify(stored, password)
+        if result is None: return PASSWORD_BUSY
+        ok, upgraded = result
+        if not ok:
             return "Geçersiz kimlik. <a href='/login'>&larr; Geri</a>", 401
+        if upgraded:
+            u.password_hash = upgraded
+            db.session.commit()
 
         session["user"] = username
         return redirect(url_for("index"))
@@ -534,7 +1981,8 @@ def profile(username):
             safe = secure_filename(file.filename)
             stem, _ = os.path.splitext(safe)
             unique = f"{stem}_{uuid.uuid4().hex[:6]}{ext}"
-            file.save(os.path.join(AVATAR_DIR, unique))
+            run_blocking(file.save, os.path.join(AVATAR_DIR, unique))
+            DERIVATIVES.submit("avatar", unique)
 
             old = user.avatar
             if old and old != unique:
@@ -542,6 +1990,7 @@ def profile(username):
                     os.remove(os.path.join(AVATAR_DIR, old))
                 except OSError:
                     pass
+                SMALL_ASSETS.invalidate(os.path.join(AVATAR_DIR, old), *DERIVATIVES.discard("avatar", old))
 
             user.avatar = unique
             db.session.commit()
@@ -559,7 +2008,7 @@ def profile(username):
     user_posts = user.posts.order_by(Post.id.desc()).all()
     bio = user.bio or ''
     uav = user.avatar
-    av_html = f"<img src='/avatar/{uav}' style='width:120px;height:120px;border-radius:50%;object-fit:cover;border:2px solid #e5e7eb;'>" if uav else "<div class='muted' style='margin:8px 0;'>Profil fotoğrafı yok</div>"
+    av_html = f"<img src='/avatar/{uav}?w=120' style='width:120px;height:120px;border-radius:50%;object-fit:cover;border:2px solid #e5e7eb;'>" if uav else "<div class='muted' style='margin:8px 0;'>Profil fotoğrafı yok</div>"
     privacy = user.privacy
 
     status = get_friendship_status(me_id, user.id) if current_user else 'none'
@@ -573,7 +2022,7 @@ def profile(username):
     """
 
     # YENİ EKLENTİ: CANLI YAYIN DURUMU
-    if username in LIVE_STREAMS:
+    if PRESENCE.is_live(username):
         html += f"<p><a href='/live_stream/{username}' style='color:red; font-weight:bold;'>🔴 CANLI YAYINDA! İzle</a></p>"
 
     if current_user and current_user.username == username:
@@ -623,7 +2072,7 @@ def profile(username):
 
 @app.route("/avatar/<filename>")
 def serve_avatar(filename):
-    return send_from_directory(AVATAR_DIR, filename)
+    return send_image(AVATAR_DIR, filename, "avatar")
 
 
 # -------------------- GÖNDERİLER (POST) (Aynı kaldı) --------------------
@@ -631,7 +2080,7 @@ def save_media(file_storage, target_dir):
     safe = secure_filename(file_storage.filename)
     stem, ext = os.path.splitext(safe)
     unique = f"{stem}_{uuid.uuid4().hex[:8]}{ext.lower()}"
-    file_storage.save(os.path.join(target_dir, unique))
+    run_blocking(file_storage.save, os.path.join(target_dir, unique))
     return unique
 
 
@@ -653,7 +2102,8 @@ def post():
     if photo and photo.filename:
         if not is_image(photo.filename): return "Sadece resim yükleyin (jpg, png, webp...).", 400
         img_name = save_media(photo, UPLOAD_DIR)
-        parts.append(f"<img class='media' src='/uploads/{img_name}' alt=''>")
+        DERIVATIVES.submit("upload", img_name)
+        parts.append(f"<img class='media' src='/uploads/{img_name}?w=720' alt=''>")
 
     if media and media.filename:
         ext = os.path.splitext(media.filename)[1].lower()
@@ -683,6 +2133,7 @@ def like_post(post_id):
     if post and can_view_posts(post.user_id, me_id):
         post.likes += 1
         db.session.commit()
+        NOTIFIER.notify(post.user_id, "like", me_id, post.id)
 
     return redirect(url_for("index"))
 
@@ -708,7 +2159,8 @@ def add_comment(post_id):
         ext = os.path.splitext(media.filename)[1].lower()
         if ext in IMAGE_EXT:
             name = save_media(media, UPLOAD_DIR)
-            parts.append(f"<img class='media' src='/uploads/{name}' alt=''>")
+            DERIVATIVES.submit("upload", name)
+            parts.append(f"<img class='media' src='/uploads/{name}?w=720' alt=''>")
         elif ext in VIDEO_EXT:
             name = save_media(media, MEDIA_DIR)
             parts.append(f"<video controls preload='metadata' src='/media/{name}'></video>")
@@ -723,6 +2175,7 @@ def add_comment(post_id):
     new_comment = Comment(post_id=post_id, user_id=current_user.id, html_content="<br>".join(parts))
     db.session.add(new_comment)
     db.session.commit()
+    NOTIFIER.notify(target_post.user_id, "comment", current_user.id, post_id)
     return redirect(request.referrer or url_for("index"))
 
 
@@ -745,13 +2198,16 @@ def request_friend(username):
         req = Friendship.query.filter_by(user_id=target.id, friend_id=me.id, status='pending').first()
         if req:
             req.status = 'accepted'
+            mark_suggestions_dirty(me.id, target.id)
             db.session.commit()
+            NOTIFIER.notify(target.id, "friend_accept", me.id, me.id)
             return redirect(request.referrer or url_for("profile", username=username))
 
     # Yeni istek gönder
     new_req = Friendship(user_id=me.id, friend_id=target.id, status='pending')
     db.session.add(new_req)
     db.session.commit()
+    NOTIFIER.notify(target.id, "friend_request", me.id)
     return redirect(request.referrer or url_for("profile", username=username))
 
 
@@ -780,7 +2236,9 @@ def accept_request(username):
     req = Friendship.query.filter_by(user_id=target.id, friend_id=me.id, status='pending').first()
     if req:
         req.status = 'accepted'
+        mark_suggestions_dirty(me.id, target.id)
         db.session.commit()
+        NOTIFIER.notify(target.id, "friend_accept", me.id, me.id)
 
     return redirect(request.referrer or url_for("profile", username=username))
 
@@ -800,6 +2258,93 @@ def decline_request(username):
     return redirect(request.referrer or url_for("profile", username=username))
 
 
+# Toplu istek işlemleri: tek işlemde, küme tabanlı tek UPDATE/DELETE.
+BULK_REQUESTS_MAX = 500  # istek başına kullanıcı adı
+
+
+def bulk_friend_requests(me, action, usernames=None):
+    """action: accept/decline (gelen) ya da cancel (giden). usernames None ise bekleyenlerin tümü.
+
+    Kullanıcı adı başına sonuç döndürür: ok, not_found ya da no_pending_request.
+    """
+    results = {}
+    if action == "cancel":
+        mine, theirs = Friendship.user_id, Friendship.friend_id
+    else:
+        mine, theirs = Friendship.friend_id, Friendship.user_id
+    q = db.session.query(Friendship.id, theirs, User.username).join(User, User.id == theirs).filter(
+        mine == me.id, Friendship.status == 'pending')
+    if usernames is not None:
+        names = list(dict.fromkeys(usernames))[:BULK_REQUESTS_MAX]
+        results = dict.fromkeys(names, "no_pending_request")
+        found = {name for (name,) in db.session.query(User.username).filter(User.username.in_(names))}
+        results.update((name, "not_found") for name in names if name not in found)
+        q = q.filter(User.username.in_(names))
+    rows = q.all()
+    if not rows:
+        return results
+    row_ids = [row_id for row_id, _, _ in rows]
+    other_ids = [other_id for _, other_id, _ in rows]
+    pending = Friendship.query.filter(Friendship.id.in_(row_ids))
+    # Toplu UPDATE/DELETE eşleyici olaylarını atlar; değişiklik akışına elle yazılır
+    if action == "accept":
+        pending.update({"status": "accepted"}, synchronize_session=False)
+        # Karşı yönde benim de bekleyen isteğim varsa artık gereksiz
+        reverse = Friendship.query.filter(Friendship.user_id == me.id, Friendship.friend_id.in_(other_ids),
+                                          Friendship.status == 'pending')
+        stale = [friendship_change(row_id, me.id, other_id)
+                 for row_id, other_id in reverse.with_entities(Friendship.id, Friendship.friend_id)]
+        reverse.delete(synchronize_session=False)
+        record_changes([friendship_change(row_id, other_id, me.id, "accepted")
+                        for row_id, other_id in zip(row_ids, other_ids)] + stale
+                       + [row for other_id in other_ids for row in friendship_resync(me.id, other_id)])
+        mark_suggestions_dirty(me.id, *other_ids)
+    else:
+        pending.delete(synchronize_session=False)
+        if action == "cancel":
+            record_changes([friendship_change(row_id, me.id, other_id) for row_id, other_id in zip(row_ids, other_ids)])
+        else:
+            record_changes([friendship_change(row_id, other_id, me.id) for row_id, other_id in zip(row_ids, other_ids)])
+    db.session.commit()
+    if action == "accept":
+        for other_id in other_ids:
+            NOTIFIER.notify(other_id, "friend_accept", me.id, me.id)
+    results.update((name, "ok") for _, _, name in rows)
+    return results
+
+
+@app.route("/requests/bulk", methods=["POST"])
+def requests_bulk():
+    """İstek kutusundaki 'tümünü' düğmeleri."""
+    me = get_user_by_username(session.get("user"))
+    if not me: return redirect(url_for("login"))
+    action = request.form.get("action")
+    if action not in ("accept", "decline", "cancel"): return "Geçersiz işlem.", 400
+    names = request.form.getlist("username")
+    bulk_friend_requests(me, action, names or None)
+    return redirect(url_for("requests_box"))
+
+
+@app.route("/api/friend_requests/bulk", methods=["POST"])
+def api_friend_requests_bulk():
+    """JSON: {"action": "accept"|"decline"|"cancel", "usernames": [...]} ya da {"action": ..., "all": true}."""
+    me = get_user_by_username(session.get("user"))
+    if not me: return jsonify({"error": "giriş gerekli"}), 401
+    data = request.get_json(silent=True) or {}
+    action, usernames = data.get("action"), data.get("usernames")
+    if action not in ("accept", "decline", "cancel"):
+        return jsonify({"error": "action accept, decline ya da cancel olmalı"}), 400
+    if data.get("all"):
+        usernames = None
+    elif not isinstance(usernames, list) or not all(isinstance(u, str) for u in usernames):
+        return jsonify({"error": "usernames listesi ya da all: true gerekli"}), 400
+    elif len(usernames) > BULK_REQUESTS_MAX:
+        return jsonify({"error": f"en fazla {BULK_REQUESTS_MAX} kullanıcı adı"}), 400
+    results = bulk_friend_requests(me, action, usernames)
+    return jsonify({"action": action, "results": results,
+                    "processed": sum(1 for r in results.values() if r == "ok")})
+
+
 @app.route("/requests")
 def requests_box():
     me = get_user_by_username(session.get("user"))
@@ -818,63 +2363,566 @@ def requests_box():
     if not incoming:
         html += "<p>Yok.</p>"
     else:
+        html += ("<form action='/requests/bulk' method='post' style='margin-bottom:10px;'>"
+                 "<button name='action' value='accept'>✅ Tümünü kabul et</button> "
+                 "<button name='action' value='decline'>❌ Tümünü reddet</button></form>")
         for u in incoming:
             html += f"<div><b>{u}</b> <form action='/accept_request/{u}' method='post' style='display:inline;'><button>✅</button></form> <form action='/decline_request/{u}' method='post' style='display:inline;margin-left:6px;'><button>❌</button></form></div><br>"
     html += "<h3>Gönderilen</h3>"
     if not outgoing:
         html += "<p>Yok.</p>"
     else:
+        html += ("<form action='/requests/bulk' method='post' style='margin-bottom:10px;'>"
+                 "<button name='action' value='cancel'>↩️ Tümünü geri al</button></form>")
         for u in outgoing:
             html += f"<div><b>{u}</b> <form action='/cancel_request/{u}' method='post' style='display:inline;margin-left:8px;'><button>↩️ Geri al</button></form></div><br>"
     return html
 
 
+# -------------------- ARKADAŞ ÖNERİLERİ (ortak arkadaş) --------------------
+# Kabul edilmiş arkadaşlıklar simetrik bir komşuluk matrisi A'dır; (A·A)[u, v]
+# u ile v'nin ortak arkadaş sayısıdır. Hesap arka planda, SUGGEST_CHUNK satırlık
+# parçalar hâlinde yapılır ve kullanıcı başına ilk SUGGEST_TOP_K aday saklanır.
+# İstek yalnızca hazır satırları okur. Tazeleme yalnızca kenarı değişen
+# kullanıcıları ve onların arkadaşlarını yeniden hesaplar.
+SUGGEST_INTERVAL = float(os.environ.get("SUGGEST_INTERVAL", 300))  # sn; 0 = kapalı
+SUGGEST_TOP_K = 20
+SUGGEST_CHUNK = 500  # satır; her parçadan sonra olay döngüsüne söz verilir
+
+
+def mark_suggestions_dirty(*user_ids):
+    """Arkadaşlık kenarı değişen kullanıcıları işaretle (commit çağırana kalır).
+
+    Tek INSERT OR IGNORE: toplu kabulde id başına SELECT (merge) olmasın.
+    """
+    if user_ids:
+        db.session.execute(db.insert(SuggestionDirty).prefix_with("OR IGNORE"),
+                           [{"user_id": user_id} for user_id in dict.fromkeys(user_ids)])
+
+
+class SuggestionEngine:
+    """Ortak arkadaş sayısına göre öneri listelerini toplu hesaplar."""
+
+    def __init__(self, top_k, chunk):
+        self.top_k = top_k
+        self.chunk = chunk
+        self.running = False
+        self.last_run = None
+        self.totals = Counter()
+
+    def _graph(self):
+        user_ids = [uid for (uid,) in db.session.query(User.id).order_by(User.id)]
+        edges = db.session.query(Friendship.user_id, Friendship.friend_id).filter_by(status='accepted').all()
+        return user_ids, edges
+
+    def _top(self, pairs):
+        return sorted(pairs, key=lambda kv: (-kv[1], kv[0]))[:self.top_k]
+
+    def _compute_python(self, user_ids, edges, rows):
+        adj = {uid: set() for uid in user_ids}
+        for u, v in edges:
+            if u in adj and v in adj and u != v:
+                adj[u].add(v)
+                adj[v].add(u)
+        for n, user_id in enumerate(rows, 1):
+            mutual = Counter()
+            for friend in adj[user_id]:
+                mutual.update(adj[friend])
+            mutual.pop(user_id, None)
+            for friend in adj[user_id]:
+                mutual.pop(friend, None)
+            yield user_id, self._top(mutual.items())
+            if n % self.chunk == 0:
+                socketio.sleep(0)
+
+    def _compute_sparse(self, user_ids, edges, rows):
+        index = {uid: i for i, uid in enumerate(user_ids)}
+        ids = np.asarray(user_ids)
+        pairs = np.array([(index[u], index[v]) for u, v in edges if u in index and v in index and u != v],
+                         dtype=np.int64).reshape(-1, 2)
+        src = np.concatenate([pairs[:, 0], pairs[:, 1]])
+        dst = np.concatenate([pairs[:, 1], pairs[:, 0]])
+        n = len(user_ids)
+        adj = sparse.csr_matrix((np.ones(len(src), dtype=np.int32), (src, dst)), shape=(n, n))
+        adj.data[:] = 1  # aynı çift iki yönde kayıtlıysa tekrarlar toplanmış olabilir
+        row_idx = np.array([index[uid] for uid in rows], dtype=np.int64)
+        for start in range(0, len(row_idx), self.chunk):
+            part = row_idx[start:start + self.chunk]
+            block = adj[part]
+            mutual = (block @ adj).tocsr()
+            # Kendisi ve zaten arkadaş olanlar aday değil
+            own = sparse.csr_matrix((np.ones(len(part), dtype=np.int32), (np.arange(len(part)), part)),
+                                    shape=mutual.shape)
+            mutual = mutual - mutual.multiply(block) - mutual.multiply(own)
+            mutual.eliminate_zeros()
+            for i, uid in enumerate(part):
+                lo, hi = mutual.indptr[i], mutual.indptr[i + 1]
+                cols, counts = mutual.indices[lo:hi], mutual.data[lo:hi]
+                order = np.lexsort((ids[cols], -counts))[:self.top_k]
+                yield int(ids[uid]), [(int(ids[cols[j]]), int(counts[j])) for j in order]
+            socketio.sleep(0)
+
+    def refresh(self, full=False):
+        """Kirli kullanıcıları (ya da herkesi) yeniden hesaplar; yazılan kullanıcı sayısını döndürür."""
+        if self.running:
+            return 0
+        self.running = True
+        started = time.time()
+        try:
+            dirty = {uid for (uid,) in db.session.query(SuggestionDirty.user_id)}
+            if not full and FriendSuggestion.query.first() is None:
+                full = True  # ilk çalıştırma
+            if not full and not dirty:
+                return 0
+            user_ids, edges = self._graph()
+            if full:
+                rows = user_ids
+            else:
+                known = set(user_ids)
+                affected = set(dirty)
+                for u, v in edges:  # kirli kullanıcıların arkadaşlarının da ortak sayıları değişti
+                    if u in dirty:
+                        affected.add(v)
+                    if v in dirty:
+                        affected.add(u)
+                rows = sorted(affected & known)
+            compute = self._compute_sparse if sparse is not None and user_ids and edges else self._compute_python
+            results = dict(compute(user_ids, edges, rows))
+            for start in range(0, len(rows), self.chunk):
+                part = rows[start:start + self.chunk]
+                FriendSuggestion.query.filter(FriendSuggestion.user_id.in_(part)).delete(synchronize_session=False)
+            values = [{"user_id": uid, "candidate_id": cand, "mutual": mutual, "rank": rank}
+                      for uid, top in results.items() for rank, (cand, mutual) in enumerate(top)]
+            if values:
+                db.session.execute(db.insert(FriendSuggestion), values)
+            if dirty:
+                # Hesap sırasında eklenen işaretler bir sonraki tura kalır
+                SuggestionDirty.query.filter(SuggestionDirty.user_id.in_(dirty)).delete(synchronize_session=False)
+            db.session.commit()
+            self.last_run = {"finished_at": time.time(), "seconds": round(time.time() - started, 3),
+                             "full": full, "users": len(rows), "engine": "sparse" if compute == self._compute_sparse else "python"}
+            self.totals.update(runs=1, users=len(rows))
+            return len(rows)
+        finally:
+            self.running = False
+            db.session.remove()
+
+    def loop(self, interval):
+        while True:
+            socketio.sleep(interval)
+            try:
+                with app.app_context():
+                    self.refresh()
+            except Exception as e:
+                print(f"Öneri tazeleme hatası: {e!r}")
+
+    def status(self):
+        return {"running": self.running, "last_run": self.last_run, "totals": dict(self.totals),
+                "interval": SUGGEST_INTERVAL, "top_k": self.top_k, "vectorized": sparse is not None}
+
+
+SUGGESTIONS = SuggestionEngine(SUGGEST_TOP_K, SUGGEST_CHUNK)
+
+
+def suggestions_for(user_id, limit=10):
+    """Hazır öneri satırları; o arada istek gönderilmiş/arkadaş olunmuş adaylar atlanır."""
+    rows = db.session.query(FriendSuggestion.candidate_id, User.username, FriendSuggestion.mutual).join(
+        User, User.id == FriendSuggestion.candidate_id
+    ).filter(FriendSuggestion.user_id == user_id).order_by(FriendSuggestion.rank).limit(limit * 2).all()
+    linked = {friend_id if uid == user_id else uid for uid, friend_id in db.session.query(
+        Friendship.user_id, Friendship.friend_id).filter(or_(Friendship.user_id == user_id, Friendship.friend_id == user_id))}
+    return [(name, mutual) for candidate_id, name, mutual in rows if candidate_id not in linked][:limit]
+
+
+@app.route("/suggestions")
+@query_budget(3)
+def suggestions_page():
+    me = get_user_by_username(session.get("user"))
+    if not me: return redirect(url_for("login"))
+    html = "<h2>Tanıyor olabileceğin kişiler</h2><p><a href='/'>Geri</a></p><hr>"
+    items = suggestions_for(me.id)
+    if not items:
+        html += "<p>Şimdilik öneri yok.</p>"
+    for name, mutual in items:
+        html += (f"<div><b><a href='/user/{name}'>{name}</a></b> <span class='muted'>{mutual} ortak arkadaş</span>"
+                 f" <form action='/request_friend/{name}' method='post' style='display:inline;margin-left:8px;'>"
+                 f"<button>🤝 İstek</button></form></div><br>")
+    return html
+
+
+# -------------------- BİLDİRİMLER --------------------
+# Olaylar NOTIFY_WINDOW boyunca bellekte (kullanıcı, tür, hedef) başına birleştirilir
+# ("12 yeni beğeni"); pencere sonunda tek işlemde yazılır ve kullanıcı başına tek
+# 'notifications' olayıyla user_<id> odasına itilir. Okunmamış sayısı
+# NotificationCounter'dan okunur.
+NOTIFY_WINDOW = float(os.environ.get("NOTIFY_WINDOW", 1.0))  # sn
+NOTIFY_PAGE = 50  # /notifications sayfasında gösterilen son bildirim sayısı
+
+
+def user_room(user_id):
+    return f"user_{user_id}"
+
+
+def notification_text(n):
+    actor = n.actor.username if n.actor else "Biri"
+    if n.kind == "friend_request":
+        return f"{actor} sana arkadaşlık isteği gönderdi" if n.count == 1 else f"{n.count} yeni arkadaşlık isteği"
+    if n.kind == "friend_accept":
+        return f"{actor} arkadaşlık isteğini kabul etti" if n.count == 1 else f"{n.count} isteğin kabul edildi"
+    if n.kind == "comment":
+        return f"{actor} gönderine yorum yaptı" if n.count == 1 else f"Gönderine {n.count} yeni yorum (son: {actor})"
+    if n.kind == "like":
+        return f"{actor} gönderini beğendi" if n.count == 1 else f"Gönderin {n.count} yeni beğeni aldı"
+    if n.kind == "dm":
+        return f"{actor} sana mesaj gönderdi" if n.count == 1 else f"{actor} kullanıcısından {n.count} yeni mesaj"
+    return n.kind
+
+
+def notification_link(n):
+    if n.kind in ("comment", "like"):
+        return "/"
+    if n.kind == "friend_request":
+        return "/requests"
+    return f"/dm/{n.actor.username}" if n.kind == "dm" and n.actor else (f"/user/{n.actor.username}" if n.actor else "/")
+
+
+def notification_dict(n):
+    return {"id": n.id, "kind": n.kind, "count": n.count, "read": n.read, "text": notification_text(n),
+            "link": notification_link(n), "updated_at": n.updated_at}
+
+
+class NotificationHub:
+    """Bildirim olaylarını birleştirip toplu yazar ve iter."""
+
+    def __init__(self, window):
+        self.window = window
+        self.pending = {}  # {(user_id, kind, target_id): [adet, son_actor_id]}
+        self.counters = Counter()
+        self._flusher = None
+
+    def notify(self, user_id, kind, actor_id=None, target_id=None):
+        if not user_id or user_id == actor_id:
+            return  # kendi eylemin için bildirim yok
+        entry = self.pending.setdefault((user_id, kind, target_id), [0, None])
+        entry[0] += 1
+        entry[1] = actor_id
+        self.counters["events"] += 1
+        if self._flusher is None:
+            self._flusher = socketio.start_background_task(self._flush_later)
+
+    def _flush_later(self):
+        socketio.sleep(self.window)
+        self._flusher = None
+        try:
+            self.flush()
+        except Exception as e:
+            print(f"Bildirim yazma hatası: {e!r}")
+
+    def flush(self):
+        pending, self.pending = self.pending, {}
+        if not pending:
+            return
+        now = time.time()
+        touched = {}  # {user_id: [Notification, ...]}
+        with app.app_context():
+            new_rows = Counter()
+            for (user_id, kind, target_id), (count, actor_id) in pending.items():
+                row = Notification.query.filter_by(user_id=user_id, read=False, kind=kind, target_id=target_id).first()
+                if row is None:
+                    row = Notification(user_id=user_id, kind=kind, target_id=target_id, count=0)
+                    db.session.add(row)
+                    new_rows[user_id] += 1
+                row.count += count
+                row.actor_id = actor_id
+                row.updated_at = now
+                touched.setdefault(user_id, []).append(row)
+            unread = {}
+            for user_id in touched:
+                counter = db.session.get(NotificationCounter, user_id)
+                if counter is None:
+                    counter = NotificationCounter(user_id=user_id, unread=0)
+                    db.session.add(counter)
+                counter.unread += new_rows[user_id]
+                unread[user_id] = counter.unread
+            db.session.commit()
+            for user_id, rows in touched.items():
+                socketio.emit('notifications', {'unread': unread[user_id], 'items': [notification_dict(n) for n in rows]},
+                              to=user_room(user_id))
+            db.session.remove()
+        self.counters["flushes"] += 1
+        self.counters["written"] += len(pending)
+        self.counters["pushed"] += len(touched)
+
+    def discard(self, user_id, kind, target_id=None):
+        """Henüz yazılmamış bildirimi düşür (ör. alıcı konuşmayı zaten görüyor)."""
+        self.pending.pop((user_id, kind, target_id), None)
+
+    def unread(self, user_id):
+        counter = db.session.get(NotificationCounter, user_id)
+        return counter.unread if counter else 0
+
+    def mark_read(self, user_id, kind=None, target_id=None):
+        """Okundu işaretler ve sayacı güncellenen satır kadar düşürür (commit çağırana kalır)."""
+        q = Notification.query.filter_by(user_id=user_id, read=False)
+        if kind is not None:
+            q = q.filter_by(kind=kind, target_id=target_id)
+        changed = q.update({"read": True}, synchronize_session=False)
+        if changed:
+            counter = db.session.get(NotificationCounter, user_id)
+            if counter is not None:
+                counter.unread = max(0, counter.unread - changed)
+        return changed
+
+    def stats(self):
+        return {"window": self.window, "pending": len(self.pending), **self.counters}
+
+
+NOTIFIER = NotificationHub(NOTIFY_WINDOW)
+
+
+@socketio.on('connect')
+def handle_connect():
+    """Giriş yapmış kullanıcılar kendi bildirim odalarına katılır."""
+    me = get_user_by_username(session.get("user"))
+    if me:
+        join_room(user_room(me.id))
+
+
+@app.route("/notifications")
+@query_budget(3)
+def notifications_page():
+    me = get_user_by_username(session.get("user"))
+    if not me: return redirect(url_for("login"))
+    items = Notification.query.filter_by(user_id=me.id).order_by(Notification.id.desc()).limit(NOTIFY_PAGE).all()
+    html = "<h2>Bildirimler</h2><p><a href='/'>Geri</a></p><hr>"
+    if not items:
+        html += "<p>Bildirim yok.</p>"
+    for n in items:
+        style = "" if n.read else " style='font-weight:bold;'"
+        html += f"<div{style}><a href='{notification_link(n)}'>{notification_text(n)}</a></div><br>"
+    if NOTIFIER.mark_read(me.id):
+        db.session.commit()
+    return html
+
+
 # -------------------- DM (Aynı kaldı) --------------------
 @app.route("/inbox")
+@query_budget(2)
 def inbox():
     me = get_user_by_username(session.get("user"))
     if not me: return redirect(url_for("login"))
     me_id = me.id
 
-    # Benim gönderdiğim ve aldığım tüm mesajları çeker
-    dms = DirectMessage.query.filter(or_(DirectMessage.from_user_id == me_id, DirectMessage.to_user_id == me_id)).all()
-
-    # Konuşulan kullanıcı adlarını bul
-    users = set()
-    for m in dms:
-        if m.from_user_id != me_id:
-            users.add(m.sender.username)
-        if m.to_user_id != me_id:
-            users.add(m.recipient.username)
-
-    sorted_users = sorted(list(users))
+    # Konuşma özetleri: tek indeksli sorgu, en yeni konuşma önce
+    partner_id = case((Conversation.user_low == me_id, Conversation.user_high), else_=Conversation.user_low)
+    rows = db.session.query(Conversation, User.username).join(User, User.id == partner_id).filter(
+        or_(Conversation.user_low == me_id, Conversation.user_high == me_id)
+    ).order_by(Conversation.last_message_id.desc()).all()
 
     html = "<h2>Mesajlar</h2><p><a href='/'>Geri</a></p><hr>"
-    if not sorted_users:
+    if not rows:
         html += "<p>Henüz konuşma yok.</p>"
     else:
-        for u in sorted_users:
-            html += f"<div><a href='/dm/{u}'>@{u}</a></div>"
+        for conv, u in rows:
+            unread = conv.unread_low if conv.user_low == me_id else conv.unread_high
+            badge = f" <b>({unread})</b>" if unread else ""
+            html += f"<div><a href='/dm/{u}'>@{u}</a>{badge} <span class='muted'>{conv.preview}</span></div>"
     return html
 
 
+# Konuşma özeti her DM eklendiğinde güncellenir (dm() POST'u ve DM_WRITER);
+# okundu işareti okuyan tarafın sayacını sıfırlar.
+DM_PREVIEW_LEN = 80
+
+
+def dm_preview(html):
+    """HTML içerikten kısa düz metin önizleme."""
+    text = " ".join(re.sub(r"<[^>]+>", " ", html).split())
+    return text[:DM_PREVIEW_LEN].replace("<", "&lt;") or "📎 Medya"
+
+
+def touch_conversation(message):
+    """Eklenmiş (id'si atanmış) DM için konuşma özetini günceller; commit çağırana kalır."""
+    low, high = sorted((message.from_user_id, message.to_user_id))
+    unread = Conversation.unread_low if message.to_user_id == low else Conversation.unread_high
+    preview, now = dm_preview(message.html_content), time.time()
+    newer = Conversation.last_message_id < message.id  # eşzamanlı yazımlarda geri gitmesin
+    values = {
+        Conversation.last_message_id: case((newer, message.id), else_=Conversation.last_message_id),
+        Conversation.last_at: case((newer, now), else_=Conversation.last_at),
+        Conversation.preview: case((newer, preview), else_=Conversation.preview),
+        unread: unread + 1,
+    }
+    pair = Conversation.query.filter_by(user_low=low, user_high=high)
+    if pair.update(values, synchronize_session=False):
+        return
+    try:
+        with db.session.begin_nested():
+            db.session.add(Conversation(user_low=low, user_high=high, last_message_id=message.id, last_at=now,
+                                        preview=preview, **{unread.key: 1}))
+    except IntegrityError:
+        pair.update(values, synchronize_session=False)  # başka bir yazım önce ekledi
+
+
+def backfill_conversations():
+    """Özet tablosu boşsa mevcut DM geçmişinden bir kez kurar."""
+    if Conversation.query.first() is not None or DirectMessage.query.first() is None:
+        return 0
+    forward = DirectMessage.from_user_id < DirectMessage.to_user_id
+    low = case((forward, DirectMessage.from_user_id), else_=DirectMessage.to_user_id)
+    high = case((forward, DirectMessage.to_user_id), else_=DirectMessage.from_user_id)
+    pairs = db.session.query(low, high, db.func.max(DirectMessage.id)).group_by(low, high).all()
+    reads = {(r.user_id, r.peer_id): r.last_read_id for r in DirectMessageRead.query}
+    for user_low, user_high, last_id in pairs:
+        last = db.session.get(DirectMessage, last_id)
+        unread = {}
+        for me_id, peer_id in ((user_low, user_high), (user_high, user_low)):
+            unread[me_id] = DirectMessage.query.filter(
+                DirectMessage.from_user_id == peer_id, DirectMessage.to_user_id == me_id,
+                DirectMessage.id > reads.get((me_id, peer_id), 0)).count() if me_id != peer_id else 0
+        db.session.add(Conversation(user_low=user_low, user_high=user_high, last_message_id=last_id,
+                                    last_at=time.time(), preview=dm_preview(last.html_content),
+                                    unread_low=unread[user_low], unread_high=unread[user_high]))
+    db.session.commit()
+    print(f"Konuşma özetleri kuruldu: {len(pairs)} konuşma.")
+    return len(pairs)
+
+
+# Gerçek zamanlı DM: iki kullanıcı dm_{küçük_id}_{büyük_id} odasında buluşur.
+# Soketten gelen mesajlar odaya hemen yayınlanır; veritabanına DM_WRITER
+# ayrı bir thread'de, kısa aralıklarla toplu yazar. Medya için POST kalır.
+DM_HISTORY = 50  # /dm sayfasında bir kez yüklenen son mesaj sayısı
+DM_WRITE_BATCH = 200
+DM_WRITE_INTERVAL = 0.05  # sn
+
+DM_CHANNELS = {}  # {sid: {peer_username: (me_username, me_id, peer_id, room)}}
+
+
+def dm_room(a_id, b_id):
+    """İki kullanıcının ortak DM odası (sıradan bağımsız)."""
+    return f"dm_{min(a_id, b_id)}_{max(a_id, b_id)}"
+
+
+def dm_text_html(text):
+    return text.replace("\n", "<br>")
+
+
+def dm_page(me_id, peer_id, before=None, limit=DM_HISTORY):
+    """(çift, id) anahtarıyla en fazla limit mesaj (eskiden yeniye) ve sonraki sayfanın imleci.
+
+    Her yön (from, to) ix_direct_message_pair_id üzerinde ayrı, sınırlı bir aralık taramasıdır;
+    iki sonuç birleştirilir. limit + 1 satır, daha eski mesaj olup olmadığını söyler.
+    """
+    rows = []
+    for from_id, to_id in {(me_id, peer_id), (peer_id, me_id)}:
+        q = DirectMessage.query.filter_by(from_user_id=from_id, to_user_id=to_id)
+        if before:
+            q = q.filter(DirectMessage.id < before)
+        rows += q.order_by(DirectMessage.id.desc()).limit(limit + 1).all()
+    rows.sort(key=lambda m: m.id, reverse=True)
+    page = rows[:limit]
+    next_before = page[-1].id if len(rows) > limit else None
+    return page[::-1], next_before
+
+
+def dm_read_upto(user_id, peer_id):
+    """user_id'nin peer_id'den gelenleri okuduğu son mesaj id'si."""
+    row = DirectMessageRead.query.filter_by(user_id=user_id, peer_id=peer_id).first()
+    return row.last_read_id if row else 0
+
+
+def mark_dm_read(user_id, peer_id):
+    """peer_id'den gelen son mesaja kadar okundu işaretler (commit çağırana kalır)."""
+    last = db.session.query(db.func.max(DirectMessage.id)).filter_by(
+        from_user_id=peer_id, to_user_id=user_id).scalar()
+    if not last:
+        return
+    low, high = sorted((user_id, peer_id))
+    unread = Conversation.unread_low if user_id == low else Conversation.unread_high
+    Conversation.query.filter_by(user_low=low, user_high=high).update({unread: 0}, synchronize_session=False)
+    row = DirectMessageRead.query.filter_by(user_id=user_id, peer_id=peer_id).first()
+    if row is None:
+        db.session.add(DirectMessageRead(user_id=user_id, peer_id=peer_id, last_read_id=last))
+    elif row.last_read_id < last:
+        row.last_read_id = last
+
+
+class DirectMessageWriter:
+    """Soketten gelen DM ve okundu işaretlerini olay döngüsü dışında, toplu yazar."""
+
+    def __init__(self, batch, interval):
+        self.batch = batch
+        self.interval = interval
+        self.queue = queue.Queue()
+        self.counters = Counter()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def put(self, kind, user_id, peer_id, payload=None):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="dm-writer", daemon=True)
+                self._thread.start()
+        self.queue.put((kind, user_id, peer_id, payload))
+
+    def _run(self):
+        while True:
+            items = [self.queue.get()]
+            deadline = time.monotonic() + self.interval
+            while len(items) < self.batch:
+                try:
+                    items.append(self.queue.get(timeout=max(0, deadline - time.monotonic())))
+                except queue.Empty:
+                    break
+            try:
+                self.write(items)
+            except Exception as e:
+                print(f"DM yazma hatası ({len(items)} kayıt): {e!r}")
+                self.counters["failed"] += len(items)
+
+    def write(self, items):
+        """Sırayı koruyarak tek işlemde yazar; okundu işareti kendinden önceki mesajları da kapsar."""
+        with app.app_context():
+            for kind, user_id, peer_id, payload in items:
+                if kind == "message":
+                    message = DirectMessage(from_user_id=user_id, to_user_id=peer_id, html_content=payload)
+                    db.session.add(message)
+                    db.session.flush()
+                    touch_conversation(message)
+                elif kind == "read":
+                    db.session.flush()
+                    mark_dm_read(user_id, peer_id)
+                    NOTIFIER.mark_read(user_id, "dm", peer_id)
+            db.session.commit()
+        self.counters["batches"] += 1
+        self.counters["written"] += len(items)
+
+    def stats(self):
+        return {"queued": self.queue.qsize(), **self.counters}
+
+
+DM_WRITER = DirectMessageWriter(DM_WRITE_BATCH, DM_WRITE_INTERVAL)
+
+
 @app.route("/dm/<username>", methods=["GET", "POST"])
 def dm(username):
     me = get_user_by_username(session.get("user"))
     target = get_user_by_username(username)
     if not me or not target: return redirect(url_for("login"))
+    room = dm_room(me.id, target.id)
 
     if request.method == "POST":
         msg = (request.form.get("text") or "").strip()
         media = request.files.get("media")
         parts = []
         # ... (Medya işleme ve parts oluşturma kısmı aynı kalır) ...
-        if msg: parts.append(msg.replace("\n", "<br>"))
+        if msg: parts.append(dm_text_html(msg))
         if media and media.filename:
             ext = os.path.splitext(media.filename)[1].lower()
             if ext in IMAGE_EXT:
                 name = save_media(media, UPLOAD_DIR)
-                parts.append(f"<img class='media' src='/uploads/{name}' alt=''>")
+                DERIVATIVES.submit("upload", name)
+                parts.append(f"<img class='media' src='/uploads/{name}?w=720' alt=''>")
             elif ext in VIDEO_EXT:
                 name = save_media(media, MEDIA_DIR)
                 parts.append(f"<video controls preload='metadata' src='/media/{name}'></video>")
@@ -887,54 +2935,395 @@ def dm(username):
         if parts:
             new_dm = DirectMessage(from_user_id=me.id, to_user_id=target.id, html_content="<br>".join(parts))
             db.session.add(new_dm)
+            db.session.flush()
+            touch_conversation(new_dm)
             db.session.commit()
+            NOTIFIER.notify(target.id, "dm", me.id, me.id)
+            # Sayfası açık olan karşı tarafa canlı ilet
+            socketio.emit('dm_message', {'cid': None, 'from': me.username, 'html': new_dm.html_content}, to=room)
 
         return redirect(url_for("dm", username=username))
 
-    # Konuşmayı çek (Gönderen veya alıcı benim/target olduğu mesajlar)
-    conv = DirectMessage.query.filter(
-        or_(
-            (DirectMessage.from_user_id == me.id) & (DirectMessage.to_user_id == target.id),
-            (DirectMessage.from_user_id == target.id) & (DirectMessage.to_user_id == me.id)
-        )
-    ).order_by(DirectMessage.id).all()
+    # Sayfa açıldı: karşı taraftan gelenler okundu; yalnızca son DM_HISTORY mesaj yüklenir,
+    # sonrası soketten gelir
+    mark_dm_read(me.id, target.id)
+    NOTIFIER.mark_read(me.id, "dm", target.id)
+    db.session.commit()
+    socketio.emit('dm_read', {'by': me.username}, to=room)
+
+    read_upto = dm_read_upto(target.id, me.id)
+    conv, next_before = dm_page(me.id, target.id)
 
     html = f"<h2>{username} ile yazışma</h2><p><a href='/'>Geri</a></p><hr>"
+    html += f"<p id='older' class='muted' data-before='{next_before or ''}'>"
+    html += "Daha eski mesajlar için yukarı kaydırın.</p>" if next_before else "Konuşmanın başı.</p>"
+    html += "<div id='conv'>"
     for m in conv:
-        sender = "Ben" if m.from_user_id == me.id else m.sender.username
-        html += f"<p><b>{sender}:</b><br>{m.html_content}</p><hr>"
+        if m.from_user_id == me.id:
+            state = "✓✓ görüldü" if m.id <= read_upto else "✓"
+            html += f"<p><b>Ben:</b><br>{m.html_content} <small class='dm-state'>{state}</small></p><hr>"
+        else:
+            html += f"<p><b>{target.username}:</b><br>{m.html_content}</p><hr>"
 
-    html += """<form method='post' enctype='multipart/form-data'>
+    html += """</div><form id='dm-form' method='post' enctype='multipart/form-data'>
       <textarea name='text' rows='2' placeholder='Mesaj.'></textarea><br>
       <input type='file' name='media' accept='image/*,video/*,audio/*'><br>
       <button>Gönder</button>
     </form>"""
+    html += render_template_string(DM_PAGE_SCRIPT, me=me.username, peer=target.username)
     return html
 
 
+@app.route("/api/dm/<username>")
+@query_budget(5)
+def api_dm_history(username):
+    """Daha eski DM sayfası: ?before=<id>&limit=<n> (keyset imleç)."""
+    me = get_user_by_username(session.get("user"))
+    target = get_user_by_username(username)
+    if not me or not target: return jsonify({"error": "giriş gerekli"}), 401
+    before = request.args.get("before", type=int)
+    limit = max(1, min(request.args.get("limit", DM_HISTORY, type=int), 200))
+    page, next_before = dm_page(me.id, target.id, before, limit)
+    read_upto = dm_read_upto(target.id, me.id)
+    return jsonify({
+        "messages": [{"id": m.id, "from": me.username if m.from_user_id == me.id else target.username,
+                      "mine": m.from_user_id == me.id, "html": m.html_content,
+                      "read": m.from_user_id == me.id and m.id <= read_upto} for m in page],
+        "next_before": next_before,
+    })
+
+
+DM_PAGE_SCRIPT = """<script src="https://cdnjs.cloudflare.com/ajax/libs/socket.io/4.0.1/socket.io.js"></script>
+<script>
+    const socket = io();
+    const me = {{ me|tojson }};
+    const peer = {{ peer|tojson }};
+    const conv = document.getElementById('conv');
+    const form = document.getElementById('dm-form');
+    let states = {}; // Gönderdiğimiz mesajların durum etiketleri (cid -> element)
+    const pending = {}; // Yankısı (dm_message) henüz gelmemiş mesajlar (cid -> metin)
+
+    socket.on('connect', () => {
+        socket.emit('dm_join', { peer: peer });
+        markRead();
+    });
+
+    function sendPending(cid) {
+        if (cid in pending) socket.emit('dm_send', { peer: peer, text: pending[cid], cid: cid });
+    }
+
+    // Sunucu olayı kıstı: mesajı kaybetme, söylenen süre kadar bekleyip aynı cid ile yeniden gönder
+    socket.on('rate_limited', (data) => {
+        const delay = (data.retry_after || 0) * 1000 + Math.random() * 250;
+        if (data.group === 'join' && data.retry_after !== null) {
+            // Odaya katılamadıysak o arada gönderilenler de düştü; katılınca hepsini yeniden gönder
+            setTimeout(() => {
+                socket.emit('dm_join', { peer: peer });
+                Object.keys(pending).forEach(sendPending);
+            }, delay);
+        } else if (data.group === 'dm' && data.cid in pending) {
+            if (data.retry_after === null) {
+                form.text.value = pending[data.cid]; // gönderilemez (ör. çok uzun): metni geri ver
+                delete pending[data.cid];
+            } else {
+                setTimeout(() => sendPending(data.cid), delay);
+            }
+        }
+    });
+
+    function markRead() {
+        if (document.visibilityState === 'visible') socket.emit('dm_read', { peer: peer });
+    }
+    document.addEventListener('visibilitychange', markRead);
+
+    function appendMessage(sender, html, cid) {
+        const p = document.createElement('p');
+        p.innerHTML = '<b></b><br>' + html;
+        p.querySelector('b').textContent = sender + ':';
+        if (cid) {
+            const state = document.createElement('small');
+            state.className = 'dm-state';
+            state.textContent = ' ✓';
+            p.appendChild(state);
+            states[cid] = state;
+        }
+        conv.appendChild(p);
+        conv.appendChild(document.createElement('hr'));
+        window.scrollTo(0, document.body.scrollHeight);
+    }
+
+    // Yalnızca metin içeren mesajlar soketten gider; medya ve bağlantı yoksa klasik POST
+    form.addEventListener('submit', (e) => {
+        if (!socket.connected || form.media.files.length) return;
+        e.preventDefault();
+        const text = form.text.value.trim();
+        if (!text) return;
+        const cid = Date.now().toString(36) + Math.random().toString(36).slice(2, 8);
+        pending[cid] = text;
+        sendPending(cid);
+        form.text.value = '';
+    });
+
+    socket.on('dm_message', (data) => {
+        const mine = data.from === me;
+        if (mine) delete pending[data.cid];
+        appendMessage(mine ? 'Ben' : data.from, data.html, mine ? data.cid : null);
+        if (!mine) {
+            if (data.cid) socket.emit('dm_delivered', { peer: peer, cid: data.cid });
+            markRead();
+        }
+    });
+
+    socket.on('dm_delivered', (data) => {
+        const state = states[data.cid];
+        if (data.by !== me && state) state.textContent = ' ✓✓';
+    });
+
+    // Yukarı kaydırdıkça eski sayfaları getir (keyset imleç: data-before)
+    const older = document.getElementById('older');
+    let loadingOlder = false;
+
+    async function loadOlder() {
+        if (loadingOlder || !older.dataset.before || window.scrollY > 200) return;
+        loadingOlder = true;
+        try {
+            const res = await fetch('/api/dm/' + encodeURIComponent(peer) + '?before=' + older.dataset.before);
+            const page = await res.json();
+            const height = document.body.scrollHeight;
+            const frag = document.createDocumentFragment();
+            page.messages.forEach(m => {
+                const p = document.createElement('p');
+                p.innerHTML = '<b></b><br>' + m.html;
+                p.querySelector('b').textContent = (m.mine ? 'Ben' : m.from) + ':';
+                if (m.mine) {
+                    const state = document.createElement('small');
+                    state.className = 'dm-state';
+                    state.textContent = m.read ? ' ✓✓ görüldü' : ' ✓';
+                    p.appendChild(state);
+                }
+                frag.appendChild(p);
+                frag.appendChild(document.createElement('hr'));
+            });
+            conv.insertBefore(frag, conv.firstChild);
+            window.scrollTo(0, window.scrollY + document.body.scrollHeight - height); // görünen yer kaymasın
+            older.dataset.before = page.next_before || '';
+            if (!page.next_before) older.textContent = 'Konuşmanın başı.';
+        } finally {
+            loadingOlder = false;
+        }
+    }
+    window.addEventListener('scroll', loadOlder);
+    window.scrollTo(0, document.body.scrollHeight);
+
+    socket.on('dm_read', (data) => {
+        if (data.by === me) return;
+        document.querySelectorAll('.dm-state').forEach(state => { state.textContent = ' ✓✓ görüldü'; });
+        states = {};
+    });
+</script>"""
+
+
+@socketio.on('dm_join')
+@rate_limited("join")
+def handle_dm_join(data):
+    """DM sayfası açıldı: iki kullanıcının ortak odasına katıl."""
+    me = get_user_by_username(session.get("user"))
+    peer = get_user_by_username((data or {}).get('peer'))
+    if not me or not peer: return
+    room = dm_room(me.id, peer.id)
+    join_room(room)
+    DM_CHANNELS.setdefault(request.sid, {})[peer.username] = (me.username, me.id, peer.id, room)
+
+
+def dm_channel(data):
+    """Bu bağlantının katıldığı DM kanalı; katılmadıysa None."""
+    return DM_CHANNELS.get(request.sid, {}).get((data or {}).get('peer'))
+
+
+def dm_channel_room(data):
+    channel = dm_channel(data)
+    return channel[3] if channel else None
+
+
+@socketio.on('dm_send')
+@rate_limited("dm", room=dm_channel_room)
+def handle_dm_send(data):
+    """Mesajı odaya hemen yayınla, kalıcı yazımı DM_WRITER'a bırak."""
+    channel = dm_channel(data)
+    text = data.get('text') if channel else None
+    if not isinstance(text, str) or not text.strip(): return
+    me_name, me_id, peer_id, room = channel
+    html = dm_text_html(text.strip())
+    DM_WRITER.put("message", me_id, peer_id, html)
+    NOTIFIER.notify(peer_id, "dm", me_id, me_id)
+    emit('dm_message', {'cid': data.get('cid'), 'from': me_name, 'html': html}, to=room)
+
+
+@socketio.on('dm_delivered')
+@rate_limited("dm_ack")
+def handle_dm_delivered(data):
+    """Alıcının tarayıcısı mesajı aldı; göndericiye ilet (kalıcı değil)."""
+    channel = dm_channel(data)
+    if channel:
+        emit('dm_delivered', {'cid': data.get('cid'), 'by': channel[0]}, to=channel[3])
+
+
+@socketio.on('dm_read')
+@rate_limited("dm_ack")
+def handle_dm_read(data):
+    """Alıcı konuşmayı gördü: okundu bilgisini kaydet ve göndericiye ilet."""
+    channel = dm_channel(data)
+    if channel:
+        me_name, me_id, peer_id, room = channel
+        DM_WRITER.put("read", me_id, peer_id)
+        NOTIFIER.discard(me_id, "dm", peer_id)
+        emit('dm_read', {'by': me_name}, to=room)
+
+
 # -------------------- DOSYA SERVİSİ (Aynı kaldı) --------------------
 @app.route("/uploads/<filename>")
 def uploaded_file(filename):
-    return send_from_directory(UPLOAD_DIR, filename)
+    return send_image(UPLOAD_DIR, filename, "upload")
 
 
 @app.route("/media/<path:filename>")
 def serve_media(filename):
     ext = os.path.splitext(filename)[1].lower()
-    if ext in VIDEO_EXT:
-        mimetype = "video/mp4" if ext in {".mp4", ".m4v"} else ("video/webm" if ext == ".webm" else "video/ogg")
-    elif ext in AUDIO_EXT:
-        if ext == ".mp3":
-            mimetype = "audio/mpeg"
-        elif ext == ".wav":
-            mimetype = "audio/wav"
-        elif ext == ".m4a":
-            mimetype = "audio/mp4"
-        else:
-            mimetype = "audio/ogg"
-    else:
-        mimetype = "application/octet-stream"
-    return partial_response(os.path.join(MEDIA_DIR, filename), mimetype)
+    mimetype = MEDIA_MIMETYPES.get(ext, "application/octet-stream")
+    path = safe_join(MEDIA_DIR, filename)
+    if path is None: abort(404)
+    return partial_response(path, mimetype)
+
+
+# -------------------- SAHİPSİZ MEDYA TOPLAYICI (GC) --------------------
+# Silinen/yarıda kalan yüklemelerin dosyaları hiçbir zaman geri kazanılmıyordu.
+# Toplayıcı DB'deki referansları tek seferde bir kümeye toplar, klasörleri
+# os.scandir ile küçük partiler halinde gezer ve sahipsiz dosyaları önce
+# karantinaya alır; süre dolunca siler. Partiler arasında döngüye söz verir.
+QUARANTINE_DIR = os.path.join(UPLOAD_DIR, ".quarantine")
+MEDIA_GC_INTERVAL = float(os.environ.get("MEDIA_GC_INTERVAL", 6 * 3600))  # sn; 0 = kapalı
+MEDIA_GC_BATCH = int(os.environ.get("MEDIA_GC_BATCH", 200))  # parti başına dosya
+MEDIA_GC_MIN_AGE = 3600  # sn; yeni (henüz DB'ye yazılmamış olabilecek) dosyalara dokunma
+MEDIA_GC_GRACE = 24 * 3600  # sn; karantinada bekleme süresi
+MEDIA_REF_RE = re.compile(r"/(uploads|media)/([^'\"?<>\s]+)")
+
+
+class MediaGC:
+    """Yükleme klasörlerinde artımlı tarama yapan sahipsiz dosya toplayıcı."""
+
+    def __init__(self, batch, min_age, grace):
+        self.batch = batch
+        self.min_age = min_age
+        self.grace = grace
+        self.running = False
+        self.totals = Counter()
+        self.last_run = None
+
+    @staticmethod
+    def scan_dirs():
+        return {"uploads": UPLOAD_DIR, "avatars": AVATAR_DIR, "media": MEDIA_DIR, "derived": DERIVED_DIR}
+
+    def collect_refs(self):
+        """Post/Comment/DirectMessage içerikleri ve User.avatar'dan referans kümesi kurar."""
+        refs, derived_stems = set(), set()
+        for model in (Post, Comment, DirectMessage):
+            for i, (html,) in enumerate(db.session.query(model.html_content).yield_per(500), 1):
+                if i % 500 == 0:
+                    socketio.sleep(0)  # parti başına bir kez: büyük tabloda döngü bloklanmasın
+                for where, name in MEDIA_REF_RE.findall(html):
+                    if where == "uploads":
+                        refs.add(("uploads", name))
+                        derived_stems.add(f"upload_{os.path.splitext(name)[0]}")
+                    else:
+                        refs.add(("media", name))
+        refs.update(("media", name) for name in RECORDER.active_names())  # süren yayın kayıtları
+        for (avatar,) in db.session.query(User.avatar).filter(User.avatar.isnot(None)):
+            refs.add(("avatars", avatar))
+            derived_stems.add(f"avatar_{os.path.splitext(avatar)[0]}")
+        db.session.remove()
+        return refs, derived_stems
+
+    def _is_referenced(self, where, name, refs, derived_stems):
+        if where == "derived":
+            return name.rsplit("__", 1)[0] in derived_stems
+        return (where, name) in refs
+
+    def _entries(self, directory):
+        """Klasörü os.scandir ile gezer; her MEDIA_GC_BATCH dosyada bir kez döngüye söz verir."""
+        seen = 0
+        with os.scandir(directory) as it:
+            for entry in it:
+                if entry.name.startswith(".") or not entry.is_file(follow_symlinks=False):
+                    continue
+                yield entry
+                seen += 1
+                if seen % self.batch == 0:
+                    socketio.sleep(0)
+
+    def run_once(self):
+        """Tek bir tam geçiş yapar ve bu geçişin istatistiklerini döndürür."""
+        if self.running:
+            return None
+        self.running = True
+        result = Counter()
+        try:
+            with app.app_context():
+                refs, derived_stems = self.collect_refs()
+            now = time.time()
+            # 1) Karantinadakiler: tekrar referans verildiyse geri al, süresi dolduysa sil
+            for where, directory in self.scan_dirs().items():
+                qdir = os.path.join(QUARANTINE_DIR, where)
+                if not os.path.isdir(qdir):
+                    continue
+                for entry in self._entries(qdir):
+                    st = entry.stat()
+                    if self._is_referenced(where, entry.name, refs, derived_stems):
+                        os.replace(entry.path, os.path.join(directory, entry.name))
+                        result["restored"] += 1
+                    elif now - st.st_mtime >= self.grace:
+                        os.remove(entry.path)
+                        result["deleted"] += 1
+                        result["bytes_reclaimed"] += st.st_size
+            # 2) Canlı klasörler: sahipsiz ve yeterince eski olanları karantinaya al
+            for where, directory in self.scan_dirs().items():
+                qdir = os.path.join(QUARANTINE_DIR, where)
+                for entry in self._entries(directory):
+                    result["scanned"] += 1
+                    if self._is_referenced(where, entry.name, refs, derived_stems):
+                        continue
+                    st = entry.stat()
+                    if now - st.st_mtime < self.min_age:
+                        continue
+                    os.makedirs(qdir, exist_ok=True)
+                    target = os.path.join(qdir, entry.name)
+                    os.replace(entry.path, target)
+                    os.utime(target, (now, now))  # karantina süresi buradan başlar
+                    FILE_HANDLES.discard(entry.path)
+                    SMALL_ASSETS.invalidate(entry.path)
+                    result["quarantined"] += 1
+                    result["bytes_quarantined"] += st.st_size
+        finally:
+            self.running = False
+        self.totals.update(result)
+        self.last_run = {"finished_at": time.time(), **result}
+        print(f"Medya GC: {result['quarantined']} dosya karantinaya alındı, "
+              f"{result['deleted']} dosya silindi ({result['bytes_reclaimed']} bayt geri kazanıldı).")
+        return result
+
+    def loop(self, interval):
+        while True:
+            socketio.sleep(interval)
+            try:
+                self.run_once()
+            except Exception as e:
+                print(f"Medya GC hatası: {e!r}")
+
+    def status(self):
+        return {"running": self.running, "last_run": self.last_run, "totals": dict(self.totals),
+                "interval": MEDIA_GC_INTERVAL, "grace": self.grace}
+
+
+MEDIA_GC = MediaGC(MEDIA_GC_BATCH, MEDIA_GC_MIN_AGE, MEDIA_GC_GRACE)
 
 
 # -------------------- ARAMA (Aynı kaldı) --------------------
@@ -1000,6 +3389,7 @@ def find_friend():
 # -------------------- CANLI YAYIN (WEBRTC Sinyalleşme) (Aynı kaldı) --------------------
 
 @app.route("/go_live")
+@precompressed
 def go_live_page():
     """Yayıncının kamera/ekran paylaşımını başlattığı sayfa."""
     me = session.get("user")
@@ -1008,65 +3398,1034 @@ def go_live_page():
 
 
 @app.route("/live_stream/<string:username>")
+@precompressed
 def live_stream_page(username):
     """İzleyicilerin yayını izlediği sayfa."""
-    if username not in LIVE_STREAMS:
+    if not PRESENCE.is_live(username):
         return redirect(url_for('index'))
     return render_template_string(LIVE_VIEWER_PAGE_TEMPLATE, streamer_user=username, viewer_user=session.get("user"))
 
 
-# SocketIO Olay Yöneticileri (Aynı kaldı)
+# Canlı yayın durumu: hangi yayın açık, yayıncının sid'i ve odadaki izleyiciler.
+# LIVE_STATE_BACKEND=memory tek süreç içindir; sqlite aynı makinedeki tüm
+# worker'ların aynı kaydı görmesini sağlar (bkz. ÇOKLU WORKER).
+LIVE_STATE_BACKEND = os.environ.get("LIVE_STATE_BACKEND", "memory")
+LIVE_WORKER_TIMEOUT = 30  # sn; bu kadar sinyal vermeyen worker'ın kayıtları silinir
+
+# Yayın dağıtım ağacı: yayıncı en fazla RELAY_ROOT_FANOUT izleyiciye doğrudan
+# gönderir; kapasite bildiren izleyiciler yayını en fazla RELAY_MAX_FANOUT
+# alt izleyiciye aktarır. Yeni izleyici boş yuvası olan en sığ düğüme bağlanır.
+RELAY_ROOT_FANOUT = int(os.environ.get("RELAY_ROOT_FANOUT", 4))
+RELAY_MAX_FANOUT = 3
+
+
+class MemoryLiveState:
+    """Tek süreçlik canlı yayın kaydı."""
+
+    def __init__(self):
+        self.streams = {}  # {user: (room, sid)}
+        self.roots = {}  # {room: (sid, capacity)}
+        self.nodes_by_room = {}  # {room: {sid: {"user", "parent", "capacity", "depth"}}}
+        self.kids = {}  # {room: {parent_sid: {child_sid, ...}}}
+        self.protos = {}  # {sid: sinyal protokolü sürümü}
+
+    def transaction(self):
+        return contextlib.nullcontext()
+
+    def start_stream(self, user, room, sid, capacity):
+        self.streams[user] = (room, sid)
+        self.roots[room] = (sid, capacity)
+
+    def end_stream(self, user, sid):
+        room, current = self.streams.get(user, (None, None))
+        if current != sid:
+            return False  # yayını başka bir sekme devralmış
+        del self.streams[user]
+        self.roots.pop(room, None)
+        self.nodes_by_room.pop(room, None)  # ağaç yayınla birlikte biter
+        self.kids.pop(room, None)
+        return True
+
+    def live_users(self):
+        return set(self.streams)
+
+    def is_live(self, user):
+        return user in self.streams
+
+    def streamer_sid(self, room):
+        return self.roots.get(room, (None, 0))[0]
+
+    def stream_capacity(self, room):
+        return self.roots.get(room, (None, 0))[1]
+
+    def nodes(self, room):
+        return {sid: dict(node) for sid, node in self.nodes_by_room.get(room, {}).items()}
+
+    def children(self, room, sid):
+        return set(self.kids.get(room, {}).get(sid, ()))
+
+    def add_viewer(self, room, sid, user, parent, capacity, depth):
+        self.nodes_by_room.setdefault(room, {})[sid] = {
+            "user": user, "parent": parent, "capacity": capacity, "depth": depth}
+        self.kids.setdefault(room, {}).setdefault(parent, set()).add(sid)
+
+    def set_parent(self, room, sid, parent, depth):
+        node = self.nodes_by_room[room][sid]
+        kids = self.kids[room]
+        kids.get(node["parent"], set()).discard(sid)
+        kids.setdefault(parent, set()).add(sid)
+        node["parent"], node["depth"] = parent, depth
+
+    def set_depth(self, room, sid, depth):
+        self.nodes_by_room[room][sid]["depth"] = depth
+
+    def remove_viewer(self, room, sid):
+        nodes = self.nodes_by_room.get(room)
+        node = nodes.pop(sid, None) if nodes is not None else None
+        if node is None:
+            return None
+        kids = self.kids[room]
+        kids.get(node["parent"], set()).discard(sid)
+        kids.pop(sid, None)
+        if not nodes:
+            del self.nodes_by_room[room]
+            del self.kids[room]
+        return node
+
+    def viewer_count(self, room):
+        return len(self.nodes_by_room.get(room, ()))
+
+    def set_proto(self, sid, proto):
+        self.protos[sid] = proto
+
+    def clear_proto(self, sid):
+        self.protos.pop(sid, None)
+
+    def signal_proto(self, sid):
+        return self.protos.get(sid, 1)
+
+    def heartbeat(self):
+        pass
+
+
+class SqliteLiveState:
+    """Aynı makinedeki worker'ların paylaştığı canlı yayın kaydı (SQLite, WAL)."""
+    SCHEMA_VERSION = 3  # kayıtlar geçicidir; sürüm değişince tablolar yeniden kurulur
+
+    def __init__(self, path):
+        self.path = path
+        self._conn = None
+        self._pid = None
+
+    @property
+    def worker(self):
+        return f"{socket.gethostname()}:{os.getpid()}"
+
+    def _db(self):
+        if self._pid != os.getpid():  # fork sonrası yeni bağlantı
+            conn = open_local_sqlite(self.path)
+            conn.execute("BEGIN IMMEDIATE")
+            if conn.execute("PRAGMA user_version").fetchone()[0] != self.SCHEMA_VERSION:
+                conn.execute("DROP TABLE IF EXISTS live_stream")
+                conn.execute("DROP TABLE IF EXISTS live_viewer")
+                conn.execute("DROP TABLE IF EXISTS live_worker")
+                conn.execute("DROP TABLE IF EXISTS live_peer")
+                conn.execute("""CREATE TABLE live_stream (user TEXT PRIMARY KEY, room TEXT NOT NULL UNIQUE,
+                                sid TEXT NOT NULL, capacity INTEGER NOT NULL, worker TEXT NOT NULL)""")
+                conn.execute("""CREATE TABLE live_viewer (sid TEXT PRIMARY KEY, room TEXT NOT NULL, user TEXT,
+                                parent TEXT, capacity INTEGER NOT NULL, depth INTEGER, worker TEXT NOT NULL)""")
+                conn.execute("CREATE INDEX ix_live_viewer_room_parent ON live_viewer (room, parent)")
+                conn.execute("CREATE TABLE live_worker (id TEXT PRIMARY KEY, seen REAL NOT NULL)")
+                conn.execute("CREATE TABLE live_peer (sid TEXT PRIMARY KEY, proto INTEGER NOT NULL, worker TEXT NOT NULL)")
+                conn.execute(f"PRAGMA user_version = {self.SCHEMA_VERSION}")
+            conn.execute("COMMIT")
+            self._conn, self._pid = conn, os.getpid()
+            self.heartbeat()
+        return self._conn
+
+    @contextlib.contextmanager
+    def transaction(self):
+        """Ağaç güncellemeleri worker'lar arasında BEGIN IMMEDIATE ile sıralanır."""
+        conn = self._db()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+
+    def start_stream(self, user, room, sid, capacity):
+        self._db().execute("INSERT OR REPLACE INTO live_stream (user, room, sid, capacity, worker) "
+                           "VALUES (?, ?, ?, ?, ?)", (user, room, sid, capacity, self.worker))
+
+    def end_stream(self, user, sid):
+        conn = self._db()
+        row = conn.execute("SELECT room FROM live_stream WHERE user = ? AND sid = ?", (user, sid)).fetchone()
+        if row is None:
+            return False
+        conn.execute("DELETE FROM live_stream WHERE user = ?", (user,))
+        conn.execute("DELETE FROM live_viewer WHERE room = ?", (row[0],))
+        return True
+
+    def live_users(self):
+        return {row[0] for row in self._db().execute("SELECT user FROM live_stream")}
+
+    def is_live(self, user):
+        return self._db().execute("SELECT 1 FROM live_stream WHERE user = ?", (user,)).fetchone() is not None
+
+    def streamer_sid(self, room):
+        row = self._db().execute("SELECT sid FROM live_stream WHERE room = ?", (room,)).fetchone()
+        return row[0] if row else None
+
+    def stream_capacity(self, room):
+        row = self._db().execute("SELECT capacity FROM live_stream WHERE room = ?", (room,)).fetchone()
+        return row[0] if row else 0
+
+    def nodes(self, room):
+        rows = self._db().execute("SELECT sid, user, parent, capacity, depth FROM live_viewer WHERE room = ?",
+                                  (room,))
+        return {sid: {"user": user, "parent": parent, "capacity": capacity, "depth": depth}
+                for sid, user, parent, capacity, depth in rows}
+
+    def children(self, room, sid):
+        return {row[0] for row in self._db().execute(
+            "SELECT sid FROM live_viewer WHERE room = ? AND parent = ?", (room, sid))}
+
+    def add_viewer(self, room, sid, user, parent, capacity, depth):
+        self._db().execute("INSERT OR REPLACE INTO live_viewer (sid, room, user, parent, capacity, depth, worker) "
+                           "VALUES (?, ?, ?, ?, ?, ?, ?)", (sid, room, user, parent, capacity, depth, self.worker))
+
+    def set_parent(self, room, sid, parent, depth):
+        self._db().execute("UPDATE live_viewer SET parent = ?, depth = ? WHERE sid = ?", (parent, depth, sid))
+
+    def set_depth(self, room, sid, depth):
+        self._db().execute("UPDATE live_viewer SET depth = ? WHERE sid = ?", (depth, sid))
+
+    def remove_viewer(self, room, sid):
+        conn = self._db()
+        row = conn.execute("SELECT user, parent, capacity, depth FROM live_viewer WHERE sid = ?", (sid,)).fetchone()
+        if row is None:
+            return None
+        conn.execute("DELETE FROM live_viewer WHERE sid = ?", (sid,))
+        return dict(zip(("user", "parent", "capacity", "depth"), row))
+
+    def viewer_count(self, room):
+        return self._db().execute("SELECT COUNT(*) FROM live_viewer WHERE room = ?", (room,)).fetchone()[0]
+
+    def set_proto(self, sid, proto):
+        self._db().execute("INSERT OR REPLACE INTO live_peer (sid, proto, worker) VALUES (?, ?, ?)",
+                           (sid, proto, self.worker))
+
+    def clear_proto(self, sid):
+        self._db().execute("DELETE FROM live_peer WHERE sid = ?", (sid,))
+
+    def signal_proto(self, sid):
+        row = self._db().execute("SELECT proto FROM live_peer WHERE sid = ?", (sid,)).fetchone()
+        return row[0] if row else 1
+
+    def heartbeat(self):
+        """Bu worker'ı canlı işaretler; çökmüş worker'ların yayın/izleyici kayıtlarını siler."""
+        conn, now = self._db(), time.time()
+        conn.execute("INSERT OR REPLACE INTO live_worker (id, seen) VALUES (?, ?)", (self.worker, now))
+        stale = [row[0] for row in conn.execute("SELECT id FROM live_worker WHERE seen < ?",
+                                                (now - LIVE_WORKER_TIMEOUT,))]
+        for worker in stale:
+            conn.execute("DELETE FROM live_stream WHERE worker = ?", (worker,))
+            conn.execute("DELETE FROM live_viewer WHERE worker = ?", (worker,))
+            conn.execute("DELETE FROM live_peer WHERE worker = ?", (worker,))
+            conn.execute("DELETE FROM live_worker WHERE id = ?", (worker,))
+
+
+def pick_relay_parent(root_sid, root_capacity, nodes, exclude=()):
+    """Boş yuvası olan en sığ düğümü (eşitlikte en az çocuklu) ve yeni derinliği döndürür."""
+    children = Counter(node["parent"] for node in nodes.values())
+    if root_capacity - children[root_sid] > 0:
+        return root_sid, 1
+    candidates = [(node["depth"], children[sid], sid) for sid, node in nodes.items()
+                  if sid not in exclude and node["parent"] is not None
+                  and node["capacity"] - children[sid] > 0]
+    if not candidates:
+        return None, None
+    depth, _, sid = min(candidates)
+    return sid, depth + 1
+
+
+def relay_subtree(nodes, sid):
+    """sid ve altındaki tüm düğümler."""
+    kids = {}
+    for child, node in nodes.items():
+        kids.setdefault(node["parent"], []).append(child)
+    found, stack = set(), [sid]
+    while stack:
+        current = stack.pop()
+        found.add(current)
+        stack.extend(kids.get(current, ()))
+    return found
+
+
+# Canlı oda varlık kaydı: disconnect'te tüm yayınları taramak yerine sid'den
+# doğrudan oda ve rol bulunur; yalnızca etkilenen odaya haber verilir.
+class PresenceRegistry:
+    """Bu süreçteki sid -> (kullanıcı, rol, oda) indeksi; oda ve ağaç LIVE_STATE'te."""
+
+    def __init__(self, state):
+        self.state = state
+        self.by_sid = {}  # {sid: (user, "streamer" | "viewer", room)}
+        self._heartbeat = None
+
+    def join(self, sid, user, role, room, capacity=0, proto=1):
+        """Kaydeder; izleyici için ağaçtaki ebeveyn sid'ini (yer yoksa None) döndürür."""
+        self._ensure_heartbeat()
+        if sid in self.by_sid:
+            # Aynı bağlantı yeniden katılıyor (ör. ICE yeniden denemesi); çağıran önce
+            # leave() sonucunu announce_leave() ile bildirmeli, yoksa taşınan çocuklar teklif almaz
+            self.leave(sid)
+        self.by_sid[sid] = (user, role, room)
+        if proto > 1:
+            self.state.set_proto(sid, proto)
+        if role == "streamer":
+            self.state.start_stream(user, room, sid, capacity or RELAY_ROOT_FANOUT)
+            return None
+        with self.state.transaction():
+            root = self.state.streamer_sid(room)
+            if root is None:
+                return None
+            parent, depth = pick_relay_parent(root, self.state.stream_capacity(room), self.state.nodes(room))
+            if parent is not None:
+                self.state.add_viewer(room, sid, user, parent, capacity, depth)
+        return parent
+
+    def leave(self, sid):
+        """Kaydı siler. Etkisizse None; değilse rol, ebeveyn ve ağaç onarımı bilgisi döndürür.
+
+        moved: yeni ebeveyne taşınan (çocuk, yeni_ebeveyn) çiftleri;
+        dropped: yer bulunamadığı için ağaçtan çıkarılan sid'ler.
+        """
+        entry = self.by_sid.pop(sid, None)
+        if entry is None:
+            return None
+        user, role, room = entry
+        self.state.clear_proto(sid)
+        result = {"user": user, "role": role, "room": room, "parent": None, "moved": [], "dropped": []}
+        if role == "streamer":
+            if not self.state.end_stream(user, sid):
+                return None  # yayını başka bir sekme devralmış; yayın sürüyor
+            return result
+        with self.state.transaction():
+            relaying = bool(self.state.children(room, sid))
+            node = self.state.remove_viewer(room, sid)
+            if node is None:
+                return result
+            result["parent"] = node["parent"]
+            if relaying:
+                self._repair(room, sid, result)
+        return result
+
+    def _repair(self, room, gone_sid, result):
+        """Ayrılan aktarıcının çocuklarını (alt ağaçlarıyla) yeni ebeveynlere bağlar."""
+        root = self.state.streamer_sid(room)
+        capacity = self.state.stream_capacity(room)
+        nodes = self.state.nodes(room)
+        orphans = sorted((s for s, n in nodes.items() if n["parent"] == gone_sid),
+                         key=lambda s: -nodes[s]["capacity"])  # aktarabilenler önce, diğerlerine yer açar
+        for child in orphans:
+            subtree = relay_subtree(nodes, child)  # döngü olmasın diye aday dışı
+            parent, depth = pick_relay_parent(root, capacity, nodes, exclude=subtree) if root else (None, None)
+            if parent is None:
+                for s in subtree:
+                    self.state.remove_viewer(room, s)
+                    nodes.pop(s, None)
+                    result["dropped"].append(s)
+                continue
+            shift = depth - nodes[child]["depth"]
+            self.state.set_parent(room, child, parent, depth)
+            nodes[child].update(parent=parent, depth=depth)
+            for s in subtree - {child}:
+                nodes[s]["depth"] += shift
+                self.state.set_depth(room, s, nodes[s]["depth"])
+            result["moved"].append((child, parent))
+
+    def streamer_sid(self, room):
+        return self.state.streamer_sid(room)
+
+    def signal_proto(self, sid):
+        return self.state.signal_proto(sid)
+
+    def viewer_count(self, room):
+        return self.state.viewer_count(room)
+
+    def is_live(self, user):
+        return self.state.is_live(user)
+
+    def live_users(self):
+        return self.state.live_users()
+
+    def _ensure_heartbeat(self):
+        if self._heartbeat is None and not isinstance(self.state, MemoryLiveState):
+            self._heartbeat = socketio.start_background_task(self._heartbeat_loop)
+
+    def _heartbeat_loop(self):
+        while True:
+            self.state.heartbeat()
+            socketio.sleep(LIVE_WORKER_TIMEOUT / 3)
+
+
+LIVE_STATE = SqliteLiveState(LIVE_STATE_PATH) if LIVE_STATE_BACKEND == "sqlite" else MemoryLiveState()
+PRESENCE = PresenceRegistry(LIVE_STATE)
+
+
+# Canlı yayın telemetrisi: oda başına sayaçlar ve sinyal aktarım gecikmesi
+# histogramı. Olay yöneticileri tek olay döngüsünde çalıştığından yapılar kilitsiz
+# güncellenir; izleyici sayısı olay başına değil LIVE_STATS_PUSH_INTERVAL'da bir itilir.
+LIVE_STATS_PUSH_INTERVAL = float(os.environ.get("LIVE_STATS_PUSH_INTERVAL", 2.0))  # sn
+LATENCY_BUCKETS_MS = (1, 2, 5, 10, 25, 50, 100, 250, 500, 1000)
+
+
+class LatencyHistogram:
+    """Sabit kovalı gecikme histogramı (ms; varsayılan kovalar LATENCY_BUCKETS_MS)."""
+    __slots__ = ("buckets", "counts", "total", "sum")
+
+    def __init__(self, buckets=LATENCY_BUCKETS_MS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # son kova: en büyük sınırın üstü
+        self.total = 0
+        self.sum = 0.0
+
+    def observe(self, ms, n=1):
+        self.counts[bisect.bisect_left(self.buckets, ms)] += n
+        self.total += n
+        self.sum += ms * n
+
+    def quantile(self, q):
+        """q'nuncu yüzdebirliğin düştüğü kovanın üst sınırı (ms); son kovada None."""
+        seen = 0
+        for i, count in enumerate(self.counts):
+            seen += count
+            if count and seen >= q * self.total:
+                return self.buckets[i] if i < len(self.buckets) else None
+        return None
+
+    def to_dict(self):
+        buckets = {f"le_{b}": c for b, c in zip(self.buckets, self.counts)}
+        buckets["inf"] = self.counts[-1]
+        return {"count": self.total, "mean_ms": round(self.sum / self.total, 3) if self.total else None,
+                "p50_ms": self.quantile(0.5), "p95_ms": self.quantile(0.95), "p99_ms": self.quantile(0.99),
+                "buckets": buckets}
+
+
+class LiveTelemetry:
+    """Bu süreçteki canlı yayın sayaçları; izleyici sayısı değişen odalar toplu itilir."""
+
+    def __init__(self, interval):
+        self.interval = interval
+        self.rooms = {}  # {oda: sayaçlar}
+        self.latency = LatencyHistogram()  # tüm odalar
+        self.dirty = set()  # izleyici sayısı itilecek odalar
+        self._pusher = None
+
+    def _room(self, room):
+        stats = self.rooms.get(room)
+        if stats is None:
+            stats = self.rooms[room] = {"live": False, "started_at": None, "viewers": 0, "peak_viewers": 0,
+                                        "joins": 0, "leaves": 0, "rejected": 0, "signals": 0,
+                                        "latency": LatencyHistogram()}
+        return stats
+
+    def stream_started(self, room):
+        self.rooms.pop(room, None)  # yeni yayın sıfırdan sayılır
+        self._room(room).update(live=True, started_at=time.time())
+        if self._pusher is None:
+            self._pusher = socketio.start_background_task(self._push_loop)
+
+    def stream_stopped(self, room):
+        self._room(room).update(live=False, viewers=0)
+        self.dirty.discard(room)
+
+    def viewer_joined(self, room, viewers):
+        stats = self._room(room)
+        stats["joins"] += 1
+        self._set_viewers(room, stats, viewers)
+
+    def viewer_left(self, room, viewers, dropped=0):
+        stats = self._room(room)
+        stats["leaves"] += 1
+        stats["rejected"] += dropped
+        self._set_viewers(room, stats, viewers)
+
+    def viewer_rejected(self, room):
+        self._room(room)["rejected"] += 1
+
+    def _set_viewers(self, room, stats, viewers):
+        stats["viewers"] = viewers
+        stats["peak_viewers"] = max(stats["peak_viewers"], viewers)
+        self.dirty.add(room)
+
+    def signals_relayed(self, room, count, seconds):
+        ms = seconds * 1000
+        self.latency.observe(ms, count)
+        if room is not None:
+            stats = self._room(room)
+            stats["signals"] += count
+            stats["latency"].observe(ms, count)
+
+    def _push_loop(self):
+        while True:
+            socketio.sleep(self.interval)
+            dirty, self.dirty = self.dirty, set()
+            for room in dirty:
+                socketio.emit('viewer_count', {'viewers': PRESENCE.viewer_count(room)}, to=room)
+
+    def stats(self, room=None):
+        rooms = {r: {**st, "latency": st["latency"].to_dict()} for r, st in self.rooms.items()
+                 if room is None or r == room}
+        return {"push_interval": self.interval, "latency_ms": self.latency.to_dict(), "rooms": rooms}
+
+
+TELEMETRY = LiveTelemetry(LIVE_STATS_PUSH_INTERVAL)
+
+
+# Sinyal protokolü v2: ICE adayları (gönderen, hedef) çifti başına SIGNAL_BATCH_WINDOW
+# boyunca biriktirilip tek 'webrtc_signal_batch' çerçevesinde iletilir. SDP (offer/answer)
+# beklemez; bekleyen adaylarla birlikte hemen gider. v1 istemcilere tek tek iletilir.
+SIGNAL_BATCH_WINDOW = float(os.environ.get("SIGNAL_BATCH_WINDOW", 0.04))  # sn
+SIGNAL_QUEUE_LIMIT = 64  # hedef başına bekleyen sinyal; aşılınca aday tekrarları birleşir, fazlası düşer
+
+
+class SignalCoalescer:
+    """Hedefi v2 olan sinyalleri kısa bir pencerede tek çerçevede toplar."""
+
+    def __init__(self, window):
+        self.window = window
+        self.pending = {}  # {(gönderen_sid, hedef_sid): [sinyal, ...]}
+        self.queued = Counter()  # {hedef_sid: bekleyen sinyal sayısı}
+        self.since = {}  # {(gönderen_sid, hedef_sid): (ilk sinyalin geliş anı, oda)}
+        self.counters = Counter()
+        self.started = time.time()
+
+    def submit(self, sender, target, signals, room=None):
+        received = time.monotonic()
+        self.counters["frames_in"] += 1
+        self.counters["signals_in"] += len(signals)
+        if PRESENCE.signal_proto(target) < 2:
+            for signal in signals:
+                socketio.emit('webrtc_signal', {'signal': signal, 'sender_sid': sender}, to=target)
+            self.counters["frames_out"] += len(signals)
+            TELEMETRY.signals_relayed(room, len(signals), time.monotonic() - received)
+            return
+        key = (sender, target)
+        if self.queued[target] + len(signals) > SIGNAL_QUEUE_LIMIT:
+            signals = self._shed(key, signals)
+            if not signals:
+                return
+        urgent = any(signal.get('type') != 'candidate' for signal in signals)
+        queue = self.pending.get(key)
+        if queue is None:
+            queue = self.pending[key] = []
+            if not urgent:
+                socketio.start_background_task(self._flush_later, key)
+        queue.extend(signals)
+        self.queued[target] += len(signals)
+        self.since.setdefault(key, (received, room))
+        if urgent:
+            self.flush(key)
+
+    def _shed(self, key, signals):
+        """Hedefin kuyruğu dolu: SDP her zaman geçer, aynı aday birleşir, kalan adaylar düşer."""
+        def ident(signal):
+            return json.dumps(signal.get('candidate'), sort_keys=True, default=str)
+        seen = {ident(s) for s in self.pending.get(key, ()) if s.get('type') == 'candidate'}
+        kept, room = [], SIGNAL_QUEUE_LIMIT - self.queued[key[1]]
+        for signal in signals:
+            if signal.get('type') != 'candidate':
+                kept.append(signal)
+            elif ident(signal) in seen:
+                self.counters["merged"] += 1
+            elif len(kept) < room:
+                kept.append(signal)
+                seen.add(ident(signal))
+            else:
+                self.counters["dropped"] += 1
+        return kept
+
+    def _flush_later(self, key):
+        socketio.sleep(self.window)
+        self.flush(key)
+
+    def flush(self, key):
+        signals = self.pending.pop(key, None)
+        if not signals:
+            return
+        sender, target = key
+        received, room = self.since.pop(key)
+        self.queued[target] -= len(signals)
+        if self.queued[target] <= 0:
+            del self.queued[target]
+        socketio.emit('webrtc_signal_batch', {'signals': signals, 'sender_sid': sender}, to=target)
+        self.counters["frames_out"] += 1
+        TELEMETRY.signals_relayed(room, len(signals), time.monotonic() - received)
+
+    def stats(self):
+        uptime = max(time.time() - self.started, 1e-9)
+        saved_in = self.counters["signals_in"] - self.counters["frames_in"]
+        saved_out = self.counters["signals_in"] - self.counters["frames_out"]
+        return {"window": self.window, "pending_pairs": len(self.pending), **self.counters,
+                "messages_saved": saved_in + saved_out,
+                "messages_saved_per_sec": round((saved_in + saved_out) / uptime, 2)}
+
+
+SIGNALS = SignalCoalescer(SIGNAL_BATCH_WINDOW)
+
+
+# SocketIO Olay Yöneticileri
+def signal_batch_cost(data):
+    """Toplu sinyal, taşıdığı sinyal sayısı kadar jeton harcar."""
+    signals = data.get('signals')
+    return max(1, len(signals)) if isinstance(signals, list) else 1
+
+
+def sender_live_room(data):
+    """Gönderenin bulunduğu canlı yayın odası (sinyal kovaları için)."""
+    return PRESENCE.by_sid.get(request.sid, (None, None, None))[2]
+
+
+def announce_leave(sid, left):
+    """PRESENCE.leave() sonucunu odaya bildirir: yayın bitti ya da ebeveyn/çocuklar güncellenir."""
+    if left is None:
+        return
+    room_id = left["room"]
+    if left["role"] == 'streamer':
+        emit('stream_status', {'status': 'stopped'}, room=room_id)
+        TELEMETRY.stream_stopped(room_id)
+        print(f"Streamer {left['user']} disconnected. Live stream stopped.")
+        return
+
+    # Ayrılan bir izleyiciyse, ebeveynine haber ver; çocuklarını yeni ebeveynlere bağla
+    if left["parent"]:
+        TELEMETRY.viewer_left(room_id, PRESENCE.viewer_count(room_id), len(left["dropped"]))
+        emit('viewer_left', {'viewer_id': sid}, room=left["parent"])
+    for child_sid, parent_sid in left["moved"]:
+        emit('new_viewer', {'viewer_id': child_sid, 'viewer_user': None}, room=parent_sid)
+    for dropped_sid in left["dropped"]:
+        emit('stream_full', {'viewers': PRESENCE.viewer_count(room_id)}, room=dropped_sid)
+
+
+def live_join_bucket(data):
+    """İzleyici katılımları oda kovasını paylaşır; yayıncının kendisi (oturumla doğrulanmış)
+    muaf tutulur ki izleyici seli yayıncının (yeniden) katılmasını engellemesin."""
+    if data.get('role') == 'streamer' and session.get("user") == data.get('streamer'):
+        return None
+    return f"live_{data.get('streamer')}"
+
+
 @socketio.on('join_live_room')
+@rate_limited("join", room=live_join_bucket)
 def handle_join_live_room(data):
-    """Yayıncı veya izleyici odaya katılır."""
+    """Yayıncı veya izleyici odaya katılır; izleyici dağıtım ağacına yerleştirilir."""
     username = data.get('username')
     streamer = data.get('streamer')
     me = session.get("user")
 
-    if get_user_by_username(streamer):
+    if streamer and get_user_by_username(streamer):
         room_id = f"live_{streamer}"
         join_room(room_id)
         print(f"User {username} joined live room {room_id} (SID: {request.sid})")
 
-        if username == streamer:
+        try:
+            capacity = int(data.get('capacity') or 0)
+            proto = int(data.get('proto') or 1)
+        except (TypeError, ValueError):
+            capacity, proto = 0, 1
+        # Eski sayfalar 'role' göndermez; o durumda username == streamer yayıncı sayılır
+        role = data.get('role') or ('streamer' if username == streamer else 'viewer')
+        if (role == 'streamer' and me == streamer and PRESENCE.streamer_sid(room_id) == request.sid
+                and PRESENCE.by_sid.get(request.sid) == (streamer, 'streamer', room_id)):
+            return  # yayını zaten bu bağlantı yürütüyor: ağaç ve izleyiciler yerinde kalsın
+        # Aynı bağlantı (izleyici olarak ya da başka odaya) yeniden katılıyorsa eski komşulara haber ver
+        announce_leave(request.sid, PRESENCE.leave(request.sid))
+        if role == 'streamer' and me == streamer:
             # Yayıncı odaya katıldı
-            LIVE_STREAMS[streamer] = room_id
+            PRESENCE.join(request.sid, streamer, 'streamer', room_id, max(0, capacity), proto)
+            TELEMETRY.stream_started(room_id)
             print(f"Streamer {streamer} is now active.")
-        elif streamer in LIVE_STREAMS:
-            # İzleyici odaya katıldı, yayıncıya haber ver
-            emit('new_viewer', {'viewer_id': request.sid, 'viewer_user': me}, room=f"live_{streamer}",
-                 include_self=False)
+        else:
+            # Kapasite bildirmeyen (eski) izleyiciler yaprak olarak yerleşir
+            capacity = max(0, min(capacity, RELAY_MAX_FANOUT))
+            parent_sid = PRESENCE.join(request.sid, me or username, 'viewer', room_id, capacity, proto)
+            if parent_sid:
+                # Ebeveyne (yayıncı ya da aktarıcı izleyici) haber ver; teklifi o gönderir
+                emit('new_viewer', {'viewer_id': request.sid, 'viewer_user': me}, room=parent_sid)
+                TELEMETRY.viewer_joined(room_id, PRESENCE.viewer_count(room_id))
+            elif PRESENCE.streamer_sid(room_id):
+                emit('stream_full', {'viewers': PRESENCE.viewer_count(room_id)})
+                TELEMETRY.viewer_rejected(room_id)
 
 
 @socketio.on('disconnect')
 def handle_disconnect():
-    """Kullanıcı ayrıldığında yayını kontrol et."""
-    # Yayıncının ayrılıp ayrılmadığını kontrol et
-    disconnected_user = None
-    for user, room in LIVE_STREAMS.items():
-        if room == f"live_{user}":
-            disconnected_user = user
-            break
-
-    if disconnected_user:
-        LIVE_STREAMS.pop(disconnected_user, None)
-        room_id = f"live_{disconnected_user}"
-        emit('stream_status', {'status': 'stopped'}, room=room_id, broadcast=True)
-        print(f"Streamer {disconnected_user} disconnected. Live stream stopped.")
-    else:
-        # Ayrılan bir izleyiciyse, yayıncıya haber ver
-        for streamer in LIVE_STREAMS.keys():
-            emit('viewer_left', {'viewer_id': request.sid}, room=f"live_{streamer}")
+    """Kullanıcı ayrıldığında yalnızca kendi odasını ve ağaçtaki komşularını güncelle."""
+    DM_CHANNELS.pop(request.sid, None)
+    RATE_LIMITER.forget(request.sid)
+    publish_recording(RECORDER.finish(request.sid))  # kayıt açık kaldıysa yayın bitti say
+    # Yayın yalnızca yayıncının kendi bağlantısı kapanınca biter (leave() bunu denetler)
+    announce_leave(request.sid, PRESENCE.leave(request.sid))
 
 
 @socketio.on('webrtc_signal')
+@rate_limited("signal", room=sender_live_room)
 def handle_webrtc_signal(data):
-    """WebRTC Sinyalleşmesini (SDP/ICE) ilgili tarafa yönlendir."""
+    """WebRTC Sinyalleşmesini (SDP/ICE) ilgili tarafa yönlendir (protokol v1, tek sinyal)."""
     target_sid = data.get('target_sid')  # Hedef SocketID (izleyici/yayıncı)
     signal_data = data.get('signal')
 
-    if target_sid:
-        emit('webrtc_signal', {'signal': signal_data, 'sender_sid': request.sid}, room=target_sid)
+    if target_sid and isinstance(signal_data, dict):
+        SIGNALS.submit(request.sid, target_sid, [signal_data], sender_live_room(data))
+
+
+@socketio.on('webrtc_signal_batch')
+@rate_limited("signal", room=sender_live_room, cost=signal_batch_cost)
+def handle_webrtc_signal_batch(data):
+    """Protokol v2: aynı hedefe giden SDP ve ICE adaylarını tek çerçevede al."""
+    target_sid = data.get('target_sid')
+    signals = [s for s in data.get('signals') or () if isinstance(s, dict)]
+
+    if target_sid and signals:
+        SIGNALS.submit(request.sid, target_sid, signals, sender_live_room(data))
+
+
+# -------------------- CANLI YAYIN KAYDI (VOD) --------------------
+# İsteğe bağlı: yayıncı sayfası MediaRecorder parçalarını 'record_chunk' ile
+# gönderir; parçalar MEDIA_DIR'deki WebM dosyasına sırayla, tamponlu eklenir.
+# MediaRecorder canlı akış biçiminde yazar: Duration ve Cues yoktur, kümelerin
+# boyu bilinmez; <video> böyle bir dosyada ileri saramaz. Yayın bitince
+# finalize_webm() dosyayı yeniden düzenler (Duration, öne alınmış Cues, SeekHead,
+# boyu belli kümeler); sonra kayıt gönderi olarak paylaşılır ve /media/ altından
+# Range destekli sunulur.
+RECORD_BUFFER = 1024 * 1024  # bayt; dosyaya yazma tamponu
+RECORD_MAX_BYTES = int(os.environ.get("RECORD_MAX_BYTES", 2 * 1024 ** 3))
+
+EBML_HEADER, SEGMENT, SEEK_HEAD, INFO, TRACKS = 0x1A45DFA3, 0x18538067, 0x114D9B74, 0x1549A966, 0x1654AE6B
+CLUSTER, CUES, TAGS, CHAPTERS, ATTACHMENTS, VOID = 0x1F43B675, 0x1C53BB6B, 0x1254C367, 0x1043A770, 0x1941A469, 0xEC
+SEGMENT_CHILDREN = {SEEK_HEAD, INFO, TRACKS, CLUSTER, CUES, TAGS, CHAPTERS, ATTACHMENTS, VOID}
+CLUSTER_CHILDREN = {0xE7, 0xA3, 0xA0, 0xA7, 0xAB, VOID}  # Timecode, SimpleBlock, BlockGroup, Position, PrevSize
+
+
+def _ebml_id(f):
+    """Eleman kimliği (uzunluk işaret biti dahil); dosya sonunda ya da geçersizse None."""
+    first = f.read(1)
+    if not first or first[0] < 0x10:
+        return None
+    length = 8 - first[0].bit_length() + 1
+    rest = f.read(length - 1)
+    return int.from_bytes(first + rest, "big") if len(rest) == length - 1 else None
+
+
+def _ebml_size(f):
+    """Eleman boyu; bilinmeyen boy (tüm bitler 1) için -1, bozuksa None."""
+    first = f.read(1)
+    if not first or first[0] == 0:
+        return None
+    length = 8 - first[0].bit_length() + 1
+    rest = f.read(length - 1)
+    if len(rest) != length - 1:
+        return None
+    value = int.from_bytes(bytes([first[0] & (0xFF >> length)]) + rest, "big")
+    return -1 if value == (1 << (7 * length)) - 1 else value
+
+
+def _ebml(element_id, payload):
+    """Elemanı 8 baytlık sabit boy alanıyla kodlar (konumlar önceden hesaplanabilsin)."""
+    return element_id.to_bytes((element_id.bit_length() + 7) // 8, "big") + b"\x01" + len(payload).to_bytes(7, "big") + payload
+
+
+def _ebml_uint(element_id, value):
+    return _ebml(element_id, value.to_bytes(8, "big"))
+
+
+def _ebml_children(data):
+    """Bellekteki küçük bir ana elemanın (Info, Tracks) çocukları: [(kimlik, yük)]."""
+    f, out = io.BytesIO(data), []
+    while True:
+        element_id = _ebml_id(f)
+        size = _ebml_size(f) if element_id is not None else None
+        if size is None or size < 0:
+            return out
+        out.append((element_id, f.read(size)))
+
+
+def _scan_cluster(f, start, body, end, track, cues):
+    """Kümenin çocuklarını gezer; küme gövdesinin gerçek sonunu ve son blok zamanını döndürür.
+
+    Boyu bilinmeyen kümede (end None) küme dışı bir kimlik görülünce durulur.
+    """
+    f.seek(body)
+    timecode, last, pos = 0, None, body
+    limit = _file_end(f) if end is None else min(end, _file_end(f))
+    while pos < limit:
+        element_id = _ebml_id(f)
+        size = _ebml_size(f) if element_id is not None else None
+        payload = f.tell()
+        if element_id not in CLUSTER_CHILDREN or size is None or size < 0:
+            break
+        if payload + size > limit:
+            break  # yarım kalmış son blok
+        if element_id == 0xE7:
+            timecode = int.from_bytes(f.read(size), "big")
+        elif element_id in (0xA3, 0xA0):
+            block = f.read(min(size, 64))
+            keyframe = False
+            if element_id == 0xA0:  # BlockGroup: Block'u bul; ReferenceBlock yoksa anahtar kare
+                children = dict(_ebml_children(block + f.read(max(0, size - 64))))
+                block, keyframe = children.get(0xA1, b""), 0xFB not in children
+            if len(block) >= 4:
+                track_len = 8 - block[0].bit_length() + 1
+                block_track = block[0] & (0xFF >> track_len) if track_len == 1 else None
+                rel = struct.unpack(">h", block[track_len:track_len + 2])[0]
+                at = timecode + rel
+                last = at if last is None else max(last, at)
+                if element_id == 0xA3:
+                    keyframe = bool(block[track_len + 2] & 0x80)
+                if keyframe and block_track == track and (not cues or cues[-1][1] != start):
+                    cues.append((at, start))  # küme başına bir işaret yeter
+        pos = payload + size
+        f.seek(pos)
+    return pos, last
+
+
+def _file_end(f):
+    here = f.tell()
+    end = f.seek(0, os.SEEK_END)
+    f.seek(here)
+    return end
+
+
+def finalize_webm(path):
+    """MediaRecorder çıktısını ileri sarılabilir WebM'e çevirir; başarıda True.
+
+    Dosya yeni bir geçici dosyaya yazılıp atomik olarak değiştirilir; kümelerin
+    içeriği kopyalanır, yeniden kodlama yapılmaz. WebM değilse dosyaya dokunulmaz.
+    """
+    with open(path, "rb") as f:
+        file_end = _file_end(f)
+        if _ebml_id(f) != EBML_HEADER:
+            return False
+        size = _ebml_size(f)
+        if size is None or size < 0:
+            return False
+        header_end = f.tell() + size
+        f.seek(0)
+        ebml_header = f.read(header_end)
+        if _ebml_id(f) != SEGMENT or _ebml_size(f) is None:
+            return False
+        pos = f.tell()
+        info = tracks = None
+        others, clusters = [], []  # others: olduğu gibi kopyalanacak bayt blokları; clusters: (gövde, son)
+        while pos < file_end:
+            f.seek(pos)
+            element_id = _ebml_id(f)
+            size = _ebml_size(f) if element_id is not None else None
+            body = f.tell()
+            if element_id not in SEGMENT_CHILDREN or size is None:
+                # Kayıp parça (sıra boşluğu) sonrası çöp: sonraki kümeyi ara
+                f.seek(pos + 1)
+                window = f.read(1024 * 1024)
+                found = window.find(CLUSTER.to_bytes(4, "big"))
+                if found < 0:
+                    if len(window) < 1024 * 1024:
+                        break
+                    pos += len(window) - 3
+                    continue
+                pos += 1 + found
+                continue
+            if element_id == CLUSTER:
+                clusters.append((pos, body, body + size if size >= 0 else None))
+                if size < 0:
+                    end, _ = _scan_cluster(f, pos, body, None, None, [])
+                    clusters[-1] = (pos, body, end)
+                pos = clusters[-1][2]
+                continue
+            if size < 0 or body + size > file_end:
+                break
+            if element_id == INFO:
+                info = f.read(size)
+            elif element_id == TRACKS:
+                tracks = f.read(size)
+            elif element_id not in (SEEK_HEAD, CUES, VOID):
+                f.seek(pos)
+                others.append(f.read(body + size - pos))
+            pos = body + size
+        if info is None or tracks is None or not clusters:
+            return False
+
+        info_children = [(k, v) for k, v in _ebml_children(info) if k != 0x4489]  # eski Duration atılır
+        entries = [dict(_ebml_children(payload)) for k, payload in _ebml_children(tracks) if k == 0xAE]
+        numbers = {int.from_bytes(e.get(0xD7, b"\x01"), "big"): int.from_bytes(e.get(0x83, b"\x01"), "big")
+                   for e in entries}
+        track = next((n for n, kind in numbers.items() if kind == 1), next(iter(numbers), 1))  # varsa video
+
+        cues, duration, layout = [], 0, []
+        for start, body, end in clusters:
+            end, last = _scan_cluster(f, start, body, end, track, cues)
+            if end > body:
+                layout.append((start, body, end))
+                if last is not None:
+                    duration = max(duration, last)
+
+        info_out = _ebml(INFO, b"".join(_ebml(k, v) for k, v in info_children)
+                         + _ebml(0x4489, struct.pack(">d", float(duration))))
+        tracks_out = _ebml(TRACKS, tracks)
+        seek_len = len(_ebml(SEEK_HEAD, _ebml(0x4DBB, _ebml(0x53AB, INFO.to_bytes(4, "big")) + _ebml_uint(0x53AC, 0)) * 3))
+        cues_len = len(_ebml(CUES, b"".join(_ebml(0xBB, _ebml_uint(0xB3, 0) + _ebml(0xB7, _ebml_uint(0xF7, 0) + _ebml_uint(0xF1, 0)))
+                                            for _ in cues)))
+        info_at = seek_len
+        tracks_at = info_at + len(info_out)
+        cues_at = tracks_at + len(tracks_out) + sum(map(len, others))
+        cluster_at, offset = {}, cues_at + cues_len
+        for start, body, end in layout:
+            cluster_at[start] = offset
+            offset += len(_ebml(CLUSTER, b"")) + (end - body)
+        seek_head = _ebml(SEEK_HEAD, b"".join(
+            _ebml(0x4DBB, _ebml(0x53AB, element.to_bytes(4, "big")) + _ebml_uint(0x53AC, at))
+            for element, at in ((INFO, info_at), (TRACKS, tracks_at), (CUES, cues_at))))
+        cues_out = _ebml(CUES, b"".join(
+            _ebml(0xBB, _ebml_uint(0xB3, at) + _ebml(0xB7, _ebml_uint(0xF7, track) + _ebml_uint(0xF1, cluster_at[start])))
+            for at, start in cues if start in cluster_at))
+        if len(cues_out) != cues_len:  # yarım kümeye düşen işaret atıldıysa boyu yeniden hesapla
+            return False
+
+        tmp = path + ".tmp"
+        try:
+            with open(tmp, "wb", buffering=RECORD_BUFFER) as out:
+                out.write(ebml_header)
+                out.write(SEGMENT.to_bytes(4, "big") + b"\x01" + offset.to_bytes(7, "big"))
+                out.write(seek_head + info_out + tracks_out + b"".join(others) + cues_out)
+                for start, body, end in layout:
+                    out.write(CLUSTER.to_bytes(4, "big") + b"\x01" + (end - body).to_bytes(7, "big"))
+                    f.seek(body)
+                    remaining = end - body
+                    while remaining:
+                        block = f.read(min(remaining, RECORD_BUFFER))
+                        out.write(block)
+                        remaining -= len(block)
+        except BaseException:
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(tmp)
+            raise
+    os.replace(tmp, path)
+    return True
+
+
+class _Recording:
+    __slots__ = ("user_id", "name", "file", "size", "seq")
+
+    def __init__(self, user_id, name):
+        self.user_id = user_id
+        self.name = name
+        self.file = open(os.path.join(MEDIA_DIR, name), "ab", buffering=RECORD_BUFFER)
+        self.size = 0
+        self.seq = -1
+
+
+class LiveRecorder:
+    """Yayıncı bağlantısı (sid) başına açık kayıtlar."""
+
+    def __init__(self):
+        self.active = {}  # {sid: _Recording}
+        self.counters = Counter()
+
+    def start(self, sid, user_id, username):
+        self.finish(sid)  # aynı bağlantıda önceki kayıt açık kaldıysa kapat
+        name = f"live_{secure_filename(username)}_{uuid.uuid4().hex[:12]}.webm"
+        self.active[sid] = _Recording(user_id, name)
+        self.counters["started"] += 1
+        return name
+
+    def append(self, sid, seq, chunk):
+        """Parçayı sıra numarası artıyorsa ekler; tekrarları ve eskileri atlar."""
+        rec = self.active.get(sid)
+        if rec is None or seq <= rec.seq:
+            self.counters["skipped"] += 1
+            return False
+        if rec.size + len(chunk) > RECORD_MAX_BYTES:
+            self.counters["over_limit"] += 1
+            return False
+        if seq != rec.seq + 1:
+            self.counters["gaps"] += 1
+        rec.file.write(chunk)
+        rec.size += len(chunk)
+        rec.seq = seq
+        self.counters["chunks"] += 1
+        self.counters["bytes"] += len(chunk)
+        return True
+
+    def finish(self, sid):
+        """Kaydı kapatıp ileri sarılabilir hale getirir; boşsa dosyayı siler ve None döndürür."""
+        rec = self.active.pop(sid, None)
+        if rec is None:
+            return None
+        rec.file.close()
+        path = os.path.join(MEDIA_DIR, rec.name)
+        if rec.size == 0:
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(path)
+            return None
+        try:
+            finalized = run_blocking(finalize_webm, path)  # GB'lık kayıtta döngüyü tutmasın
+        except Exception as e:
+            print(f"Kayıt sonlandırılamadı ({rec.name}): {e!r}")
+            finalized = False
+        self.counters["finished" if finalized else "unfinalized"] += 1
+        rec.size = os.path.getsize(path)
+        return rec
+
+    def active_names(self):
+        return {rec.name for rec in self.active.values()}
+
+    def stats(self):
+        return {"active": {rec.name: rec.size for rec in self.active.values()}, **self.counters}
+
+
+RECORDER = LiveRecorder()
+
+
+def publish_recording(rec):
+    """Biten kaydı yayıncının gönderisi olarak paylaşır."""
+    if rec is None:
+        return None
+    post = Post(user_id=rec.user_id,
+                html_content=f"🔴 Canlı yayın kaydı<br><video controls preload='metadata' src='/media/{rec.name}'></video>")
+    db.session.add(post)
+    db.session.commit()
+    print(f"Canlı yayın kaydı paylaşıldı: {rec.name} ({rec.size} bayt)")
+    return post
+
+
+@socketio.on('record_start')
+@rate_limited("record")
+def handle_record_start(data):
+    """Yalnızca aktif yayıncı bağlantısı kayıt başlatabilir."""
+    entry = PRESENCE.by_sid.get(request.sid)
+    user = get_user_by_username(entry[0]) if entry and entry[1] == 'streamer' else None
+    if user is None: return
+    emit('record_started', {'name': RECORDER.start(request.sid, user.id, user.username)})
+
+
+@socketio.on('record_chunk')
+@rate_limited("record")
+def handle_record_chunk(data):
+    chunk, seq = data.get('data'), data.get('seq')
+    if not isinstance(chunk, (bytes, bytearray)) or not isinstance(seq, int): return
+    RECORDER.append(request.sid, seq, chunk)
+
+
+@socketio.on('record_stop')
+@rate_limited("record")
+def handle_record_stop(data):
+    """Kaydı kapatıp paylaşır; istemciye onay (ack) olarak gönderi bilgisini döndürür."""
+    rec = RECORDER.finish(request.sid)
+    post = publish_recording(rec)
+    if post:
+        return {'post_id': post.id, 'url': f"/media/{rec.name}"}
 
 
 # -------------------- Canlı Yayın HTML ve JS Şablonları (Aynı kaldı) --------------------
@@ -1097,13 +4456,16 @@ LIVE_STREAM_PAGE_TEMPLATE = """<!DOCTYPE html>
       <div class="controls">
         <button id="stopBtn">Yayını Durdur</button>
         <p id="status">Aktif Yayın...</p>
+        <p id="viewerCount"></p>
       </div>
   {% else %}
       <video id="localVideo" autoplay muted style="display:none;"></video>
       <div class="controls">
+        <label><input type="checkbox" id="recordToggle"> Yayını kaydet ve paylaş</label><br>
         <button id="startBtn">Yayını Başlat (Kamera/Ekran İzni İste)</button>
         <button id="stopBtn" disabled>Yayını Durdur</button>
         <p id="status">Hazır. Yayın tipini seçin.</p>
+        <p id="viewerCount"></p>
       </div>
   {% endif %}
 
@@ -1120,9 +4482,54 @@ LIVE_STREAM_PAGE_TEMPLATE = """<!DOCTYPE html>
     let localStream = null;
     let peerConnections = {}; // İzleyiciler için PeerConnection objeleri
 
+    // Sinyal protokolü v2: ICE adaylarını hedef başına kısa bir pencerede topla,
+    // SDP'yi (offer/answer) bekleyen adaylarla birlikte hemen gönder
+    const SIGNAL_BATCH_MS = 40;
+    let signalOutbox = {};
+    let signalChain = Promise.resolve(); // Gelen sinyaller sırayla işlenir
+
+    function sendSignal(targetSid, signal) {
+        let box = signalOutbox[targetSid];
+        if (!box) {
+            box = signalOutbox[targetSid] = [];
+            if (signal.type === 'candidate') setTimeout(() => flushSignals(targetSid), SIGNAL_BATCH_MS);
+        }
+        box.push(signal);
+        if (signal.type !== 'candidate') flushSignals(targetSid);
+    }
+
+    function flushSignals(targetSid) {
+        const signals = signalOutbox[targetSid];
+        delete signalOutbox[targetSid];
+        if (signals && signals.length) socket.emit('webrtc_signal_batch', { target_sid: targetSid, signals: signals });
+    }
+
+    function queueSignals(senderSid, signals) {
+        signals.forEach(signal => {
+            signalChain = signalChain.then(() => handleSignal({ signal: signal, sender_sid: senderSid }))
+                .catch(e => console.warn("Sinyal işlenemedi:", e));
+        });
+    }
+
+    socket.on('webrtc_signal', (data) => queueSignals(data.sender_sid, [data.signal]));
+    socket.on('webrtc_signal_batch', (data) => queueSignals(data.sender_sid, data.signals));
+
+    // Sunucu izleyici sayısını değiştikçe (en fazla birkaç saniyede bir) iter
+    socket.on('viewer_count', (data) => {
+        document.getElementById('viewerCount').textContent = '👁 ' + data.viewers + ' izleyici';
+    });
+
     // Yayıncı odaya katılır (Socket.io)
-    socket.on('connect', () => {
-        socket.emit('join_live_room', { username: streamerUser, streamer: streamerUser });
+    function joinRoom() {
+        socket.emit('join_live_room', { username: streamerUser, streamer: streamerUser, role: 'streamer', proto: 2 });
+    }
+    socket.on('connect', joinRoom);
+
+    // Katılma kısıldıysa (oda kovası izleyicilerce boşaltılmış olabilir) bekleyip yeniden dene
+    socket.on('rate_limited', (data) => {
+        if (data.group === 'join' && data.retry_after !== null) {
+            setTimeout(joinRoom, data.retry_after * 1000 + Math.random() * 1000);
+        }
     });
 
     async function startStream() {
@@ -1170,9 +4577,56 @@ LIVE_STREAM_PAGE_TEMPLATE = """<!DOCTYPE html>
                 return;
             }
         }
+        startRecording();
     }
 
-    function stopLiveStream() {
+    // İsteğe bağlı kayıt: MediaRecorder parçaları saniyede bir sırayla sunucuya gider
+    let recorder = null;
+    let recordSeq = 0;
+    let recordChain = Promise.resolve();
+    let recordedUrl = null;
+
+    function startRecording() {
+        const toggle = document.getElementById('recordToggle');
+        if (!toggle || !toggle.checked || !window.MediaRecorder) return;
+        const mime = ['video/webm;codecs=vp8,opus', 'video/webm'].find(t => MediaRecorder.isTypeSupported(t));
+        if (!mime) {
+            statusDiv.textContent += ' (Tarayıcı WebM kaydını desteklemiyor, kayıt yapılmıyor.)';
+            return;
+        }
+        recordSeq = 0;
+        recorder = new MediaRecorder(localStream, { mimeType: mime, videoBitsPerSecond: 2500000 });
+        socket.emit('record_start', {});
+        recorder.ondataavailable = (event) => {
+            if (!event.data.size) return;
+            const seq = recordSeq++;
+            recordChain = recordChain
+                .then(() => event.data.arrayBuffer())
+                .then(data => socket.emit('record_chunk', { seq: seq, data: data }))
+                .catch(e => console.warn("Kayıt parçası gönderilemedi:", e));
+        };
+        recorder.start(1000);
+    }
+
+    function stopRecording() {
+        if (!recorder || recorder.state === 'inactive') return Promise.resolve();
+        return new Promise(resolve => {
+            recorder.onstop = () => recordChain.then(() => {
+                recorder = null;
+                const timer = setTimeout(resolve, 5000); // onay gelmezse beklemeyi bırak
+                // Onay gelmeden bağlantı kapanırsa sunucu kaydı disconnect'te yine paylaşır
+                socket.emit('record_stop', {}, (saved) => {
+                    clearTimeout(timer);
+                    if (saved) recordedUrl = saved.url;
+                    resolve();
+                });
+            });
+            recorder.stop();
+        });
+    }
+
+    async function stopLiveStream() {
+        await stopRecording();
         if (localStream) {
             localStream.getTracks().forEach(track => track.stop());
             localStream = null;
@@ -1191,6 +4645,10 @@ LIVE_STREAM_PAGE_TEMPLATE = """<!DOCTYPE html>
         if (localVideo) localVideo.style.display = 'none';
 
         statusDiv.textContent = 'Yayın durduruldu.';
+        if (recordedUrl) {
+            statusDiv.innerHTML += ' Kayıt paylaşıldı: <a href="' + recordedUrl + '">izle</a>';
+            recordedUrl = null;
+        }
 
         // Sunucuya yayını durdurduğunu bildir (Gerekli değil, disconnect halleder)
         socket.disconnect();
@@ -1215,12 +4673,9 @@ LIVE_STREAM_PAGE_TEMPLATE = """<!DOCTYPE html>
             const offer = await pc.createOffer();
             await pc.setLocalDescription(offer);
 
-            socket.emit('webrtc_signal', {
-                target_sid: viewerSid,
-                signal: {
-                    type: 'offer',
-                    sdp: pc.localDescription.sdp
-                }
+            sendSignal(viewerSid, {
+                type: 'offer',
+                sdp: pc.localDescription.sdp
             });
         } catch (e) {
             console.error("Offer oluşturulamadı:", e);
@@ -1228,7 +4683,7 @@ LIVE_STREAM_PAGE_TEMPLATE = """<!DOCTYPE html>
     });
 
     // Sinyalleşme Verilerini Yönetme (Answer, ICE Candidate)
-    socket.on('webrtc_signal', async (data) => {
+    async function handleSignal(data) {
         const signal = data.signal;
         const senderSid = data.sender_sid;
 
@@ -1243,7 +4698,7 @@ LIVE_STREAM_PAGE_TEMPLATE = """<!DOCTYPE html>
                 await peerConnections[senderSid].addIceCandidate(new RTCIceCandidate(signal.candidate));
             } catch (e) { console.warn("Add ICE candidate failed:", e); }
         }
-    });
+    }
 
     // PeerConnection Oluşturma Fonksiyonu
     function createPeerConnection(targetSid) {
@@ -1254,12 +4709,9 @@ LIVE_STREAM_PAGE_TEMPLATE = """<!DOCTYPE html>
         // Kendi ICE Candidate'lerimizi izleyiciye gönder
         pc.onicecandidate = (event) => {
             if (event.candidate) {
-                socket.emit('webrtc_signal', {
-                    target_sid: targetSid,
-                    signal: {
-                        type: 'candidate',
-                        candidate: event.candidate
-                    }
+                sendSignal(targetSid, {
+                    type: 'candidate',
+                    candidate: event.candidate
                 });
             }
         };
@@ -1306,6 +4758,7 @@ LIVE_VIEWER_PAGE_TEMPLATE = """<!DOCTYPE html>
   <p><a href="/">Ana Sayfaya Dön</a></p>
   <video id="remoteVideo" autoplay controls></video>
   <p id="status">Yayına bağlanılıyor...</p>
+  <p id="viewerCount"></p>
 
 <script>
     // -------------------- JAVASCRIPT / WEBRTC İZLEYİCİ BAŞLANGIÇ --------------------
@@ -1316,12 +4769,71 @@ LIVE_VIEWER_PAGE_TEMPLATE = """<!DOCTYPE html>
     const viewerUser = "{{ viewer_user or 'viewer' }}";
 
     let peerConnection = null;
-    let streamerSid = null; // Yayıncının socket ID'si
+    let upstreamSid = null; // Yayını bize gönderen (yayıncı ya da aktarıcı izleyici) socket ID'si
+    let upstreamStream = null; // Aktarım için elimizdeki yayın
     let isConnected = false;
+    let relayPeers = {}; // Bizden yayını alan alt izleyiciler için PeerConnection objeleri
+    let pendingChildren = []; // Yayın gelmeden atanan alt izleyiciler
+
+    // Sinyal protokolü v2: ICE adaylarını hedef başına kısa bir pencerede topla,
+    // SDP'yi (offer/answer) bekleyen adaylarla birlikte hemen gönder
+    const SIGNAL_BATCH_MS = 40;
+    let signalOutbox = {};
+    let signalChain = Promise.resolve(); // Gelen sinyaller sırayla işlenir
+
+    function sendSignal(targetSid, signal) {
+        let box = signalOutbox[targetSid];
+        if (!box) {
+            box = signalOutbox[targetSid] = [];
+            if (signal.type === 'candidate') setTimeout(() => flushSignals(targetSid), SIGNAL_BATCH_MS);
+        }
+        box.push(signal);
+        if (signal.type !== 'candidate') flushSignals(targetSid);
+    }
+
+    function flushSignals(targetSid) {
+        const signals = signalOutbox[targetSid];
+        delete signalOutbox[targetSid];
+        if (signals && signals.length) socket.emit('webrtc_signal_batch', { target_sid: targetSid, signals: signals });
+    }
+
+    function queueSignals(senderSid, signals) {
+        signals.forEach(signal => {
+            signalChain = signalChain.then(() => handleSignal({ signal: signal, sender_sid: senderSid }))
+                .catch(e => console.warn("Sinyal işlenemedi:", e));
+        });
+    }
+
+    socket.on('webrtc_signal', (data) => queueSignals(data.sender_sid, [data.signal]));
+    socket.on('webrtc_signal_batch', (data) => queueSignals(data.sender_sid, data.signals));
+
+    // Sunucu izleyici sayısını değiştikçe (en fazla birkaç saniyede bir) iter
+    socket.on('viewer_count', (data) => {
+        document.getElementById('viewerCount').textContent = '👁 ' + data.viewers + ' izleyici';
+    });
+
+    // Kaç izleyiciye yayın aktarabileceğimizi kabaca tahmin et (sunucu üst sınırı uygular)
+    function relayCapacity() {
+        const conn = navigator.connection || {};
+        if (conn.saveData || /Mobi|Android/i.test(navigator.userAgent)) return 0;
+        const downlink = conn.downlink || 5; // Mbps
+        const cores = navigator.hardwareConcurrency || 2;
+        return Math.max(0, Math.min(3, Math.floor(downlink / 5), Math.floor(cores / 2)));
+    }
+
+    function joinRoom() {
+        socket.emit('join_live_room', { username: viewerUser, streamer: streamerUser, role: 'viewer', capacity: relayCapacity(), proto: 2 });
+    }
 
     // 1. Odaya Katıl
-    socket.on('connect', () => {
-        socket.emit('join_live_room', { username: viewerUser, streamer: streamerUser });
+    socket.on('connect', joinRoom);
+
+    // Katılma kısıldı (kendi ya da odanın kovası boş): söylenen süre + rastgele pay kadar bekle
+    socket.on('rate_limited', (data) => {
+        if (data.group === 'join' && data.retry_after !== null) {
+            statusDiv.textContent = 'Yayın yoğun, tekrar bağlanılıyor...';
+            setTimeout(joinRoom, data.retry_after * 1000 + Math.random() * 1000);
+        }
     });
 
     // 2. PeerConnection Oluşturma Fonksiyonu
@@ -1341,24 +4853,23 @@ LIVE_VIEWER_PAGE_TEMPLATE = """<!DOCTYPE html>
 
         pc.oniceconnectionstatechange = () => {
              console.log("ICE state:", pc.iceConnectionState);
-             if (pc.iceConnectionState === 'failed' || pc.iceConnectionState === 'disconnected') {
+             if (pc.iceConnectionState === 'connected' || pc.iceConnectionState === 'completed') {
+                 // Tüm track'ler geldi: alt izleyicilere aktarmaya başla
+                 setUpstreamStream(remoteVideo.srcObject);
+             } else if (pc.iceConnectionState === 'failed' || pc.iceConnectionState === 'disconnected') {
                  statusDiv.textContent = 'Bağlantı kesildi. Tekrar deneniyor...';
                  // Tekrar bağlanmayı dene
-                 setTimeout(() => socket.emit('join_live_room', { username: viewerUser, streamer: streamerUser }), 3000);
+                 setTimeout(joinRoom, 3000);
              }
         };
 
 
-        // Kendi ICE Candidate'lerimizi yayıncıya gönder
+        // Kendi ICE Candidate'lerimizi yukarıdaki eşe gönder
         pc.onicecandidate = (event) => {
-            if (event.candidate && streamerSid) {
-                // Sinyali yayıncıya geri gönder
-                socket.emit('webrtc_signal', {
-                    target_sid: streamerSid, // Yayıncının Socket ID'si
-                    signal: {
-                        type: 'candidate',
-                        candidate: event.candidate
-                    }
+            if (event.candidate && upstreamSid) {
+                sendSignal(upstreamSid, {
+                    type: 'candidate',
+                    candidate: event.candidate
                 });
             }
         };
@@ -1366,13 +4877,76 @@ LIVE_VIEWER_PAGE_TEMPLATE = """<!DOCTYPE html>
         return pc;
     }
 
+    // Yayın (yeniden) geldiğinde bekleyen çocuklara başla, mevcutların track'lerini değiştir
+    function setUpstreamStream(stream) {
+        if (!stream) return;
+        const changed = upstreamStream !== stream;
+        upstreamStream = stream;
+        if (changed) {
+            for (const sid in relayPeers) {
+                relayPeers[sid].getSenders().forEach(sender => {
+                    const track = sender.track && stream.getTracks().find(t => t.kind === sender.track.kind);
+                    if (track) sender.replaceTrack(track);
+                });
+            }
+        }
+        pendingChildren.splice(0).forEach(startRelay);
+    }
+
+    // Alt izleyiciye yayını aktar (yayıncı sayfasındaki new_viewer akışının aynısı)
+    async function startRelay(childSid) {
+        if (relayPeers[childSid]) relayPeers[childSid].close();
+        const pc = new RTCPeerConnection({
+            iceServers: [ { urls: 'stun:stun.l.google.com:19302' } ]
+        });
+        relayPeers[childSid] = pc;
+        pc.onicecandidate = (event) => {
+            if (event.candidate) {
+                sendSignal(childSid, { type: 'candidate', candidate: event.candidate });
+            }
+        };
+        upstreamStream.getTracks().forEach(track => pc.addTrack(track, upstreamStream));
+        try {
+            const offer = await pc.createOffer();
+            await pc.setLocalDescription(offer);
+            sendSignal(childSid, { type: 'offer', sdp: pc.localDescription.sdp });
+        } catch (e) {
+            console.error("Aktarım teklifi oluşturulamadı:", e);
+        }
+    }
+
+    // Sunucu bizi bir alt izleyicinin ebeveyni yaptı
+    socket.on('new_viewer', (data) => {
+        if (upstreamStream) startRelay(data.viewer_id);
+        else pendingChildren.push(data.viewer_id);
+    });
+
+    socket.on('viewer_left', (data) => {
+        const childSid = data.viewer_id;
+        pendingChildren = pendingChildren.filter(sid => sid !== childSid);
+        if (relayPeers[childSid]) {
+            relayPeers[childSid].close();
+            delete relayPeers[childSid];
+        }
+    });
+
+    socket.on('stream_full', () => {
+        statusDiv.textContent = 'Yayın şu an dolu. Biraz sonra tekrar deneyin.';
+    });
+
     // 3. Sinyalleşme Verilerini Yönetme (Offer, Answer, ICE Candidate)
-    socket.on('webrtc_signal', async (data) => {
+    async function handleSignal(data) {
         const signal = data.signal;
+        const senderSid = data.sender_sid;
 
         if (signal.type === 'offer') {
-            // Yayıncıdan Offer (Teklif) geldi.
-            streamerSid = data.sender_sid; // Yayıncının Socket ID'sini kaydet
+            // Yukarıdaki eşten (yayıncı ya da aktarıcı) Offer geldi. Ağaç onarıldıysa
+            // gönderen değişmiştir: eski bağlantıyı kapatıp yenisini kur.
+            if (peerConnection && upstreamSid !== senderSid) {
+                peerConnection.close();
+                peerConnection = null;
+            }
+            upstreamSid = senderSid;
 
             if (!peerConnection) {
                 peerConnection = createPeerConnection();
@@ -1381,16 +4955,13 @@ LIVE_VIEWER_PAGE_TEMPLATE = """<!DOCTYPE html>
             try {
                 await peerConnection.setRemoteDescription(new RTCSessionDescription(signal));
 
-                // Answer oluştur ve yayıncıya gönder
+                // Answer oluştur ve gönderene yolla
                 const answer = await peerConnection.createAnswer();
                 await peerConnection.setLocalDescription(answer);
 
-                socket.emit('webrtc_signal', {
-                    target_sid: streamerSid,
-                    signal: {
-                        type: 'answer',
-                        sdp: peerConnection.localDescription.sdp
-                    }
+                sendSignal(upstreamSid, {
+                    type: 'answer',
+                    sdp: peerConnection.localDescription.sdp
                 });
                 statusDiv.textContent = 'Bağlantı kuruluyor...';
             } catch (e) {
@@ -1398,13 +4969,19 @@ LIVE_VIEWER_PAGE_TEMPLATE = """<!DOCTYPE html>
                 statusDiv.textContent = 'Bağlantı hatası oluştu.';
             }
 
-        } else if (signal.type === 'candidate' && peerConnection) {
-            // ICE Candidate geldi, PeerConnection'a ekle
+        } else if (signal.type === 'answer' && relayPeers[senderSid]) {
             try {
-                await peerConnection.addIceCandidate(new RTCIceCandidate(signal.candidate));
+                await relayPeers[senderSid].setRemoteDescription(new RTCSessionDescription(signal));
+            } catch (e) { console.error("Set remote description failed (Answer):", e); }
+        } else if (signal.type === 'candidate') {
+            // ICE Candidate geldi, ilgili PeerConnection'a ekle
+            const pc = senderSid === upstreamSid ? peerConnection : relayPeers[senderSid];
+            if (!pc) return;
+            try {
+                await pc.addIceCandidate(new RTCIceCandidate(signal.candidate));
             } catch (e) { console.warn("Add ICE candidate failed:", e); }
         }
-    });
+    }
 
     // 4. Yayın Durumu
     socket.on('stream_status', (data) => {
@@ -1415,6 +4992,8 @@ LIVE_VIEWER_PAGE_TEMPLATE = """<!DOCTYPE html>
                 peerConnection = null;
                 remoteVideo.srcObject = null;
             }
+            for (const sid in relayPeers) relayPeers[sid].close();
+            relayPeers = {};
              setTimeout(() => window.location.href = '/', 3000);
         }
     });
@@ -1427,24 +5006,123 @@ LIVE_VIEWER_PAGE_TEMPLATE = """<!DOCTYPE html>
 
 
 # -------------------- API (SQLAlchemy'ye Uyarlandı ve Düzeltildi) --------------------
+# Liste uç noktaları: keyset sayfalama (?cursor=&limit=), alan seçimi (?fields=a,b)
+# ve data_version() tabanlı güçlü ETag. Sonraki sayfa Link: rel="next" başlığındadır;
+# gövde eski sürümlerdeki gibi düz bir JSON dizisidir ve parça parça kodlanarak akıtılır.
+API_PAGE = 50
+API_PAGE_MAX = 500
+API_STREAM_CHUNK = 16 * 1024  # bayt; akan JSON gövdesinin yazım parçası
+POST_FIELDS = {"id": Post.id, "user": User.username, "html": Post.html_content, "likes": Post.likes}
+USER_FIELDS = {"username": User.username, "bio": User.bio, "avatar": User.avatar, "privacy": User.privacy}
+
+
+def _fields_arg(allowed):
+    """?fields=a,b -> alan listesi; verilmemişse [], bilinmeyen alan varsa None."""
+    raw = request.args.get("fields", "")
+    fields = [f for f in dict.fromkeys(part.strip() for part in raw.split(",")) if f]
+    return None if any(f not in allowed for f in fields) else fields
+
+
+def _list_etag(*key):
+    return hashlib.blake2b(repr((request.endpoint, data_version()) + key).encode(), digest_size=12).hexdigest()
+
+
+def etag_fresh(etag):
+    """If-None-Match eşleşmesi; sıkıştırma katmanının eklediği '-<kodlama>' sonekini de tanır."""
+    return any(tag in request.if_none_match for tag in [etag] + [f"{etag}-{enc}" for enc in SUPPORTED_ENCODINGS])
+
+
+def stream_json_array(items):
+    """Öğeleri tek bir liste/dize kurmadan JSON dizisi olarak parça parça kodlar."""
+    buf, size = ["["], 1
+    for n, item in enumerate(items):
+        part = ("," if n else "") + json.dumps(item)
+        buf.append(part)
+        size += len(part)
+        if size >= API_STREAM_CHUNK:
+            yield "".join(buf)
+            buf, size = [], 0
+    buf.append("]")
+    yield "".join(buf)
+
+
+def list_response(etag, rows, limit, encode, cursor_of):
+    """limit+1 satırdan sayfa yanıtı: akan JSON gövdesi, ETag ve varsa Link: rel="next"."""
+    more = len(rows) > limit
+    rows = rows[:limit]
+    resp = Response(stream_json_array(encode(row) for row in rows), mimetype="application/json")
+    resp.set_etag(etag)
+    resp.headers["Cache-Control"] = "private, no-cache"
+    if more:
+        args = request.args.to_dict()
+        args["cursor"] = cursor_of(rows[-1])
+        resp.headers["Link"] = f'<{url_for(request.endpoint, **args)}>; rel="next"'
+    return resp
+
+
+def not_modified(etag):
+    resp = Response(status=304)
+    resp.set_etag(etag)
+    resp.headers["Cache-Control"] = "private, no-cache"
+    return resp
+
+
 @app.route("/api/posts")
+@query_budget(3)
 def api_posts():
-    """Tüm görünür gönderileri JSON olarak döndürür."""
+    """Görünür gönderiler, yeniden eskiye; ?cursor=<id>&limit=n&fields=id,user,html,likes&user=<ad>."""
     me_user = get_user_by_username(session.get("user"))
     me_id = me_user.id if me_user else None
-
-    all_posts = Post.query.order_by(Post.id.desc()).all()
-    # Gönderileri filtrele ve to_dict() metodu ile JSON'a uygun hale getir
-    visible_posts = [p.to_dict() for p in all_posts if can_view_posts(p.user_id, me_id)]
-    return jsonify(visible_posts)
+    fields = _fields_arg(POST_FIELDS)
+    if fields is None: return jsonify({"error": "geçersiz alan", "fields": list(POST_FIELDS)}), 400
+    fields = fields or list(POST_FIELDS)
+    cursor = request.args.get("cursor", type=int)
+    limit = min(max(request.args.get("limit", API_PAGE, type=int), 1), API_PAGE_MAX)
+    owner = request.args.get("user")  # tek kullanıcının gönderileri (ör. akıştaki resync kaydı)
+
+    etag = _list_etag(me_id, fields, cursor, limit, owner)
+    if etag_fresh(etag):
+        return not_modified(etag)
+
+    q = db.session.query(Post.id, *(POST_FIELDS[f] for f in fields))
+    if "user" in fields:
+        q = q.join(User, User.id == Post.user_id)
+    q = q.filter(visible_posts_clause(me_id))
+    if owner:
+        q = q.filter(Post.user_id == db.select(User.id).where(User.username == owner).scalar_subquery())
+    if cursor is not None:
+        q = q.filter(Post.id < cursor)
+    rows = q.order_by(Post.id.desc()).limit(limit + 1).all()
+    return list_response(etag, rows, limit, lambda row: dict(zip(fields, row[1:])), lambda row: row[0])
 
 
 @app.route("/api/users")
+@query_budget(2)
 def api_users():
-    """Tüm kullanıcı adlarını JSON olarak döndürür."""
-    users = User.query.with_entities(User.username).all()
-    # Sonuç bir tuple listesi olduğu için [u[0]] ile sadece kullanıcı adlarını al
-    return jsonify([u[0] for u in users])
+    """Kullanıcı adları (id sırasıyla); ?fields=username,bio,avatar,privacy ile nesneler, ?cursor=&limit=."""
+    fields = _fields_arg(USER_FIELDS)
+    if fields is None: return jsonify({"error": "geçersiz alan", "fields": list(USER_FIELDS)}), 400
+    cursor = request.args.get("cursor", type=int)
+    limit = min(max(request.args.get("limit", API_PAGE, type=int), 1), API_PAGE_MAX)
+
+    etag = _list_etag(fields, cursor, limit)
+    if etag_fresh(etag):
+        return not_modified(etag)
+
+    q = db.session.query(User.id, *(USER_FIELDS[f] for f in fields or ["username"]))
+    if cursor is not None:
+        q = q.filter(User.id > cursor)
+    rows = q.order_by(User.id).limit(limit + 1).all()
+
+    def encode(row):
+        if not fields:
+            return row[1]  # eski biçim: düz kullanıcı adı listesi
+        item = dict(zip(fields, row[1:]))
+        if item.get("avatar"):
+            item["avatar"] = f"/avatar/{item['avatar']}"
+        return item
+
+    return list_response(etag, rows, limit, encode, lambda row: row[0])
 
 
 @app.route("/api/comments/<int:post_id>")
@@ -1465,15 +5143,202 @@ def api_comments(post_id):
     return jsonify(comments)
 
 
+BATCH_MAX = 100  # /api/batch isteği başına gönderi id'si ya da kullanıcı adı
+
+
+def _batch_arg(data, key, cast):
+    """JSON gövdesinden liste ya da sorgu dizgisinden virgüllü değer; geçersizler atlanır."""
+    raw = data.get(key) if data else request.args.get(key, "").split(",")
+    values = []
+    for value in raw if isinstance(raw, list) else []:
+        with contextlib.suppress(TypeError, ValueError):
+            value = cast(value)
+            if value != "":
+                values.append(value)
+    return list(dict.fromkeys(values))[:BATCH_MAX]
+
+
+@app.route("/api/batch", methods=["GET", "POST"])
+@query_budget(6)
+def api_batch():
+    """Birden çok gönderiyi (yorumlarıyla) ve kullanıcıyı tek yanıtta döndürür.
+
+    GET ?posts=1,2,3&users=ali,veli ya da POST {"posts": [...], "users": [...]}.
+    Tek gizlilik değerlendirmesi ve IN (...) sorguları: istek boyundan bağımsız sabit sorgu sayısı.
+    """
+    me_user = get_user_by_username(session.get("user"))
+    me_id = me_user.id if me_user else None
+    data = request.get_json(silent=True) if request.method == "POST" else None
+    if data is not None and not isinstance(data, dict):
+        return jsonify({"error": "gövde {\"posts\": [...], \"users\": [...]} biçiminde olmalı"}), 400
+    post_ids = _batch_arg(data, "posts", int)
+    usernames = _batch_arg(data, "users", lambda v: str(v).strip())
+
+    posts, unavailable = {}, []
+    if post_ids:
+        rows = db.session.query(Post.id, Post.user_id, Post.html_content, Post.likes, User.username).join(
+            User, User.id == Post.user_id).filter(Post.id.in_(post_ids)).all()
+        visible = visible_owner_ids(me_id, {row.user_id for row in rows})
+        for row in rows:
+            if row.user_id in visible:
+                posts[row.id] = {"id": row.id, "user": row.username, "html": row.html_content,
+                                 "likes": row.likes, "comments": []}
+        unavailable = [pid for pid in post_ids if pid not in posts]  # yok ya da görme izni yok
+        if posts:
+            for post_id, html, username in db.session.query(Comment.post_id, Comment.html_content, User.username).join(
+                    User, User.id == Comment.user_id).filter(Comment.post_id.in_(list(posts))).order_by(Comment.id):
+                posts[post_id]["comments"].append({"user": username, "html": html})
+
+    users = {}
+    if usernames:
+        live = PRESENCE.live_users()
+        for u in User.query.filter(User.username.in_(usernames)):
+            users[u.username] = {"username": u.username, "bio": u.bio, "avatar": u.get_avatar_path(),
+                                 "privacy": u.privacy, "live": u.username in live}
+
+    return jsonify({
+        "posts": [posts[pid] for pid in post_ids if pid in posts],
+        "users": [users[name] for name in usernames if name in users],
+        "unavailable": {"posts": unavailable, "users": [name for name in usernames if name not in users]},
+    })
+
+
+@app.route("/api/changes")
+@query_budget(6)
+def api_changes():
+    """Artımlı senkronizasyon: ?since=<imleç>&limit=n.
+
+    İlk çekim since=0 ile yapılır; yanıttaki next bir sonraki çağrının imlecidir,
+    more doğruysa hemen devam edilir. reset: imleç bu sunucuda yok, baştan eşitle.
+    Arkadaşlık kayıtları (user, friend) çiftiyle eşlenmeli; satır id'si yeniden kullanılabilir.
+    entity=resync: data.user'ın gönderilerini /api/posts?user= ile yeniden çek (görünürlük değişti).
+    """
+    me_user = get_user_by_username(session.get("user"))
+    me_id = me_user.id if me_user else None
+    since = max(request.args.get("since", 0, type=int), 0)
+    limit = min(max(request.args.get("limit", CHANGES_PAGE, type=int), 1), CHANGES_PAGE_MAX)
+    changes, cursor, more = changes_since(me_id, since, limit)
+    if cursor == since and since > 0:
+        if since > data_version():
+            return jsonify({"changes": [], "next": 0, "more": False, "reset": True})
+    return jsonify({"changes": changes, "next": cursor, "more": more, "reset": False})
+
+
+@app.route("/api/derivatives")
+def api_derivatives():
+    """Görsel türevi kuyruğunun derinliğini ve iş durumlarını döndürür."""
+    return jsonify(DERIVATIVES.status())
+
+
+@app.route("/api/cache_stats")
+def api_cache_stats():
+    """Dosya servis önbelleklerinin doluluk ve sayaçlarını döndürür."""
+    return jsonify({"file_handles": FILE_HANDLES.stats(), "small_assets": SMALL_ASSETS.stats()})
+
+
+@app.route("/api/password_pool")
+def api_password_pool():
+    """Parola havuzu: kuyruk derinliği, reddedilenler, yenilenen özetler ve gecikme yüzdebirlikleri."""
+    return jsonify(PASSWORDS.stats())
+
+
+@app.route("/api/io")
+def api_io():
+    """Eşzamanlılık modu, havuz boyutları/doluluğu ve döngü bekçisinin blok raporları."""
+    pool = db.engine.pool
+    return jsonify({
+        "mode": IO_MODE, "async_mode": socketio.async_mode, "io_threads": IO_THREADS if tpool else 0,
+        "db_pool": {"size": DB_POOL_SIZE, "overflow": DB_POOL_OVERFLOW, "checked_out": pool.checkedout()},
+        "watchdog": WATCHDOG.stats() if WATCHDOG else None,
+    })
+
+
+@app.route("/api/live/signaling")
+def api_live_signaling():
+    """Sinyal birleştirme sayaçları (kaydedilen mesaj sayısı ve hızı)."""
+    return jsonify(SIGNALS.stats())
+
+
+@app.route("/api/notifications/unread")
+@query_budget(2)
+def api_notifications_unread():
+    """Okunmamış bildirim sayısı (sayaç tablosundan, tarama yok)."""
+    me = get_user_by_username(session.get("user"))
+    if not me: return jsonify({"error": "giriş gerekli"}), 401
+    return jsonify({"unread": NOTIFIER.unread(me.id)})
+
+
+@app.route("/api/notifications")
+@query_budget(3)
+def api_notifications():
+    me = get_user_by_username(session.get("user"))
+    if not me: return jsonify({"error": "giriş gerekli"}), 401
+    items = Notification.query.filter_by(user_id=me.id).order_by(Notification.id.desc()).limit(NOTIFY_PAGE).all()
+    return jsonify({"unread": NOTIFIER.unread(me.id), "items": [notification_dict(n) for n in items],
+                    "hub": NOTIFIER.stats()})
+
+
+@app.route("/api/suggestions")
+@query_budget(3)
+def api_suggestions():
+    """Hazır arkadaş önerileri ve hesaplama durumu."""
+    me = get_user_by_username(session.get("user"))
+    if not me: return jsonify({"error": "giriş gerekli"}), 401
+    return jsonify({"suggestions": [{"user": name, "mutual": mutual} for name, mutual in suggestions_for(me.id)],
+                    "engine": SUGGESTIONS.status()})
+
+
+@app.route("/api/live/stats")
+def api_live_stats():
+    """Canlı yayın oda sayaçları ve sinyal gecikme histogramları (?room=live_<kullanıcı>)."""
+    return jsonify(TELEMETRY.stats(request.args.get("room")))
+
+
+@app.route("/api/live/recordings")
+def api_live_recordings():
+    """Süren yayın kayıtları ve kayıt sayaçları."""
+    return jsonify(RECORDER.stats())
+
+
+@app.route("/api/rate_limits")
+def api_rate_limits():
+    """Soket olay sınırları ve kısılan olay sayaçları."""
+    return jsonify(RATE_LIMITER.stats())
+
+
+@app.route("/api/dm_writer")
+def api_dm_writer():
+    """DM yazma kuyruğu durumu."""
+    return jsonify(DM_WRITER.stats())
+
+
+@app.route("/api/media_gc")
+def api_media_gc():
+    """Sahipsiz medya toplayıcısının son geçişini ve toplam geri kazanımı döndürür."""
+    return jsonify(MEDIA_GC.status())
+
+
 # -------------------- ÇALIŞTIR & VERİTABANI BAŞLATMA (Aynı kaldı) --------------------
 
 if __name__ == "__main__":
     port = int(os.environ.get("PORT", 8080))
-    print("Veritabanı başlatılıyor (site.db)...")
 
     # Uygulama bağlamında veritabanını oluştur
     with app.app_context():
+        print(f"Veritabanı başlatılıyor ({db.engine.url})...")  # URL'deki parola maskelenir
         db.create_all()
+        ensure_indexes()
+        backfill_conversations()
+        backfill_changes()
+
+    if MEDIA_GC_INTERVAL > 0:
+        socketio.start_background_task(MEDIA_GC.loop, MEDIA_GC_INTERVAL)
+    if SUGGEST_INTERVAL > 0:
+        socketio.start_background_task(SUGGESTIONS.loop, SUGGEST_INTERVAL)
+    if WATCHDOG is not None:
+        WATCHDOG.start()
+    if CHANGES_COMPACT_INTERVAL > 0:
+        socketio.start_background_task(compact_changes_loop, CHANGES_COMPACT_INTERVAL)
 
     print(f"Çalışıyor: http://0.0.0.0:{port}")
     socketio.run(app, host="0.0.0.0", port=port, debug=False)
\ No newline at end of file
@@ -0,0 +1,40 @@
+"""Tekrarlanabilir performans ölçümü.
+
+    python -m bench.seed --workdir bench_run --users 2000 --seed 1
+    python -m bench.run --workdir bench_run --mode both --out sonuc.json
+    python -m bench.compare eski.json yeni.json
+
+Depo kökünden çalıştırın. Her şey --workdir altında çalışır (site.db, uploads/);
+depodaki instance/site.db'ye dokunulmaz. Aynı --seed ve parametreler aynı veri
+kümesini üretir; çıktı JSON'u commit'ler arasında karşılaştırılabilir.
+"""
+import os
+import sys
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+APP_PATH = os.path.join(REPO_DIR, "appcloud.py")
+
+
+def bench_env(workdir):
+    """Uygulamanın (süreç içi ya da alt süreç) bench dizininde çalışması için ortam."""
+    workdir = os.path.abspath(workdir)
+    return {
+        "DATABASE_URL": f"sqlite:///{os.path.join(workdir, 'site.db')}",
+        "LIVE_STATE_PATH": os.path.join(workdir, "live_state.db"),
+        "METRICS_HEADERS": "1",  # X-SQL-Queries: istek başına sorgu sayısı
+    }
+
+
+def load_app(workdir):
+    """workdir'e geçip appcloud'u bench ortamıyla içe aktarır (yüklemeler workdir/uploads'a gider)."""
+    workdir = os.path.abspath(workdir)
+    os.makedirs(workdir, exist_ok=True)
+    os.environ.update(bench_env(workdir))  # kabuktaki DATABASE_URL vb. workdir dışına yazdırmasın
+    os.chdir(workdir)
+    if REPO_DIR not in sys.path:
+        sys.path.insert(0, REPO_DIR)
+    import appcloud
+    with appcloud.app.app_context():
+        appcloud.db.create_all()
+        appcloud.ensure_indexes()
+    return appcloud
@@ -0,0 +1,75 @@
+"""İki bench.run çıktısını senaryo senaryo karşılaştırır.
+
+    python -m bench.compare eski.json yeni.json --threshold 0.2
+
+p99 süresi ya da istek başına ortalama sorgu sayısı eşikten fazla kötüleşen
+senaryo varsa çıkış kodu 1 olur (CI'da gerileme kapısı olarak kullanılabilir).
+"""
+import argparse
+import json
+import sys
+
+MIN_P99_MS = 1.0  # bunun altındaki süreler gürültü; oransal karşılaştırılmaz
+
+
+def parse_args(argv=None):
+    p = argparse.ArgumentParser(prog="python -m bench.compare", description=__doc__.splitlines()[0])
+    p.add_argument("old")
+    p.add_argument("new")
+    p.add_argument("--threshold", type=float, default=0.2, help="izin verilen göreli kötüleşme (0.2 = %%20)")
+    return p.parse_args(argv)
+
+
+def load(path):
+    with open(path) as f:
+        report = json.load(f)
+    return report, {(r["mode"], r["name"]): r for r in report.get("results", [])}
+
+
+def change(old, new):
+    if old is None or new is None:
+        return None
+    if not old:
+        return 0.0 if not new else float("inf")
+    return (new - old) / old
+
+
+def fmt(old, new):
+    delta = change(old, new)
+    pct = "" if delta is None else f" ({delta:+.0%})"
+    return f"{old} → {new}{pct}"
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    old_report, old = load(args.old)
+    new_report, new = load(args.new)
+    if old_report.get("dataset", {}).get("args") != new_report.get("dataset", {}).get("args"):
+        print("uyarı: veri kümesi parametreleri farklı; sonuçlar doğrudan karşılaştırılamaz", file=sys.stderr)
+
+    regressions = []
+    for key in sorted(set(old) & set(new)):
+        o, n = old[key], new[key]
+        flags = []
+        p99 = change(o["p99_ms"], n["p99_ms"])
+        if p99 is not None and p99 > args.threshold and n["p99_ms"] >= MIN_P99_MS:
+            flags.append("p99")
+        queries = change(o["queries_mean"], n["queries_mean"])
+        if queries is not None and queries > args.threshold:
+            flags.append("sorgu")
+        if n["errors"] > o["errors"]:
+            flags.append("hata")
+        print(f"{key[0]:6} {key[1]:20} rps {fmt(o['rps'], n['rps'])}  p99 {fmt(o['p99_ms'], n['p99_ms'])} ms  "
+              f"sorgu {fmt(o['queries_mean'], n['queries_mean'])}" + (f"  GERİLEME: {','.join(flags)}" if flags else ""))
+        if flags:
+            regressions.append(key)
+    for key in sorted(set(old) ^ set(new)):
+        print(f"{key[0]:6} {key[1]:20} yalnızca {'eski' if key in old else 'yeni'} çıktıda")
+
+    if regressions:
+        print(f"{len(regressions)} senaryoda gerileme (eşik {args.threshold:.0%})", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,441 @@
+"""Senaryo sürücüsü: HTTP uç noktaları, aralıklı /media istekleri ve Socket.IO katıl/sinyal trafiği.
+
+--mode client: Flask test istemcisiyle süreç içinde (ağ yok; uygulamanın kendi maliyeti).
+--mode server: appcloud.py alt süreçte başlatılır, --concurrency iş parçacığı HTTP ile sürer.
+Senaryo başına istek/sn, p50/p90/p99 ve istek başına SQL sayısı (X-SQL-Queries) JSON olarak yazılır.
+"""
+import argparse
+import contextlib
+import http.client
+import json
+import math
+import os
+import platform
+import random
+import socket
+import subprocess
+import sys
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from http.cookies import SimpleCookie
+from urllib.parse import quote, urlencode
+
+from bench import APP_PATH, REPO_DIR, bench_env, load_app
+from bench.seed import BENCH_PASSWORD, MANIFEST, WORDS
+
+# Opsiyonel: sunucu modunda Socket.IO trafiği için python-socketio istemcisi
+# (websocket taşıması websocket-client ister). Yoksa o bölüm atlanır.
+try:
+    import socketio as socketio_client
+except ImportError:
+    socketio_client = None
+
+SERVER_START_TIMEOUT = 30  # sn
+SOCKET_TIMEOUT = 10  # sn
+TIMEOUT_STATUS = 599  # zaman aşımı/bağlantı hatası örneklere bu durumla yazılır
+
+
+def parse_args(argv=None):
+    p = argparse.ArgumentParser(prog="python -m bench.run", description=__doc__.splitlines()[0])
+    p.add_argument("--workdir", default="bench_run", help="bench.seed ile hazırlanmış dizin")
+    p.add_argument("--mode", choices=("client", "server", "both"), default="client")
+    p.add_argument("--scenarios", default="", help="virgüllü senaryo adları (boş = hepsi)")
+    p.add_argument("--requests", type=int, default=200, help="senaryo başına ölçülen istek")
+    p.add_argument("--warmup", type=int, default=5, help="senaryo başına ölçülmeyen ısınma isteği")
+    p.add_argument("--clients", type=int, default=8, help="oturum açan sanal kullanıcı sayısı")
+    p.add_argument("--concurrency", type=int, default=8, help="sunucu modunda eşzamanlı bağlantı")
+    p.add_argument("--viewers", type=int, default=20, help="Socket.IO senaryosunda izleyici sayısı")
+    p.add_argument("--timeout", type=float, default=120, help="sunucu modunda istek başına zaman aşımı (sn)")
+    p.add_argument("--seed", type=int, default=1)
+    p.add_argument("--server-env", action="append", default=[], metavar="AD=DEĞER",
+                   help="sunucu sürecine ek ortam değişkeni (ör. IO_MODE=tpool)")
+    p.add_argument("--out", help="JSON çıktısı (boş = stdout)")
+    return p.parse_args(argv)
+
+
+# -------------------- VERİ KÜMESİ & SENARYOLAR --------------------
+
+class Dataset:
+    """Senaryoların istek üretirken seçtiği adlar ve id'ler (veritabanından bir kez okunur)."""
+
+    def __init__(self, a, clients):
+        with a.app.app_context():
+            db = a.db
+            self.users = [name for (name,) in db.session.query(a.User.username).order_by(a.User.id)]
+            self.post_ids = [pid for (pid,) in db.session.query(a.Post.id).order_by(a.Post.id)]
+            names = dict(db.session.query(a.User.id, a.User.username))
+            peers = {}
+            for low, high in db.session.query(a.Conversation.user_low, a.Conversation.user_high):
+                peers.setdefault(names[low], []).append(names[high])
+                peers.setdefault(names[high], []).append(names[low])
+        if not self.users or not self.post_ids:
+            raise SystemExit("Veri kümesi boş; önce: python -m bench.seed --workdir ...")
+        # En çok konuşması olanlar oturum açar: gelen kutusu ve DM sayfaları boş kalmasın
+        self.logins = sorted(peers, key=lambda u: (-len(peers[u]), u))[:clients] or self.users[:clients]
+        self.peers = {user: sorted(peers.get(user) or self.users[:1]) for user in self.logins}
+        self.media_dir = a.MEDIA_DIR
+        self.media = sorted(f for f in os.listdir(a.MEDIA_DIR) if f.startswith("bench_")) \
+            if os.path.isdir(a.MEDIA_DIR) else []
+        self.media_size = {f: os.path.getsize(os.path.join(a.MEDIA_DIR, f)) for f in self.media}
+
+
+def _range(ds, rng):
+    name = rng.choice(ds.media)
+    start = rng.randrange(max(1, ds.media_size[name] - 65536))
+    return f"/media/{name}", {"Range": f"bytes={start}-{start + 65535}"}
+
+
+# ad -> (rng, ds, oturum açan kullanıcı) -> (yol, başlıklar)
+SCENARIOS = {
+    "feed": lambda rng, ds, user: ("/", {}),
+    "search": lambda rng, ds, user: (f"/search?q={quote(rng.choice(WORDS))}", {}),
+    "find_friend": lambda rng, ds, user: (f"/find_friend?name=user{rng.randrange(max(1, len(ds.users) // 10)):04d}", {}),
+    "inbox": lambda rng, ds, user: ("/inbox", {}),
+    "dm_page": lambda rng, ds, user: (f"/dm/{rng.choice(ds.peers[user])}", {}),
+    "api_dm": lambda rng, ds, user: (f"/api/dm/{rng.choice(ds.peers[user])}", {}),
+    "api_posts": lambda rng, ds, user: ("/api/posts", {}),
+    "api_posts_projected": lambda rng, ds, user: ("/api/posts?fields=id,likes&limit=200", {}),
+    "api_users": lambda rng, ds, user: ("/api/users?limit=200", {}),
+    "api_comments": lambda rng, ds, user: (f"/api/comments/{rng.choice(ds.post_ids)}", {}),
+    "api_batch": lambda rng, ds, user: ("/api/batch?" + urlencode({
+        "posts": ",".join(map(str, rng.sample(ds.post_ids, min(20, len(ds.post_ids))))),
+        "users": ",".join(rng.sample(ds.users, min(5, len(ds.users))))}), {}),
+    "api_changes": lambda rng, ds, user: ("/api/changes?since=0&limit=500", {}),
+    "api_suggestions": lambda rng, ds, user: ("/api/suggestions", {}),
+    "api_notifications": lambda rng, ds, user: ("/api/notifications", {}),
+    "media_range": lambda rng, ds, user: _range(ds, rng),
+}
+
+
+def selected_scenarios(args, ds):
+    names = [n.strip() for n in args.scenarios.split(",") if n.strip()] or list(SCENARIOS)
+    unknown = [n for n in names if n not in SCENARIOS]
+    if unknown:
+        raise SystemExit(f"Bilinmeyen senaryo: {', '.join(unknown)} (seçenekler: {', '.join(SCENARIOS)})")
+    if not ds.media:
+        names = [n for n in names if n != "media_range"]
+    return names
+
+
+def percentile(sorted_values, q):
+    if not sorted_values:
+        return None
+    return round(sorted_values[max(0, math.ceil(q * len(sorted_values)) - 1)], 3)
+
+
+def summarize(mode, name, samples, wall):
+    """samples: [(ms, durum, sorgu sayısı ya da None, gövde baytı)]."""
+    ms = sorted(s[0] for s in samples)
+    queries = [s[2] for s in samples if s[2] is not None]
+    status = Counter(s[1] for s in samples)
+    return {
+        "mode": mode, "name": name, "requests": len(samples),
+        "errors": sum(n for code, n in status.items() if code >= 400),
+        "status": {str(code): n for code, n in sorted(status.items())},
+        "seconds": round(wall, 3), "rps": round(len(samples) / wall, 1) if wall else None,
+        "p50_ms": percentile(ms, 0.5), "p90_ms": percentile(ms, 0.9), "p99_ms": percentile(ms, 0.99),
+        "max_ms": round(ms[-1], 3) if ms else None,
+        "queries_mean": round(sum(queries) / len(queries), 2) if queries else None,
+        "queries_max": max(queries) if queries else None,
+        "bytes_mean": round(sum(s[3] for s in samples) / len(samples)) if samples else None,
+    }
+
+
+def _queries(headers):
+    value = headers.get("X-SQL-Queries")
+    return int(value) if value is not None else None
+
+
+# -------------------- SÜREÇ İÇİ (Flask test istemcisi) --------------------
+
+def run_client(a, ds, args):
+    clients, login = {}, []
+    for user in ds.logins:
+        c = a.app.test_client()
+        started = time.perf_counter()
+        resp = c.post("/login", data={"username": user, "password": BENCH_PASSWORD})
+        login.append(((time.perf_counter() - started) * 1000, resp.status_code, _queries(resp.headers), 0))
+        clients[user] = c
+    results = []
+    for name in selected_scenarios(args, ds):
+        rng = random.Random(f"{args.seed}:{name}")
+        samples, wall = [], 0.0
+        for i in range(args.warmup + args.requests):
+            user = ds.logins[i % len(ds.logins)]
+            path, headers = SCENARIOS[name](rng, ds, user)
+            started = time.perf_counter()
+            resp = clients[user].get(path, headers=headers)
+            body = resp.get_data()  # akan yanıtlar da sonuna dek tüketilsin
+            elapsed = time.perf_counter() - started
+            if i >= args.warmup:
+                wall += elapsed
+                samples.append((elapsed * 1000, resp.status_code, _queries(resp.headers), len(body)))
+        results.append(summarize("client", name, samples, wall))
+        print(f"[client] {name}: p50 {results[-1]['p50_ms']} ms, p99 {results[-1]['p99_ms']} ms", file=sys.stderr)
+    return results, summarize("client", "login", login, sum(s[0] for s in login) / 1000)
+
+
+def socket_client(a, ds, args):
+    """Bir yayıncı ve --viewers izleyici: katılma ve teklif+aday paketinin iletimi (süreç içi)."""
+    streamer = ds.logins[0]
+    http = a.app.test_client()
+    http.post("/login", data={"username": streamer, "password": BENCH_PASSWORD})
+    s = a.socketio.test_client(a.app, flask_test_client=http)
+    s.emit("join_live_room", {"username": streamer, "streamer": streamer, "role": "streamer",
+                              "proto": 2, "capacity": args.viewers})
+    join_ms, signal_ms, viewers, delivered = [], [], [], 0
+    for i in range(args.viewers):
+        v = a.socketio.test_client(a.app)
+        started = time.perf_counter()
+        v.emit("join_live_room", {"username": f"viewer{i}", "streamer": streamer, "role": "viewer", "proto": 2})
+        got = [e for e in s.get_received() if e["name"] == "new_viewer"]
+        join_ms.append((time.perf_counter() - started) * 1000)
+        if got:
+            viewers.append((v, got[-1]["args"][0]["viewer_id"]))
+    for v, sid in viewers:
+        started = time.perf_counter()
+        s.emit("webrtc_signal_batch", {"target_sid": sid, "signals": signal_batch(sid)})
+        received = [e for e in v.get_received() if e["name"] == "webrtc_signal_batch"]
+        signal_ms.append((time.perf_counter() - started) * 1000)
+        delivered += sum(len(e["args"][0]["signals"]) for e in received)
+    for v, _ in viewers:
+        v.disconnect()
+    s.disconnect()
+    return socket_summary(args.viewers, len(viewers), join_ms, signal_ms, delivered)
+
+
+def signal_batch(sid):
+    offer = {"type": "offer", "sdp": "v=0\r\n" + "a=bench\r\n" * 40}
+    candidates = [{"type": "candidate", "candidate": {"candidate": f"candidate:{n} 1 udp 2122 10.0.0.{n} 5000{n} typ host",
+                                                      "sdpMid": "0", "sdpMLineIndex": 0}} for n in range(4)]
+    return [offer] + candidates
+
+
+def socket_summary(viewers, joined, join_ms, signal_ms, delivered):
+    join_ms, signal_ms = sorted(join_ms), sorted(signal_ms)
+    return {"viewers": viewers, "joined": joined, "signals_sent": joined * 5, "signals_delivered": delivered,
+            "join_p50_ms": percentile(join_ms, 0.5), "join_p99_ms": percentile(join_ms, 0.99),
+            "signal_p50_ms": percentile(signal_ms, 0.5), "signal_p99_ms": percentile(signal_ms, 0.99)}
+
+
+# -------------------- YEREL SUNUCU (HTTP) --------------------
+
+class HttpClient:
+    """Kalıcı bağlantılı küçük HTTP istemcisi; oturum çerezini taşır."""
+
+    def __init__(self, port, timeout=SOCKET_TIMEOUT):
+        self.port = port
+        self.conn = http.client.HTTPConnection("127.0.0.1", port, timeout=timeout)
+        self.cookies = SimpleCookie()
+
+    @property
+    def cookie_header(self):
+        return "; ".join(f"{k}={m.value}" for k, m in self.cookies.items())
+
+    def request(self, method, path, body=None, headers=None):
+        headers = dict(headers or {})
+        if self.cookies:
+            headers["Cookie"] = self.cookie_header
+        for attempt in (1, 2):
+            try:
+                self.conn.request(method, path, body=body, headers=headers)
+                resp = self.conn.getresponse()
+                data = resp.read()
+                break
+            except (ConnectionError, http.client.HTTPException):
+                self.conn.close()  # sunucu keep-alive bağlantısını kapattıysa bir kez yeniden dene
+                if attempt == 2:
+                    raise
+        for value in resp.headers.get_all("Set-Cookie") or ():
+            self.cookies.load(value)
+        return resp.status, resp.headers, data
+
+    def login(self, user):
+        body = urlencode({"username": user, "password": BENCH_PASSWORD})
+        return self.request("POST", "/login", body, {"Content-Type": "application/x-www-form-urlencoded"})
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_server(workdir, extra_env):
+    port = free_port()
+    env = dict(os.environ, **bench_env(workdir), PORT=str(port))
+    for item in extra_env:
+        key, _, value = item.partition("=")
+        env[key] = value
+    log = open(os.path.join(workdir, "server.log"), "w")
+    proc = subprocess.Popen([sys.executable, APP_PATH], cwd=workdir, env=env, stdout=log, stderr=subprocess.STDOUT)
+    deadline = time.time() + SERVER_START_TIMEOUT
+    while time.time() < deadline:
+        if proc.poll() is not None:
+            break
+        with socket.socket() as s:
+            if s.connect_ex(("127.0.0.1", port)) == 0:
+                return proc, port
+        time.sleep(0.1)
+    proc.kill()
+    raise SystemExit(f"Sunucu başlamadı; ayrıntı: {os.path.join(workdir, 'server.log')}")
+
+
+def run_server(port, ds, args):
+    results, login = [], []
+    pool = ThreadPoolExecutor(max_workers=args.concurrency)
+    clients = []
+    for w in range(args.concurrency):
+        c = HttpClient(port, args.timeout)
+        started = time.perf_counter()
+        status, headers, _ = c.login(ds.logins[w % len(ds.logins)])
+        login.append(((time.perf_counter() - started) * 1000, status, _queries(headers), 0))
+        clients.append((c, ds.logins[w % len(ds.logins)]))
+    for name in selected_scenarios(args, ds):
+        per_worker = [args.requests // args.concurrency + (1 if w < args.requests % args.concurrency else 0)
+                      for w in range(args.concurrency)]
+
+        def work(w, count, measure=True):
+            c, user = clients[w]
+            rng = random.Random(f"{args.seed}:{name}:{w}:{measure}")
+            out = []
+            for _ in range(count):
+                path, headers = SCENARIOS[name](rng, ds, user)
+                started = time.perf_counter()
+                try:
+                    status, resp_headers, body = c.request("GET", path, headers=headers)
+                except (OSError, http.client.HTTPException):
+                    c.conn.close()
+                    status, resp_headers, body = TIMEOUT_STATUS, {}, b""
+                out.append(((time.perf_counter() - started) * 1000, status, _queries(resp_headers), len(body)))
+            return out
+
+        list(pool.map(lambda w: work(w, args.warmup, False), range(args.concurrency)))
+        started = time.perf_counter()
+        samples = [s for part in pool.map(lambda w: work(w, per_worker[w]), range(args.concurrency)) for s in part]
+        results.append(summarize("server", name, samples, time.perf_counter() - started))
+        print(f"[server] {name}: {results[-1]['rps']} istek/sn, p99 {results[-1]['p99_ms']} ms", file=sys.stderr)
+    pool.shutdown()
+    return results, summarize("server", "login", login, sum(s[0] for s in login) / 1000)
+
+
+def socket_server(port, ds, args):
+    """socket_client'ın aynısı, gerçek websocket bağlantılarıyla."""
+    if socketio_client is None or not hasattr(socketio_client, "Client"):
+        return {"skipped": "python-socketio istemcisi yok"}
+    streamer = ds.logins[0]
+    http = HttpClient(port)
+    http.login(streamer)
+    url = f"http://127.0.0.1:{port}"
+    lock = threading.Lock()
+    new_viewer_at, received_at, delivered = {}, {}, Counter()
+    opened = []
+    try:
+        s = socketio_client.Client(reconnection=False)
+        s.on("new_viewer", lambda data: new_viewer_at.setdefault(data["viewer_id"], time.perf_counter()))
+        s.connect(url, headers={"Cookie": http.cookie_header}, transports=["websocket"], wait_timeout=SOCKET_TIMEOUT)
+        opened.append(s)
+        s.call("join_live_room", {"username": streamer, "streamer": streamer, "role": "streamer",
+                                  "proto": 2, "capacity": args.viewers}, timeout=SOCKET_TIMEOUT)
+        joined_at = {}
+        for i in range(args.viewers):
+            v = socketio_client.Client(reconnection=False)
+
+            def on_batch(data, v=v):
+                with lock:
+                    received_at.setdefault(v.get_sid(), time.perf_counter())
+                    delivered[v.get_sid()] += len(data.get("signals") or ())
+
+            v.on("webrtc_signal_batch", on_batch)
+            v.connect(url, transports=["websocket"], wait_timeout=SOCKET_TIMEOUT)
+            opened.append(v)
+            joined_at[v.get_sid()] = time.perf_counter()
+            v.emit("join_live_room", {"username": f"viewer{i}", "streamer": streamer, "role": "viewer", "proto": 2})
+        wait_until(lambda: len(new_viewer_at) >= len(joined_at))
+        sent_at = {}
+        for sid in joined_at:
+            if sid in new_viewer_at:
+                sent_at[sid] = time.perf_counter()
+                s.emit("webrtc_signal_batch", {"target_sid": sid, "signals": signal_batch(sid)})
+        wait_until(lambda: len(received_at) >= len(sent_at))
+    except Exception as e:  # websocket-client eksik, bağlantı reddi vb.
+        return {"skipped": f"{type(e).__name__}: {e}"}
+    finally:
+        for client in opened:
+            client.disconnect()
+    join_ms = [(new_viewer_at[sid] - t) * 1000 for sid, t in joined_at.items() if sid in new_viewer_at]
+    signal_ms = [(received_at[sid] - t) * 1000 for sid, t in sent_at.items() if sid in received_at]
+    return socket_summary(args.viewers, len(join_ms), join_ms, signal_ms, sum(delivered.values()))
+
+
+def wait_until(done, timeout=SOCKET_TIMEOUT):
+    deadline = time.time() + timeout
+    while not done() and time.time() < deadline:
+        time.sleep(0.01)
+
+
+# -------------------- ÇIKTI --------------------
+
+def git_revision():
+    try:
+        rev = subprocess.run(["git", "rev-parse", "HEAD"], cwd=REPO_DIR, capture_output=True, text=True).stdout.strip()
+        dirty = subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], cwd=REPO_DIR,
+                               capture_output=True, text=True).stdout.strip()
+    except OSError:
+        return None
+    return {"commit": rev or None, "dirty": bool(dirty)}
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.out:
+        args.out = os.path.abspath(args.out)  # load_app() workdir'e geçer; göreli yol oraya düşmesin
+    with contextlib.redirect_stdout(sys.stderr):  # uygulamanın print'leri JSON çıktısına karışmasın
+        report = run(args)
+    text = json.dumps(report, indent=2, ensure_ascii=False)
+    if args.out:
+        with open(args.out, "w") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+
+
+def run(args):
+    workdir = os.path.abspath(args.workdir)
+    manifest_path = os.path.join(workdir, MANIFEST)
+    if not os.path.exists(manifest_path):
+        raise SystemExit(f"{manifest_path} yok; önce: python -m bench.seed --workdir {args.workdir}")
+    with open(manifest_path) as f:
+        manifest = json.load(f)
+    a = load_app(workdir)
+    ds = Dataset(a, args.clients)
+
+    report = {
+        "meta": {"git": git_revision(), "python": platform.python_version(), "platform": platform.platform(),
+                 "cpus": os.cpu_count(), "started_at": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+                 "args": {k: v for k, v in vars(args).items() if k not in ("workdir", "out")}},
+        "dataset": manifest,
+        "results": [], "login": [], "socketio": {},
+    }
+    if args.mode in ("client", "both"):
+        results, login = run_client(a, ds, args)
+        report["results"] += results
+        report["login"].append(login)
+        report["socketio"]["client"] = socket_client(a, ds, args)
+    if args.mode in ("server", "both"):
+        proc, port = start_server(workdir, args.server_env)
+        try:
+            results, login = run_server(port, ds, args)
+            report["results"] += results
+            report["login"].append(login)
+            report["socketio"]["server"] = socket_server(port, ds, args)
+        finally:
+            proc.terminate()
+            proc.wait(timeout=10)
+    return report
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,170 @@
+"""Sentetik sosyal ağ üretici: kullanıcılar, arkadaşlık grafiği, gönderiler, yorumlar, DM'ler ve medya.
+
+Dağılımlar sabit --seed ile belirlenir; aynı parametreler aynı veritabanını üretir.
+Birkaç "popüler" kullanıcı (küçük id'ler) daha çok arkadaş, gönderi ve yorum alır.
+Satırlar toplu INSERT ile yazılır (eşleyici olayları atlanır); değişiklik akışı
+kayıtlarını sonda uygulamanın backfill_changes() işlevi üretir.
+"""
+import argparse
+import json
+import os
+import random
+import shutil
+import time
+
+from bench import load_app
+
+BENCH_PASSWORD = "bench"
+MANIFEST = "bench_manifest.json"
+WORDS = ("merhaba", "kahve", "deniz", "konser", "maç", "kitap", "film", "yağmur", "tatil", "proje",
+         "kod", "müzik", "yemek", "spor", "sınav", "gece", "sabah", "yol", "şehir", "oyun")
+CHUNK = 5000  # INSERT başına satır
+
+
+def parse_args(argv=None):
+    p = argparse.ArgumentParser(prog="python -m bench.seed", description=__doc__.splitlines()[0])
+    p.add_argument("--workdir", default="bench_run", help="site.db ve uploads/ buraya yazılır")
+    p.add_argument("--seed", type=int, default=1)
+    p.add_argument("--users", type=int, default=1000)
+    p.add_argument("--friends", type=float, default=20, help="kullanıcı başına ortalama kabul edilmiş arkadaş")
+    p.add_argument("--pending", type=float, default=0.1, help="bekleyen isteklerin arkadaşlıklara oranı")
+    p.add_argument("--public", type=float, default=0.5, help="herkese açık profillerin oranı")
+    p.add_argument("--posts", type=float, default=5, help="kullanıcı başına ortalama gönderi")
+    p.add_argument("--comments", type=float, default=2, help="gönderi başına ortalama yorum")
+    p.add_argument("--conversations", type=float, default=3, help="kullanıcı başına ortalama DM konuşması")
+    p.add_argument("--dms", type=int, default=20, help="konuşma başına mesaj")
+    p.add_argument("--media", type=int, default=50, help="gönderilere eklenen medya dosyası sayısı")
+    p.add_argument("--media-kb", type=int, default=512, help="medya dosyası boyu (KiB)")
+    p.add_argument("--fresh", action="store_true", help="workdir'deki eski site.db ve uploads/ silinir")
+    return p.parse_args(argv)
+
+
+def skewed(rng, n):
+    """[0, n) aralığında küçük değerlere yığılan indeks (popüler kullanıcılar/gönderiler)."""
+    return int(n * rng.random() ** 2)
+
+
+def text(rng, words=8):
+    return " ".join(rng.choice(WORDS) for _ in range(rng.randint(2, words)))
+
+
+def insert(a, model, rows):
+    for start in range(0, len(rows), CHUNK):
+        a.db.session.execute(a.db.insert(model), rows[start:start + CHUNK])
+
+
+def build_graph(rng, args):
+    """(kabul edilmiş kenarlar, bekleyen istekler); yönlü (gönderen, alan) çiftleri, 1 tabanlı id."""
+    n = args.users
+    pairs = set()
+
+    def draw(count, pick_v):
+        out = []
+        for _ in range(count * 20):  # küçük grafiklerde istenen yoğunluğa ulaşılamayabilir
+            if len(out) >= count:
+                break
+            u, v = rng.randrange(n) + 1, pick_v() + 1
+            key = (min(u, v), max(u, v))
+            if u != v and key not in pairs:
+                pairs.add(key)
+                out.append((u, v) if rng.random() < 0.5 else (v, u))
+        return out
+
+    edges = draw(int(n * args.friends / 2), lambda: skewed(rng, n))
+    pending = draw(int(len(edges) * args.pending), lambda: rng.randrange(n))
+    return edges, pending
+
+
+def seed(args):
+    workdir = os.path.abspath(args.workdir)
+    if args.fresh:
+        for name in ("site.db", "site.db-wal", "site.db-shm", "live_state.db", MANIFEST):
+            path = os.path.join(workdir, name)
+            if os.path.exists(path):
+                os.remove(path)
+        shutil.rmtree(os.path.join(workdir, "uploads"), ignore_errors=True)
+    a = load_app(workdir)
+    rng = random.Random(args.seed)
+    started = time.time()
+    counts = {}
+
+    with a.app.app_context():
+        if a.User.query.first() is not None:
+            raise SystemExit(f"{workdir} içindeki veritabanı boş değil; --fresh ile yeniden üretin.")
+        # Tek özet herkes için: binlerce scrypt hesabı tohumlamayı dakikalarca sürdürürdü
+        password_hash = a.generate_password_hash(BENCH_PASSWORD, a.PASSWORD_METHOD)
+        users = [{"id": i + 1, "username": f"user{i:05d}", "password_hash": password_hash,
+                  "bio": text(rng, 5), "avatar": None,
+                  "privacy": "public" if rng.random() < args.public else "friends"} for i in range(args.users)]
+        insert(a, a.User, users)
+        counts["users"] = len(users)
+
+        edges, pending = build_graph(rng, args)
+        friendships = [{"id": i + 1, "user_id": u, "friend_id": v, "status": "accepted"} for i, (u, v) in enumerate(edges)]
+        friendships += [{"id": len(edges) + i + 1, "user_id": u, "friend_id": v, "status": "pending"}
+                        for i, (u, v) in enumerate(pending)]
+        insert(a, a.Friendship, friendships)
+        counts.update(friendships=len(edges), pending_requests=len(pending))
+
+        media_dir = a.MEDIA_DIR
+        os.makedirs(media_dir, exist_ok=True)
+        media = []
+        for i in range(args.media):
+            name = f"bench_{i:04d}.mp4"
+            with open(os.path.join(media_dir, name), "wb") as f:
+                f.write(rng.randbytes(args.media_kb * 1024))
+            media.append(name)
+        counts["media_files"] = len(media)
+
+        posts = []
+        for i in range(int(args.users * args.posts)):
+            html = text(rng, 20)
+            if i < len(media):
+                html += f"<br><video controls preload='metadata' src='/media/{media[i]}'></video>"
+            posts.append({"id": i + 1, "user_id": skewed(rng, args.users) + 1, "html_content": html,
+                          "likes": int(rng.expovariate(0.2))})
+        rng.shuffle(posts)  # medyalı gönderiler akışın her yerine dağılsın
+        for i, post in enumerate(posts):
+            post["id"] = i + 1
+        insert(a, a.Post, posts)
+        counts["posts"] = len(posts)
+
+        comments = []
+        for i in range(int(len(posts) * args.comments)):
+            post = posts[skewed(rng, len(posts))] if posts else None
+            if post is None:
+                break
+            comments.append({"id": i + 1, "post_id": post["id"], "user_id": rng.randrange(args.users) + 1,
+                             "html_content": text(rng, 10)})
+        insert(a, a.Comment, comments)
+        counts["comments"] = len(comments)
+
+        # DM'ler çoğunlukla arkadaşlar arasında
+        conversations = rng.sample(edges, min(len(edges), int(args.users * args.conversations / 2)))
+        messages = []
+        for u, v in conversations:
+            for _ in range(args.dms):
+                sender, recipient = (u, v) if rng.random() < 0.5 else (v, u)
+                messages.append({"from_user_id": sender, "to_user_id": recipient, "html_content": text(rng, 12)})
+        insert(a, a.DirectMessage, messages)
+        counts.update(conversations=len(conversations), direct_messages=len(messages))
+
+        a.db.session.commit()
+        a.backfill_changes()
+        a.backfill_conversations()
+        a.SUGGESTIONS.refresh(full=True)
+
+    manifest = {"args": {k: v for k, v in vars(args).items() if k not in ("workdir", "fresh")},
+                "counts": counts, "password": BENCH_PASSWORD, "seconds": round(time.time() - started, 2)}
+    with open(os.path.join(workdir, MANIFEST), "w") as f:
+        json.dump(manifest, f, indent=2)
+    return manifest
+
+
+def main(argv=None):
+    manifest = seed(parse_args(argv))
+    print(json.dumps(manifest, indent=2))
+
+
+if __name__ == "__main__":
+    main()